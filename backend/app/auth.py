@@ -1,12 +1,17 @@
+import hashlib
+import time
+
 import jwt
 from datetime import datetime, timedelta
-from fastapi import HTTPException, Depends
+from fastapi import HTTPException, Depends, Request
 from app.database import SessionLocal
 from passlib.context import CryptContext
 from dotenv import load_dotenv
 import os
 
 from app.models import User
+from app.utils.cache import TTLCache
+from app.utils.workpool import BoundedWorkPool
 
 load_dotenv()
 
@@ -14,9 +19,19 @@ load_dotenv()
 SECRET_KEY = os.getenv('SECRET_KEY')
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+# Verified token payloads kept so reconnects skip the signature check; 0 disables the cache
+JWT_CACHE_SIZE = int(os.getenv("JWT_CACHE_SIZE", "10000"))
+JWT_CACHE_TTL = float(os.getenv("JWT_CACHE_TTL", "300"))
+
+# Password hashing; hashes made with a different cost are upgraded on the next login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
 
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Dedicated pool for bcrypt, so login bursts neither block the event loop nor the default threadpool
+AUTH_POOL_KIND = os.getenv("AUTH_POOL_KIND", "thread")
+AUTH_POOL_SIZE = int(os.getenv("AUTH_POOL_SIZE", str(min(4, os.cpu_count() or 1))))
+AUTH_POOL_MAX_WAITING = int(os.getenv("AUTH_POOL_MAX_WAITING", "64"))
+auth_pool = BoundedWorkPool(AUTH_POOL_SIZE, AUTH_POOL_MAX_WAITING, kind=AUTH_POOL_KIND, name="auth")
 
 
 def hash_password(password: str) -> str:
@@ -27,6 +42,11 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
 
+def verify_and_update_password(plain_password: str, hashed_password: str):
+    """(valid, new_hash); new_hash is set when the stored hash uses outdated parameters."""
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+
 def create_refresh_token(data: dict, expires_delta: timedelta = timedelta(days=7)):
     to_encode = data.copy()
     expire = datetime.utcnow() + expires_delta
@@ -42,14 +62,75 @@ def create_access_token(data: dict):
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 
+# Payload and expiry of verified tokens, by sha256 digest of the token
+verified_tokens = TTLCache(JWT_CACHE_SIZE, JWT_CACHE_TTL)
+# Digests of revoked tokens and when each would have expired anyway
+revoked_tokens: dict = {}
+
+
+def token_digest(token) -> bytes:
+    if isinstance(token, str):
+        token = token.encode("utf-8")
+    return hashlib.sha256(token).digest()
+
+
 def decode_token(token: str):
+    digest = token_digest(token)
+    if digest in revoked_tokens:
+        raise HTTPException(status_code=401, detail="Token has been revoked")
+    cached = verified_tokens.get(digest)
+    if cached is not None:
+        payload, expires_at = cached
+        if expires_at is None or expires_at > time.time():
+            return dict(payload)
+        verified_tokens.pop(digest)
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return payload
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token has expired")
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
+    verified_tokens.set(digest, (payload, payload.get("exp")))
+    return dict(payload)
+
+
+def revocation_for(token: str):
+    """(digest, exp) identifying a token to revoke, or None if it does not verify anyway."""
+    try:
+        payload = decode_token(token)
+    except HTTPException:
+        return None
+    return token_digest(token), payload.get("exp")
+
+
+def apply_revocation(digest: bytes, expires_at):
+    now = time.time()
+    # Forget revocations of tokens that have expired since; they fail verification anyway
+    for expired in [key for key, exp in revoked_tokens.items() if exp is not None and exp <= now]:
+        del revoked_tokens[expired]
+    revoked_tokens[digest] = expires_at
+    verified_tokens.pop(digest)
+
+
+def authenticated_username(request: Request) -> str:
+    """Dependency: the username of the request's access token, else 401.
+
+    The token is read from the access_token cookie, or from an "Authorization: Bearer"
+    header as the frontend sends it. Like the csrf_token of a websocket connection, an
+    X-CSRF-TOKEN header must come along with it.
+    """
+    token = request.cookies.get("access_token")
+    authorization = request.headers.get("Authorization", "")
+    if not token and authorization.startswith("Bearer "):
+        token = authorization[len("Bearer "):]
+    if not token:
+        raise HTTPException(status_code=401, detail="Access token not provided")
+    if not request.headers.get("X-CSRF-TOKEN"):
+        raise HTTPException(status_code=403, detail="CSRF token not provided")
+    username = decode_token(token).get("sub")
+    if not username:
+        raise HTTPException(status_code=401, detail="Invalid access token")
+    return username
 
 
 # Dependency to get DB session
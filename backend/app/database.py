@@ -1,17 +1,78 @@
-from sqlalchemy import create_engine
+import asyncio
+import contextvars
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
+
+from dotenv import load_dotenv
+from sqlalchemy import event, insert
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+
+load_dotenv()
+
+from app.db_profiles import DB_PROFILE, build_engines  # noqa: E402 (reads settings loaded above)
+from app.utils.metrics import current_action, registry  # noqa: E402
+
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./test.db")
+DATABASE_BACKEND = make_url(DATABASE_URL).get_backend_name()
 
-DATABASE_URL = "sqlite:///./test.db"
+# How the websocket hot path talks to the database:
+# "async" uses AsyncSession, "threadpool" runs the blocking Session in worker threads
+DB_EXECUTION_MODE = os.getenv("DB_EXECUTION_MODE", "async")
+DB_THREADPOOL_SIZE = int(os.getenv("DB_THREADPOOL_SIZE", "4"))
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+# Pool sizes and SQLite pragmas come from the DB_PROFILE settings in app.db_profiles
+engine, async_engine = build_engines(DATABASE_URL, DB_PROFILE)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+# Objects stay usable after commit: expiring them would force lazy IO outside the event loop
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+_db_executor = ThreadPoolExecutor(max_workers=DB_THREADPOOL_SIZE, thread_name_prefix="db")
+
+# Query count and time per websocket action ("none" outside of actions, e.g. REST requests).
+# The hooks add microseconds per statement (benchmarks/bench_metrics_overhead.py); METRICS_QUERY_HOOKS=0 drops them
+METRICS_QUERY_HOOKS = os.getenv("METRICS_QUERY_HOOKS", "1") != "0"
+query_duration = registry.histogram("chat_db_query_duration_seconds",
+                                    "Database statement execution time by websocket action", ("action",))
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # The execution context lives for one statement, so a failed statement leaves nothing behind
+    context.query_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    query_duration.labels(current_action.get()).observe(time.perf_counter() - context.query_started)
+
+
+if METRICS_QUERY_HOOKS:
+    for _engine in (engine, async_engine.sync_engine):
+        event.listen(_engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(_engine, "after_cursor_execute", _after_cursor_execute)
+
 
 Base.metadata.create_all(bind=engine)
 
 
+def insert_ignore(table):
+    """INSERT into `table` that skips rows clashing with an existing key instead of failing."""
+    if DATABASE_BACKEND == "sqlite":
+        return sqlite.insert(table).on_conflict_do_nothing()
+    if DATABASE_BACKEND == "postgresql":
+        return postgresql.insert(table).on_conflict_do_nothing()
+    if DATABASE_BACKEND in ("mysql", "mariadb"):
+        return insert(table).prefix_with("IGNORE")
+    raise ValueError(f"No conflict-ignoring insert configured for {DATABASE_BACKEND} databases")
+
+
 def get_db():
     db = SessionLocal()
     try:
@@ -20,6 +81,117 @@ def get_db():
         db.close()
 
 
+class ThreadPoolSession:
+    """Awaitable facade over a blocking Session, used by the "threadpool" execution mode.
+
+    Exposes the subset of the AsyncSession API used by the websocket handlers, and runs
+    every call that may touch the database in a dedicated thread pool so the event loop
+    keeps delivering messages while a query or commit is in flight.
+    """
+
+    def __init__(self, session: Session):
+        self.sync_session = session
+
+    async def _run(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        # Carry the caller's context (e.g. the current action) into the worker thread
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(_db_executor, partial(context.run, fn, *args, **kwargs))
+
+    def add(self, instance):
+        self.sync_session.add(instance)
+
+    def add_all(self, instances):
+        self.sync_session.add_all(instances)
+
+    async def execute(self, statement, *args, **kwargs):
+        # Fetch rows in the worker thread so no cursor IO happens on the event loop
+        def fetch():
+            result = self.sync_session.execute(statement, *args, **kwargs)
+            # ORM results (e.g. of a bulk INSERT) only tell through their metadata that they have no rows
+            returns_rows = getattr(result, "returns_rows", getattr(result._metadata, "returns_rows", True))
+            return result.freeze()() if returns_rows else result
+        return await self._run(fetch)
+
+    async def scalar(self, statement, *args, **kwargs):
+        return await self._run(self.sync_session.scalar, statement, *args, **kwargs)
+
+    async def scalars(self, statement, *args, **kwargs):
+        # Buffer the rows in the worker thread, like AsyncSession.scalars does
+        def fetch():
+            return self.sync_session.execute(statement, *args, **kwargs).scalars().all()
+        return _BufferedScalars(await self._run(fetch))
+
+    async def get(self, entity, ident, **kwargs):
+        return await self._run(self.sync_session.get, entity, ident, **kwargs)
+
+    async def delete(self, instance):
+        await self._run(self.sync_session.delete, instance)
+
+    async def flush(self):
+        await self._run(self.sync_session.flush)
+
+    async def commit(self):
+        await self._run(self.sync_session.commit)
+
+    async def rollback(self):
+        await self._run(self.sync_session.rollback)
+
+    async def refresh(self, instance, attribute_names=None):
+        await self._run(self.sync_session.refresh, instance, attribute_names)
+
+    async def close(self):
+        await self._run(self.sync_session.close)
+
+
+class _BufferedScalars(list):
+    """Minimal ScalarResult stand-in returned by ThreadPoolSession.scalars."""
+
+    def all(self):
+        return list(self)
+
+    def first(self):
+        return self[0] if self else None
+
+
+# Unit-of-work bookkeeping, exposed through the websocket stats endpoint
+session_stats = {"opened": 0, "open": 0, "identity_map_last": 0, "identity_map_peak": 0}
+
+
+def _identity_map_size(db) -> int:
+    session = db.sync_session if isinstance(db, ThreadPoolSession) else db
+    return len(session.identity_map)
+
+
+@asynccontextmanager
+async def session_scope():
+    """Short-lived session for one unit of work, e.g. a single websocket action.
+
+    The connection goes back to the pool and the identity map is dropped when the
+    scope exits, so long-lived websockets don't accumulate loaded objects.
+    """
+    if DB_EXECUTION_MODE == "threadpool":
+        db = ThreadPoolSession(SessionLocal(expire_on_commit=False))
+    else:
+        db = AsyncSessionLocal()
+    session_stats["opened"] += 1
+    session_stats["open"] += 1
+    try:
+        yield db
+    finally:
+        size = _identity_map_size(db)
+        session_stats["identity_map_last"] = size
+        session_stats["identity_map_peak"] = max(session_stats["identity_map_peak"], size)
+        session_stats["open"] -= 1
+        await db.close()
+
+
+async def get_async_db():
+    """Session for async handlers: AsyncSession, or the thread pool fallback."""
+    async with session_scope() as db:
+        yield db
+
+
 def create_all_tables():
     # This will create the tables inside the existing database file
-    Base.metadata.create_all(bind=engine)
\ No newline at end of file
+    Base.metadata.create_all(bind=engine)
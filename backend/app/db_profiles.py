@@ -0,0 +1,109 @@
+import os
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool, StaticPool
+
+# "tuned" applies the settings below, "legacy" builds bare engines like the app originally did
+DB_PROFILE = os.getenv("DB_PROFILE", "tuned")
+
+# SQLite: WAL lets readers run alongside the single writer, synchronous=NORMAL only
+# fsyncs at checkpoints (safe with WAL), and busy_timeout makes writers queue instead
+# of failing with "database is locked"
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_POOL_SIZE = int(os.getenv("SQLITE_POOL_SIZE", "8"))
+
+# Server databases (PostgreSQL, MySQL, ...)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "mysql": "mysql+aiomysql",
+}
+
+
+def to_async_url(url: str) -> str:
+    """Swap the driver of a sync database URL for its asyncio counterpart."""
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver configured for {backend} databases")
+    return parsed.set(drivername=ASYNC_DRIVERS[backend]).render_as_string(hide_password=False)
+
+
+def _is_memory_sqlite(url: str) -> bool:
+    return make_url(url).database in (None, "", ":memory:")
+
+
+def sqlite_pragmas() -> dict:
+    return {
+        "journal_mode": SQLITE_JOURNAL_MODE,
+        "synchronous": SQLITE_SYNCHRONOUS,
+        "busy_timeout": SQLITE_BUSY_TIMEOUT_MS,
+        # Negative cache_size is in KiB rather than pages
+        "cache_size": -SQLITE_CACHE_SIZE_KB,
+        "mmap_size": SQLITE_MMAP_SIZE,
+        "temp_store": "MEMORY",
+    }
+
+
+def _install_sqlite_pragmas(sync_engine):
+    pragmas = sqlite_pragmas()
+
+    @event.listens_for(sync_engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+
+def engine_options(url: str, profile: str = DB_PROFILE, is_async: bool = False) -> dict:
+    """Keyword arguments for create_engine/create_async_engine under the given profile."""
+    backend = make_url(url).get_backend_name()
+    if backend == "sqlite":
+        # aiosqlite runs each connection in its own thread already
+        options = {} if is_async else {"connect_args": {"check_same_thread": False}}
+        if _is_memory_sqlite(url):
+            # Every connection to :memory: is a new database, so share a single one
+            options["poolclass"] = StaticPool
+        elif profile == "tuned":
+            # Keep connections (and their page cache and mmap) instead of reopening the file;
+            # aiosqlite would otherwise default to NullPool
+            options.update(
+                poolclass=AsyncAdaptedQueuePool if is_async else QueuePool,
+                pool_size=SQLITE_POOL_SIZE,
+                max_overflow=0,
+                pool_timeout=DB_POOL_TIMEOUT,
+            )
+        return options
+    if profile == "legacy":
+        return {}
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": True,
+    }
+
+
+def build_engines(url: str, profile: str = DB_PROFILE):
+    """Create the sync and async engines for `url` configured by `profile`."""
+    if profile not in ("tuned", "legacy"):
+        raise ValueError(f"Unknown database profile: {profile}")
+    engine = create_engine(url, **engine_options(url, profile))
+    async_engine = create_async_engine(to_async_url(url), **engine_options(url, profile, is_async=True))
+    if profile == "tuned" and make_url(url).get_backend_name() == "sqlite":
+        _install_sqlite_pragmas(engine)
+        _install_sqlite_pragmas(async_engine.sync_engine)
+    return engine, async_engine
@@ -1,18 +1,35 @@
-import json
+import asyncio
+import logging
 import secrets
 
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from starlette.middleware.cors import CORSMiddleware
-from starlette.responses import JSONResponse
+from starlette.responses import JSONResponse, PlainTextResponse
 from starlette.websockets import WebSocketDisconnect
 from app.utils.admin_actions import check_if_admin
 from app.models import GroupChat, User
-from app.websocket.handle_websocket_actions import handle_websocket_action, connection_manager
+from app.websocket.handle_websocket_actions import (
+    handle_websocket_action, connection_manager, chat_directory, group_chat_manager, membership, backplane, dispatcher,
+    presence, heartbeat, can_access_chat
+)
 
+from app.websocket.history import HISTORY_PAGE_SIZE, fetch_history_page
+from app.websocket.persistence import message_writer
+from app.websocket.protocol import negotiate
 from app.database import (
     get_db,
-    create_all_tables
+    get_async_db,
+    session_stats,
+    create_all_tables,
+    engine,
+    async_engine
 )
+from app.utils.histogram import LatencyHistogram
+from app.utils.memory import rss_bytes
+from app.utils.metrics import registry
+from app.utils.workpool import PoolBusy
 from fastapi import (
     FastAPI,
     Depends,
@@ -24,16 +41,22 @@ from fastapi import (
 from app.schemas import (
     UserCreate,
     UserResponse,
-    LoginRequest, GroupChatResponse, GroupChatRequest
+    LoginRequest, GroupChatResponse, GroupChatRequest, GroupMembersRequest
 )
 from app.auth import (
     create_access_token,
     decode_token,
     hash_password,
-    verify_password,
-    create_refresh_token
+    verify_and_update_password,
+    create_refresh_token,
+    auth_pool,
+    revocation_for,
+    apply_revocation,
+    authenticated_username
 )
 
+logger = logging.getLogger(__name__)
+
 app = FastAPI()
 
 app.add_middleware(
@@ -45,37 +68,112 @@ app.add_middleware(
 )
 
 
+def _apply_token_revocation(payload: dict):
+    apply_revocation(bytes.fromhex(payload["digest"]), payload["exp"])
+
+
+# Logouts are announced on the backplane so every worker rejects the revoked tokens
+backplane.subscribe("revoke_token", _apply_token_revocation)
+
+
+# Room sizes as a histogram: a few big rooms and many pairs need very different fan-out
+ROOM_SIZE_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 5000, 10000)
+
+
+def _room_size_histogram() -> dict:
+    histogram = LatencyHistogram(ROOM_SIZE_BUCKETS)
+    for size in connection_manager.rooms.room_sizes().values():
+        histogram.observe(size)
+    return {(): histogram}
+
+
+registry.gauge("chat_ws_connections", "Authenticated websocket connections",
+               lambda: len(connection_manager.active_connections))
+registry.gauge("chat_ws_rooms", "Rooms with at least one connected member", connection_manager.rooms.room_count)
+registry.expose("chat_ws_room_members", "Connected members per room", "histogram", _room_size_histogram)
+registry.expose("chat_ws_action_duration_seconds", "Websocket action handler latency", "histogram",
+                dispatcher.latency, ("action",))
+registry.expose("chat_ws_action_rejected_total", "Frames rejected for an invalid payload", "counter",
+                dispatcher.rejected, ("action",))
+registry.expose("chat_ws_action_failed_total", "Actions whose handler raised", "counter",
+                dispatcher.failed, ("action",))
+ws_disconnects = registry.counter("chat_ws_disconnects_total", "Websocket connections ended, by reason", ("reason",))
+
+
 @app.on_event("startup")
 async def startup_event():
     create_all_tables()
+    await backplane.start()
+    await message_writer.start()
+    await presence.start()
+    await heartbeat.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    # Write-behind mode: flush buffered messages before the process exits
+    await heartbeat.close()
+    await presence.close()
+    await connection_manager.fanout.close()
+    await message_writer.close()
+    await backplane.close()
+    auth_pool.close()
+    # Pooled aiosqlite connections each hold a non-daemon thread that would keep the process alive
+    await async_engine.dispose()
+    engine.dispose()
+
+
+async def run_auth_job(fn, *args):
+    """Run a bcrypt call on the auth pool; answer 503 instead of queueing without bound."""
+    try:
+        return await auth_pool.run(fn, *args)
+    except PoolBusy:
+        raise HTTPException(status_code=503, detail="Too many authentication requests, retry shortly",
+                            headers={"Retry-After": "1"})
 
 
 @app.post("/register/", response_model=UserResponse)
-def register(user: UserCreate, db: Session = Depends(get_db)):
-    if db.query(User).filter(User.username == user.username).first():
+async def register(user: UserCreate, db: AsyncSession = Depends(get_async_db)):
+    if await db.scalar(select(User.id).where(User.username == user.username)):
         raise HTTPException(status_code=400, detail="Username already exists")
-    if db.query(User).filter(User.email == user.email).first():
+    if await db.scalar(select(User.id).where(User.email == user.email)):
         raise HTTPException(status_code=400, detail="Email already exists")
 
-    hashed_password = hash_password(user.password)
+    hashed_password = await run_auth_job(hash_password, user.password)
     new_user = User(username=user.username, email=user.email, hashed_password=hashed_password)
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.commit()
+    await db.refresh(new_user)
     return new_user
 
 
 @app.post("/login/")
-def login(login_data: LoginRequest, response: Response, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.username == login_data.username).first()
+async def login(login_data: LoginRequest, db: AsyncSession = Depends(get_async_db)):
+    user = await db.scalar(select(User).where(User.username == login_data.username))
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
 
-    if not user or not verify_password(login_data.password, user.hashed_password):
+    valid, new_hash = await run_auth_job(verify_and_update_password, login_data.password, user.hashed_password)
+    if not valid:
         raise HTTPException(status_code=401, detail="Invalid credentials")
+    if new_hash:
+        # Stored with an outdated bcrypt cost: replace it while we have the plain password
+        user.hashed_password = new_hash
+        await db.commit()
 
     access_token = create_access_token({"sub": login_data.username}).decode('utf-8')
     refresh_token = create_refresh_token({"sub": login_data.username}).decode('utf-8')
     csrf_token = secrets.token_hex(32)  # Generate a secure random CSRF token
 
+    # Cookies go on the response actually returned; ones set on an injected Response would be dropped
+    response = JSONResponse(
+        content={
+            "access_token": access_token,
+            "refresh_token": refresh_token,
+            "csrf_token": csrf_token,
+            "token_type": "bearer",
+        }
+    )
     response.set_cookie(
         key="access_token",
         value=access_token,
@@ -90,14 +188,7 @@ def login(login_data: LoginRequest, response: Response, db: Session = Depends(ge
         secure=True,
         samesite="strict"
     )
-    return JSONResponse(
-        content={
-            "access_token": access_token,
-            "refresh_token": refresh_token,
-            "csrf_token": csrf_token,
-            "token_type": "bearer",
-        }
-    )
+    return response
 
 
 @app.post("/refresh")
@@ -129,7 +220,14 @@ def refresh_token(request: Request, response: Response):
 
 
 @app.get("/logout")
-def logout(response: Response):
+async def logout(request: Request, response: Response):
+    # Revoke the tokens themselves, so copies of them stop working too
+    for cookie in ("access_token", "refresh_token"):
+        token = request.cookies.get(cookie)
+        revocation = revocation_for(token) if token else None
+        if revocation:
+            digest, expires_at = revocation
+            backplane.publish_nowait("revoke_token", {"digest": digest.hex(), "exp": expires_at})
     # Delete the cookies
     response.delete_cookie("access_token")
     response.delete_cookie("refresh_token")
@@ -164,6 +262,7 @@ async def create_group(group_data: GroupChatRequest, db: Session = Depends(get_d
     db.add(new_group)
     db.commit()
     db.refresh(new_group)
+    chat_directory.invalidate_group(new_group.id, new_group.name)
     return JSONResponse({
         "message": "Group is successfully created",
         "group_name": new_group.name,
@@ -194,6 +293,46 @@ async def get_group_members(group_name: str, db: Session = Depends(get_db)):
     return {"group_name": group_name, "members": members}
 
 
+@app.post("/group/{group_name}/members/add")
+async def add_group_members(group_name: str, request: GroupMembersRequest,
+                            username: str = Depends(authenticated_username),
+                            db: AsyncSession = Depends(get_async_db)):
+    """Add many users to a group in one statement as the logged-in member; the group sees one summary message."""
+    adder = await chat_directory.user_by_name(db, username)
+    if not adder:
+        raise HTTPException(status_code=401, detail="User not found")
+    group = await chat_directory.group_by_name(db, group_name)
+    if not group:
+        raise HTTPException(status_code=404, detail="Group not found")
+    if not await membership.can_access(db, group, adder.id):
+        raise HTTPException(status_code=403, detail="You are not a member of this group")
+    try:
+        result = await group_chat_manager.add_users_to_group(group.id, adder.id, request.user_ids, db)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"group_name": group_name, **result}
+
+
+@app.post("/group/{group_name}/members/remove")
+async def remove_group_members(group_name: str, request: GroupMembersRequest,
+                               username: str = Depends(authenticated_username),
+                               db: AsyncSession = Depends(get_async_db)):
+    """Remove many members in one statement; only the logged-in admin may do this."""
+    admin = await chat_directory.user_by_name(db, username)
+    if not admin:
+        raise HTTPException(status_code=401, detail="User not found")
+    group = await chat_directory.group_by_name(db, group_name)
+    if not group:
+        raise HTTPException(status_code=404, detail="Group not found")
+    if admin.id != group.admin_id:
+        raise HTTPException(status_code=403, detail="You are not an admin")
+    try:
+        result = await group_chat_manager.remove_users_from_group(admin.id, group.id, request.user_ids, db)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"group_name": group_name, **result}
+
+
 @app.get("/{group_name}/check_admin/{admin_name}")
 async def check_admin(group_name: str, admin_name: str, db: Session = Depends(get_db)):
     group = db.query(GroupChat).filter(GroupChat.name == group_name).first()
@@ -215,36 +354,105 @@ async def delete_group(group_name: str, admin_name: str, db: Session = Depends(g
     if not check_if_admin(admin.id, group.id, db):
         raise HTTPException(status_code=403, detail="You are not an admin")
 
+    group_id = group.id
     db.delete(group)
     db.commit()
+    chat_directory.invalidate_group(group_id, group_name)
     return {"message": "Group deleted successfully"}
 
 
+@app.get("/history/{chat_type}/{chat_id}")
+async def get_chat_history(chat_type: str, chat_id: int, cursor: str | None = None,
+                           limit: int = HISTORY_PAGE_SIZE, username: str = Depends(authenticated_username),
+                           db: AsyncSession = Depends(get_async_db)):
+    """Page through a chat's history, newest first; pass the returned cursor to get older messages.
+
+    Only participants of a private chat and members (or the admin) of a group may read it.
+    """
+    if chat_type not in ("private", "group"):
+        raise HTTPException(status_code=404, detail="Unknown chat type")
+    user = await chat_directory.user_by_name(db, username)
+    if not user:
+        raise HTTPException(status_code=401, detail="User does not exist")
+    if not await can_access_chat(db, user.id, chat_type, chat_id):
+        raise HTTPException(status_code=403, detail="You are not a member of this chat")
+    try:
+        page = await fetch_history_page(db, chat_type, chat_id, cursor, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"chat_type": chat_type, "chat_id": chat_id, **page}
+
+
+@app.get("/ws/stats")
+async def websocket_stats():
+    """Live connection counts, memory, per-action latency and per-connection send queue depths/drops (slowest first)."""
+    connections = len(connection_manager.active_connections)
+    rss = rss_bytes()
+    return {
+        "connections": connections,
+        "rooms": connection_manager.rooms.room_count(),
+        "memory": {
+            "rss_bytes": rss,
+            "rss_per_connection_bytes": rss // connections if connections else None,
+            "db_sessions": session_stats,
+        },
+        "directory_cache": chat_directory.stats(),
+        "membership": membership.stats(),
+        "message_persistence": message_writer.stats(),
+        "actions": dispatcher.stats(),
+        "rate_limits": dispatcher.limiter.stats(),
+        "auth_pool": auth_pool.stats(),
+        "presence": presence.stats(),
+        "replay_buffer": connection_manager.replay.stats(),
+        "backplane": backplane.stats(),
+        "heartbeat": heartbeat.stats(),
+        "large_room_fanout": connection_manager.fanout.stats(),
+        "send_queues": connection_manager.queue_stats(),
+    }
+
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus text exposition of the connection, action, database and fan-out metrics."""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
 @app.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket, db: Session = Depends(get_db)):
-    await websocket.accept()
+async def websocket_endpoint(websocket: WebSocket):
+    # JSON text frames unless the client asked for a compact subprotocol we support
+    codec = negotiate(websocket.scope.get("subprotocols", ()))
+    await websocket.accept(subprotocol=codec.subprotocol)
     try:
-        # Initial connection authentication
-        data = await websocket.receive_text()
-        message = json.loads(data)
+        # Initial connection authentication; the reaper only sees authenticated sockets,
+        # so a socket that never authenticates gets one idle timeout to do so
+        try:
+            message = await asyncio.wait_for(codec.receive(websocket),
+                                             timeout=heartbeat.idle_timeout if heartbeat.enabled else None)
+        except asyncio.TimeoutError:
+            await websocket.close(code=1008, reason="Authentication timeout")
+            return
         access_token = message.get("access_token")
         csrf_token = message.get("csrf_token")
         if not access_token or not csrf_token:
             await websocket.close(code=1008, reason="Missing authentication tokens")
             return
 
-        await connection_manager.connect(websocket, csrf_token, access_token)
-        await handle_websocket_action(websocket, message, db)
+        if not await connection_manager.connect(websocket, csrf_token, access_token, codec=codec):
+            return
+        # The dispatcher opens one short-lived session per valid action
+        await handle_websocket_action(websocket, message)
         # Handle subsequent WebSocket messages
         while True:
-            data = await websocket.receive_text()
-            message = json.loads(data)
-            await handle_websocket_action(websocket, message, db)
+            message = await codec.receive(websocket)
+            heartbeat.seen(websocket)
+            await handle_websocket_action(websocket, message)
 
     except WebSocketDisconnect:
         connection_manager.disconnect(websocket)
-        print("Client disconnected")
-    except Exception as e:
-        print(f"Error: {str(e)}")
+        ws_disconnects.labels("client").inc()
+        logger.debug("Client disconnected")
+    except Exception:
+        logger.exception("Websocket connection failed")
+        ws_disconnects.labels("error").inc()
         connection_manager.disconnect(websocket)
         await websocket.close(code=1008, reason="Unexpected error")
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Text, Table
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Text, Table, Index
 from sqlalchemy.orm import relationship
 from app.database import Base
 from datetime import datetime
@@ -8,7 +8,9 @@ group_user_association = Table(
     "group_users",
     Base.metadata,
     Column("group_id", Integer, ForeignKey("group_chats.id"), primary_key=True),
-    Column("user_id", Integer, ForeignKey("users.id"), primary_key=True)
+    Column("user_id", Integer, ForeignKey("users.id"), primary_key=True),
+    # The primary key serves "members of a group"; this serves "groups of a user"
+    Index("ix_group_users_user_id_group_id", "user_id", "group_id"),
 )
 
 
@@ -29,6 +31,11 @@ class PrivateChat(Base):
     user2_id = Column(Integer, ForeignKey("users.id"))
     messages = relationship("PrivateMessage", back_populates="chat", cascade="all, delete-orphan")
 
+    # Pairs are stored ordered (user1_id < user2_id), so a chat is found with one index probe
+    __table_args__ = (
+        Index("uq_private_chats_user1_id_user2_id", "user1_id", "user2_id", unique=True),
+    )
+
 
 class PrivateMessage(Base):
     __tablename__ = "private_messages"
@@ -40,6 +47,11 @@ class PrivateMessage(Base):
 
     chat = relationship("PrivateChat", back_populates="messages")
 
+    # Keyset pagination of a chat's history walks (timestamp, id) within one chat
+    __table_args__ = (
+        Index("ix_private_messages_chat_id_timestamp_id", "chat_id", "timestamp", "id"),
+    )
+
 
 class GroupChat(Base):
     __tablename__ = "group_chats"
@@ -58,4 +70,8 @@ class GroupMessage(Base):
     content = Column(Text)
     timestamp = Column(DateTime, default=datetime.utcnow)
 
-    group = relationship("GroupChat", back_populates="messages")
\ No newline at end of file
+    group = relationship("GroupChat", back_populates="messages")
+
+    __table_args__ = (
+        Index("ix_group_messages_group_id_timestamp_id", "group_id", "timestamp", "id"),
+    )
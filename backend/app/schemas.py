@@ -1,4 +1,6 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, Field
+
+from app.websocket.membership import MAX_BULK_MEMBERS
 
 
 class UserBase(BaseModel):
@@ -42,3 +44,7 @@ class GroupChatResponse(BaseModel):
 class GroupChatRequest(BaseModel):
     group_name: str
     admin_username: str
+
+
+class GroupMembersRequest(BaseModel):
+    user_ids: list[int] = Field(min_length=1, max_length=MAX_BULK_MEMBERS)
@@ -0,0 +1,52 @@
+from bisect import bisect_left
+from typing import Sequence
+
+# Upper bounds in seconds, from sub-millisecond cache hits to multi-second stalls
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram; O(log buckets) per observation, no samples kept."""
+
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        # One extra slot for observations above the last bound (+Inf)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float):
+        self.counts[bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def quantile(self, q: float) -> float | None:
+        """Upper bound of the bucket holding the q-th observation (None when empty)."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def cumulative(self) -> list:
+        """(upper bound, observations <= bound) pairs, ending with +Inf."""
+        pairs, seen = [], 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            seen += count
+            pairs.append((bound, seen))
+        return pairs
+
+    def stats(self) -> dict:
+        def ms(value):
+            return None if value is None else round(value * 1000, 3)
+        return {
+            "count": self.count,
+            "mean_ms": ms(self.sum / self.count) if self.count else None,
+            "p50_ms": ms(self.quantile(0.5)),
+            "p95_ms": ms(self.quantile(0.95)),
+            "p99_ms": ms(self.quantile(0.99)),
+        }
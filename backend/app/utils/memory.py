@@ -0,0 +1,14 @@
+import os
+import resource
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def rss_bytes() -> int:
+    """Current resident set size of this process."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        # No procfs (e.g. macOS): fall back to the peak RSS, reported in bytes there
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
@@ -0,0 +1,127 @@
+from contextvars import ContextVar
+from typing import Callable, Dict, Mapping, Sequence, Tuple, Union
+
+from app.utils.histogram import LATENCY_BUCKETS, LatencyHistogram
+
+# Websocket action being handled by the current task, so database hooks can attribute their queries
+current_action: ContextVar[str] = ContextVar("current_action", default="none")
+
+
+class Counter:
+    """Monotonic value; incrementing is a single attribute update."""
+
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: Union[int, float] = 1):
+        self.value += amount
+
+
+Children = Union[Mapping, Callable[[], Mapping]]
+
+
+class MetricFamily:
+    """One metric name with its children, one per label value tuple.
+
+    Children are either created on demand by labels() or read from a mapping (or a
+    function returning one) that the instrumented object already keeps, e.g. the
+    dispatcher's latency histograms, so exposing them costs nothing until a scrape.
+    Mapping keys are label value tuples, or plain values for a single label; values
+    are numbers, Counters or LatencyHistograms.
+    """
+
+    def __init__(self, name: str, help_text: str, kind: str, labelnames: Sequence[str] = (),
+                 children: Children = None, factory: Callable = None):
+        self.name = name
+        self.help = help_text
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self.factory = factory
+        self._children = {} if children is None else children
+
+    def labels(self, *values):
+        """The child for these label values, created on first use. Keep a reference on hot paths."""
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self.factory()
+        return child
+
+    def children(self) -> Mapping:
+        return self._children() if callable(self._children) else self._children
+
+
+class MetricsRegistry:
+    """Process-wide metrics, rendered in the Prometheus text exposition format.
+
+    Recording is plain attribute and dict updates on objects the hot paths hold on to;
+    anything that can be computed from existing state (connection counts, room sizes) is
+    only computed when /metrics is scraped.
+    """
+
+    def __init__(self):
+        self._families: Dict[str, MetricFamily] = {}
+
+    def register(self, family: MetricFamily) -> MetricFamily:
+        if family.name in self._families:
+            raise ValueError(f"Metric {family.name} is already registered")
+        self._families[family.name] = family
+        return family
+
+    def counter(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        """A Counter, or a family of them when labelnames are given."""
+        family = self.register(MetricFamily(name, help_text, "counter", labelnames, factory=Counter))
+        return family if labelnames else family.labels()
+
+    def histogram(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS):
+        """A LatencyHistogram, or a family of them when labelnames are given."""
+        family = self.register(MetricFamily(name, help_text, "histogram", labelnames,
+                                            factory=lambda: LatencyHistogram(buckets)))
+        return family if labelnames else family.labels()
+
+    def expose(self, name: str, help_text: str, kind: str, children: Children, labelnames: Sequence[str] = ()):
+        """Publish values kept elsewhere (or computed at scrape time) under a metric name."""
+        return self.register(MetricFamily(name, help_text, kind, labelnames, children=children))
+
+    def gauge(self, name: str, help_text: str, fn: Callable[[], Union[int, float]]):
+        """A single value computed at scrape time."""
+        return self.expose(name, help_text, "gauge", lambda: {(): fn()})
+
+    def render(self) -> str:
+        lines = []
+        for family in self._families.values():
+            lines.append(f"# HELP {family.name} {family.help}")
+            lines.append(f"# TYPE {family.name} {family.kind}")
+            for key, child in list(family.children().items()):
+                labels = _labels(family.labelnames, key if isinstance(key, tuple) else (key,))
+                if family.kind == "histogram":
+                    for bound, count in child.cumulative():
+                        le = f'le="{_number(bound)}"'
+                        lines.append(f"{family.name}_bucket{{{labels + ',' if labels else ''}{le}}} {count}")
+                    suffix = f"{{{labels}}}" if labels else ""
+                    lines.append(f"{family.name}_sum{suffix} {_number(child.sum)}")
+                    lines.append(f"{family.name}_count{suffix} {child.count}")
+                else:
+                    value = child.value if isinstance(child, Counter) else child
+                    lines.append(f"{family.name}{{{labels}}} {_number(value)}" if labels
+                                 else f"{family.name} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(names: Tuple[str, ...], values: tuple) -> str:
+    return ",".join(f'{name}="{_escape(str(value))}"' for name, value in zip(names, values))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return str(round(value, 9)) if isinstance(value, float) else str(value)
+
+
+registry = MetricsRegistry()
@@ -0,0 +1,82 @@
+import asyncio
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Optional
+
+from app.utils.histogram import LatencyHistogram
+
+
+class PoolBusy(Exception):
+    """Raised instead of queueing when a pool already has its maximum of waiting jobs."""
+
+
+class BoundedWorkPool:
+    """Runs CPU-heavy calls on a dedicated executor with a cap on running and waiting jobs.
+
+    At most `workers` jobs run at once and at most `max_waiting` wait for a slot; further
+    calls fail fast with PoolBusy, so latency stays bounded instead of growing with the
+    queue. Because the pool has its own executor, bursts never occupy the default
+    threadpool that the rest of the app (sync endpoints, DB_EXECUTION_MODE=threadpool) uses.
+    """
+
+    def __init__(self, workers: int, max_waiting: int, kind: str = "thread", name: str = "pool"):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Unknown work pool kind: {kind}")
+        self.workers = workers
+        self.max_waiting = max_waiting
+        self.kind = kind
+        self.name = name
+        self._executor: Optional[Executor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self.waiting = 0
+        self.running = 0
+        self.rejected = 0
+        self.queue_time = LatencyHistogram()
+        self.run_time = LatencyHistogram()
+
+    def _ensure_started(self):
+        if self._executor is None:
+            if self.kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=self.name)
+            self._slots = asyncio.Semaphore(self.workers)
+
+    async def run(self, fn: Callable, *args):
+        self._ensure_started()
+        if self.waiting >= self.max_waiting and self._slots.locked():
+            self.rejected += 1
+            raise PoolBusy(f"{self.name} pool is busy")
+        queued = time.perf_counter()
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        started = time.perf_counter()
+        self.queue_time.observe(started - queued)
+        self.running += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            self.running -= 1
+            self._slots.release()
+            self.run_time.observe(time.perf_counter() - started)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+            self._slots = None
+
+    def stats(self) -> dict:
+        return {
+            "kind": self.kind,
+            "workers": self.workers,
+            "running": self.running,
+            "waiting": self.waiting,
+            "max_waiting": self.max_waiting,
+            "rejected": self.rejected,
+            "queue_time": self.queue_time.stats(),
+            "run_time": self.run_time.stats(),
+        }
@@ -0,0 +1,257 @@
+import asyncio
+import itertools
+import json
+import logging
+import os
+import uuid
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# "inprocess" keeps fan-out inside this worker, "redis" shares it across workers and hosts
+BROADCAST_BACKPLANE = os.getenv("BROADCAST_BACKPLANE", "inprocess")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+BACKPLANE_CHANNEL = os.getenv("BACKPLANE_CHANNEL", "websocket_chat:backplane")
+# Wait before resubscribing after the pub/sub connection dropped, doubling up to the maximum
+BACKPLANE_RETRY_DELAY = float(os.getenv("BACKPLANE_RETRY_DELAY", "0.5"))
+BACKPLANE_MAX_RETRY_DELAY = float(os.getenv("BACKPLANE_MAX_RETRY_DELAY", "30"))
+
+
+class Backplane:
+    """Carries typed events (room broadcasts, cache invalidations) between workers.
+
+    publish() always dispatches to this worker's handlers right away; implementations
+    that span processes additionally forward the event so every other worker's
+    handlers run too. Handlers deliver only to local sockets.
+    """
+
+    # True when every socket lives in this process, so rooms without local members can be skipped
+    is_local = True
+
+    def __init__(self):
+        # Tells this worker's events apart from other workers' ones
+        self.node_id = uuid.uuid4().hex
+        self._handlers: Dict[str, List[Callable[[dict], None]]] = {}
+        # key -> [epoch, last seq]; a counter started afresh gets a new epoch
+        self._sequences: Dict[str, list] = {}
+        self._epoch_prefix = uuid.uuid4().hex[:8]
+        self._epochs = itertools.count(1)
+
+    def subscribe(self, event_type: str, handler: Callable[[dict], None]):
+        self._handlers.setdefault(event_type, []).append(handler)
+
+    def _dispatch(self, event_type: str, payload: dict):
+        for handler in self._handlers.get(event_type, ()):
+            try:
+                handler(payload)
+            except Exception:
+                logger.exception("Backplane handler for %s failed", event_type)
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def publish(self, event_type: str, payload: dict):
+        self._dispatch(event_type, payload)
+
+    def publish_nowait(self, event_type: str, payload: dict):
+        """Publish from synchronous code; remote delivery happens in the background."""
+        self._dispatch(event_type, payload)
+
+    async def next_seq(self, key: str) -> Optional[Tuple[str, int]]:
+        """(epoch, next number) of a counter shared by every worker on this backplane.
+
+        Numbers start at 1 and only compare within one epoch: a counter that is restarted,
+        by a process restart or forget_seq(), counts again under a new epoch. None if the
+        shared counter cannot be reached; the message then goes out unnumbered.
+        """
+        counter = self._sequences.get(key)
+        if counter is None:
+            counter = self._sequences[key] = [f"{self._epoch_prefix}.{next(self._epochs)}", 0]
+        counter[1] += 1
+        return counter[0], counter[1]
+
+    def forget_seq(self, key: str):
+        """Drop a counter nobody can resume from any more; it starts again at 1 if reused."""
+        self._sequences.pop(key, None)
+
+    def sequence_count(self) -> int:
+        return len(self._sequences)
+
+    def stats(self) -> dict:
+        return {"kind": "inprocess", "sequences": len(self._sequences)}
+
+
+class InProcessBackplane(Backplane):
+    """Single-worker backplane: events never leave the process."""
+
+
+class RedisBackplane(Backplane):
+    """Backplane over Redis pub/sub (or anything exposing the same client API).
+
+    The client needs `publish(channel, data)`, `pipeline()` with `incr`, `set` and `get`,
+    and `pubsub()` returning an object with `subscribe(channel)`, `listen()` and
+    `unsubscribe()`, as redis.asyncio.Redis does, so a local fake can stand in for a
+    Redis server.
+
+    If the subscription drops, the listener resubscribes with backoff and then dispatches
+    a local "resubscribed" event: whatever was published meanwhile is lost, so handlers
+    holding state derived from remote events (the directory caches) start over. While
+    Redis is unreachable, events still reach this worker's handlers; forwarding them and
+    numbering messages fail quietly (logged and counted) instead of failing the sender.
+    """
+
+    is_local = False
+
+    def __init__(self, client, channel: str = BACKPLANE_CHANNEL, node_id: Optional[str] = None,
+                 retry_delay: float = BACKPLANE_RETRY_DELAY, max_retry_delay: float = BACKPLANE_MAX_RETRY_DELAY):
+        super().__init__()
+        self.client = client
+        self.channel = channel
+        self.node_id = node_id or uuid.uuid4().hex
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self._pubsub = None
+        self._listener: Optional[asyncio.Task] = None
+        self._pending: set = set()
+        self.published = 0
+        self.received = 0
+        self.malformed = 0
+        self.reconnects = 0
+        self.publish_failures = 0
+        self.seq_failures = 0
+
+    @classmethod
+    def from_url(cls, url: str = REDIS_URL, **kwargs) -> "RedisBackplane":
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("BROADCAST_BACKPLANE=redis requires the 'redis' package (pip install redis)")
+        return cls(redis.from_url(url), **kwargs)
+
+    async def start(self):
+        await self._subscribe()
+        self._listener = asyncio.create_task(self._listen())
+
+    async def _subscribe(self):
+        pubsub = self.client.pubsub()
+        await pubsub.subscribe(self.channel)
+        self._pubsub = pubsub
+
+    async def _unsubscribe_quietly(self):
+        pubsub, self._pubsub = self._pubsub, None
+        if pubsub is not None:
+            try:
+                await pubsub.unsubscribe(self.channel)
+            except Exception:
+                pass
+
+    async def close(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            self._listener = None
+        if self._pending:
+            await asyncio.gather(*self._pending, return_exceptions=True)
+        if self._pubsub is not None:
+            await self._pubsub.unsubscribe(self.channel)
+            self._pubsub = None
+
+    async def _listen(self):
+        """Dispatch remote events until closed; resubscribe with backoff whenever the subscription fails."""
+        delay = self.retry_delay
+        while True:
+            try:
+                if self._pubsub is None:
+                    await self._subscribe()
+                    self.reconnects += 1
+                    delay = self.retry_delay
+                    logger.warning("Backplane resubscribed to %s, events published meanwhile were missed", self.channel)
+                    self._dispatch("resubscribed", {})
+                async for message in self._pubsub.listen():
+                    try:
+                        self._handle(message)
+                    except Exception:
+                        self.malformed += 1
+                        logger.exception("Ignoring backplane message that could not be handled")
+                raise ConnectionError("Backplane subscription ended")
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Backplane subscription to %s failed, retrying in %.2fs", self.channel, delay)
+                await self._unsubscribe_quietly()
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_retry_delay)
+
+    def _handle(self, message: dict):
+        if message.get("type") != "message":
+            return
+        envelope = json.loads(message["data"])
+        # Our own events were already dispatched locally when they were published
+        if envelope.get("origin") == self.node_id:
+            return
+        event_type, payload = envelope["type"], envelope["payload"]
+        self.received += 1
+        self._dispatch(event_type, payload)
+
+    def _envelope(self, event_type: str, payload: dict) -> str:
+        return json.dumps({"origin": self.node_id, "type": event_type, "payload": payload},
+                          separators=(",", ":"), ensure_ascii=False)
+
+    async def publish(self, event_type: str, payload: dict):
+        self._dispatch(event_type, payload)
+        await self._forward(event_type, payload)
+
+    def publish_nowait(self, event_type: str, payload: dict):
+        self._dispatch(event_type, payload)
+        task = asyncio.create_task(self._forward(event_type, payload))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def _forward(self, event_type: str, payload: dict):
+        """Send an already dispatched event to the other workers; a failure only costs them the event."""
+        try:
+            await self.client.publish(self.channel, self._envelope(event_type, payload))
+            self.published += 1
+        except Exception as exc:
+            self.publish_failures += 1
+            logger.warning("Backplane could not forward %s to %s: %s", event_type, self.channel, exc)
+
+    async def next_seq(self, key: str) -> Optional[Tuple[str, int]]:
+        # The epoch key is only set by the first worker to number the room, and vanishes
+        # together with the counter if Redis loses its data
+        pipe = self.client.pipeline(transaction=False)
+        pipe.incr(f"{self.channel}:seq:{key}")
+        pipe.set(f"{self.channel}:epoch:{key}", uuid.uuid4().hex[:8], nx=True)
+        pipe.get(f"{self.channel}:epoch:{key}")
+        try:
+            seq, _, epoch = await pipe.execute()
+        except Exception as exc:
+            self.seq_failures += 1
+            logger.warning("Backplane could not number a message of %s: %s", key, exc)
+            return None
+        return epoch.decode() if isinstance(epoch, bytes) else epoch, seq
+
+    def forget_seq(self, key: str):
+        # The counter lives in Redis and other workers may still be numbering the room
+        pass
+
+    def stats(self) -> dict:
+        return {
+            "kind": "redis",
+            "published": self.published,
+            "received": self.received,
+            "malformed": self.malformed,
+            "reconnects": self.reconnects,
+            "publish_failures": self.publish_failures,
+            "seq_failures": self.seq_failures,
+        }
+
+
+def create_backplane(kind: str = BROADCAST_BACKPLANE) -> Backplane:
+    if kind == "inprocess":
+        return InProcessBackplane()
+    if kind == "redis":
+        return RedisBackplane.from_url()
+    raise ValueError(f"Unknown broadcast backplane: {kind}")
@@ -0,0 +1,154 @@
+import asyncio
+import os
+from collections import deque
+from enum import Enum
+from typing import Callable, Optional
+
+from fastapi import WebSocket
+
+from app.utils.metrics import registry
+from app.websocket.protocol import JSON_CODEC, Frame
+
+SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))
+
+
+class OverflowPolicy(str, Enum):
+    """What to do when a connection's outbound queue is full."""
+    DROP_OLDEST = "drop_oldest"  # Discard the oldest queued frame to make room
+    DISCONNECT = "disconnect"  # Treat the client as too slow and close it
+    COALESCE = "coalesce"  # Replace a queued frame with the same coalesce key, else drop oldest
+
+
+DEFAULT_OVERFLOW_POLICY = OverflowPolicy(os.getenv("WS_OVERFLOW_POLICY", OverflowPolicy.DROP_OLDEST.value))
+
+outbound_frames = registry.counter("chat_ws_outbound_frames_total", "Frames written to websocket clients")
+outbound_bytes = registry.counter("chat_ws_outbound_bytes_total", "Payload bytes written to websocket clients")
+dropped_frames = registry.counter("chat_ws_dropped_frames_total", "Frames dropped from full send queues")
+
+
+class ConnectionSender:
+    """Bounded outbound queue of one WebSocket, drained by its own writer task.
+
+    Broadcasts only enqueue, so a slow or half-dead client delays nobody but itself.
+    Frames are queued already encoded, with the connection's negotiated codec, so one
+    broadcast frame can be shared by every recipient speaking the same protocol.
+    """
+
+    def __init__(self, websocket: WebSocket, on_failure: Callable[[WebSocket, str], None],
+                 max_queue: int = SEND_QUEUE_SIZE, policy: OverflowPolicy = DEFAULT_OVERFLOW_POLICY,
+                 codec=JSON_CODEC):
+        self.websocket = websocket
+        self.codec = codec
+        self.max_queue = max_queue
+        self.policy = policy
+        self._on_failure = on_failure
+        # Items are (kind, payload, coalesce_key) tuples
+        self._queue: deque = deque()
+        self._ready = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.closed = False
+        self.sent = 0
+        self.bytes_sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        """Stop the writer task and discard whatever is still queued."""
+        self.closed = True
+        self._queue.clear()
+        if self._task is not None and self._task is not asyncio.current_task():
+            self._task.cancel()
+
+    @property
+    def depth(self) -> int:
+        return len(self._queue)
+
+    def send_json(self, payload: dict, coalesce_key: Optional[str] = None) -> bool:
+        """Encode a structured message with the connection's codec and queue it."""
+        return self.send_frame(self.codec.encode(payload), coalesce_key)
+
+    def send_notice(self, text: str, coalesce_key: Optional[str] = None) -> bool:
+        """Queue a plain-text notice (raw text for JSON clients, a packed string otherwise)."""
+        return self.send_frame(self.codec.encode_text(text), coalesce_key)
+
+    def send_frame(self, frame: Frame, coalesce_key: Optional[str] = None) -> bool:
+        """Queue a frame that was already encoded with this connection's codec."""
+        if isinstance(frame, bytes):
+            return self.send_bytes(frame, coalesce_key)
+        return self.send_text(frame, coalesce_key)
+
+    def send_text(self, payload: str, coalesce_key: Optional[str] = None) -> bool:
+        return self._enqueue(("text", payload, coalesce_key))
+
+    def send_bytes(self, payload: bytes, coalesce_key: Optional[str] = None) -> bool:
+        return self._enqueue(("bytes", payload, coalesce_key))
+
+    def _enqueue(self, item: tuple) -> bool:
+        """Queue a frame without blocking. Returns False if the frame was not queued."""
+        if self.closed:
+            return False
+        if len(self._queue) >= self.max_queue:
+            if self.policy == OverflowPolicy.DISCONNECT:
+                self.dropped += 1
+                dropped_frames.inc()
+                self.closed = True
+                self._on_failure(self.websocket, "Send queue overflow")
+                return False
+            if self.policy == OverflowPolicy.COALESCE and item[2] is not None and self._replace(item):
+                self.coalesced += 1
+                return True
+            self._queue.popleft()
+            self.dropped += 1
+            dropped_frames.inc()
+        self._queue.append(item)
+        self._ready.set()
+        return True
+
+    def _replace(self, item: tuple) -> bool:
+        """Overwrite the newest queued frame that shares the item's coalesce key."""
+        for index in range(len(self._queue) - 1, -1, -1):
+            if self._queue[index][2] == item[2]:
+                self._queue[index] = item
+                return True
+        return False
+
+    async def _run(self):
+        try:
+            while not self.closed:
+                if not self._queue:
+                    self._ready.clear()
+                    await self._ready.wait()
+                    continue
+                kind, payload, _ = self._queue.popleft()
+                if kind == "text":
+                    await self.websocket.send_text(payload)
+                    # isascii() is O(1), so only non-ASCII text pays for an extra encode
+                    size = len(payload) if payload.isascii() else len(payload.encode())
+                else:
+                    await self.websocket.send_bytes(payload)
+                    size = len(payload)
+                self.sent += 1
+                self.bytes_sent += size
+                outbound_frames.inc()
+                outbound_bytes.inc(size)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # The socket is gone; let the manager drop it from every room
+            self.closed = True
+            self._on_failure(self.websocket, "Send failed")
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": len(self._queue),
+            "max_queue": self.max_queue,
+            "policy": self.policy.value,
+            "protocol": self.codec.name,
+            "sent": self.sent,
+            "bytes_sent": self.bytes_sent,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+        }
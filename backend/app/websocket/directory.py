@@ -0,0 +1,138 @@
+import os
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import GroupChat, User
+from app.utils.cache import TTLCache
+from app.websocket.backplane import Backplane, InProcessBackplane
+
+DIRECTORY_CACHE_SIZE = int(os.getenv("DIRECTORY_CACHE_SIZE", "10000"))
+DIRECTORY_CACHE_TTL = float(os.getenv("DIRECTORY_CACHE_TTL", "300"))
+
+
+class UserInfo(NamedTuple):
+    id: int
+    username: str
+
+
+class GroupInfo(NamedTuple):
+    id: int
+    name: str
+    admin_id: int
+
+
+class ChatDirectory:
+    """In-process cache of user identity, group metadata and group member ids.
+
+    Lookups that miss go to the database and only successful results are cached, so
+    newly registered users and groups show up immediately. Anything that changes a
+    group or its members must call the matching invalidate_* method; invalidations are
+    sent over the backplane so the caches of other workers drop the entry as well.
+    """
+
+    def __init__(self, maxsize: int = DIRECTORY_CACHE_SIZE, ttl: float = DIRECTORY_CACHE_TTL,
+                 backplane: Optional[Backplane] = None):
+        self.backplane = backplane or InProcessBackplane()
+        self.backplane.subscribe("invalidate", self._apply_invalidation)
+        # Invalidations published while the backplane was disconnected never arrive
+        self.backplane.subscribe("resubscribed", lambda payload: self.clear())
+        self.users_by_name = TTLCache(maxsize, ttl)
+        self.users_by_id = TTLCache(maxsize, ttl)
+        self.groups_by_name = TTLCache(maxsize, ttl)
+        self.groups_by_id = TTLCache(maxsize, ttl)
+        # Member ids per group, filled and read by the MembershipService
+        self.members = TTLCache(maxsize, ttl)
+        # Bumped whenever a group's member ids are invalidated (one int per group ever changed),
+        # so a load that was reading the old members meanwhile does not cache them
+        self._member_generations: Dict[int, int] = {}
+        self._clears = 0
+
+    def _remember_user(self, user: UserInfo) -> UserInfo:
+        self.users_by_name.set(user.username, user)
+        self.users_by_id.set(user.id, user)
+        return user
+
+    def _remember_group(self, group: GroupInfo) -> GroupInfo:
+        self.groups_by_name.set(group.name, group)
+        self.groups_by_id.set(group.id, group)
+        return group
+
+    async def user_by_name(self, db: AsyncSession, username: str) -> Optional[UserInfo]:
+        user = self.users_by_name.get(username)
+        if user is None:
+            row = (await db.execute(select(User.id, User.username).where(User.username == username))).first()
+            user = self._remember_user(UserInfo(*row)) if row else None
+        return user
+
+    async def user_by_id(self, db: AsyncSession, user_id: int) -> Optional[UserInfo]:
+        user = self.users_by_id.get(user_id)
+        if user is None:
+            row = (await db.execute(select(User.id, User.username).where(User.id == user_id))).first()
+            user = self._remember_user(UserInfo(*row)) if row else None
+        return user
+
+    async def group_by_name(self, db: AsyncSession, name: str) -> Optional[GroupInfo]:
+        group = self.groups_by_name.get(name)
+        if group is None:
+            row = (await db.execute(
+                select(GroupChat.id, GroupChat.name, GroupChat.admin_id).where(GroupChat.name == name)
+            )).first()
+            group = self._remember_group(GroupInfo(*row)) if row else None
+        return group
+
+    async def group_by_id(self, db: AsyncSession, group_id: int) -> Optional[GroupInfo]:
+        group = self.groups_by_id.get(group_id)
+        if group is None:
+            row = (await db.execute(
+                select(GroupChat.id, GroupChat.name, GroupChat.admin_id).where(GroupChat.id == group_id)
+            )).first()
+            group = self._remember_group(GroupInfo(*row)) if row else None
+        return group
+
+    def members_generation(self, group_id: int) -> Tuple[int, int]:
+        """Changes whenever the group's cached member ids are invalidated; compare before caching a load."""
+        return self._clears, self._member_generations.get(group_id, 0)
+
+    def _forget_members(self, group_id: int):
+        self._member_generations[group_id] = self._member_generations.get(group_id, 0) + 1
+        self.members.pop(group_id)
+
+    def clear(self):
+        self._clears += 1
+        for cache in (self.users_by_name, self.users_by_id, self.groups_by_name, self.groups_by_id, self.members):
+            cache.clear()
+
+    def invalidate_members(self, group_id: int):
+        self.backplane.publish_nowait("invalidate", {"group_id": group_id, "members_only": True})
+
+    def invalidate_group(self, group_id: Optional[int] = None, name: Optional[str] = None):
+        """Forget a group's metadata and members after it was created, renamed or deleted."""
+        self.backplane.publish_nowait("invalidate", {"group_id": group_id, "name": name, "members_only": False})
+
+    def _apply_invalidation(self, payload: dict):
+        group_id, name = payload.get("group_id"), payload.get("name")
+        if payload.get("members_only"):
+            self._forget_members(group_id)
+            return
+        if group_id is None and name is not None:
+            cached = self.groups_by_name.get(name)
+            group_id = cached.id if cached else None
+        if name is None and group_id is not None:
+            cached = self.groups_by_id.get(group_id)
+            name = cached.name if cached else None
+        if name is not None:
+            self.groups_by_name.pop(name)
+        if group_id is not None:
+            self.groups_by_id.pop(group_id)
+            self._forget_members(group_id)
+
+    def stats(self) -> dict:
+        return {
+            "users_by_name": self.users_by_name.stats(),
+            "users_by_id": self.users_by_id.stats(),
+            "groups_by_name": self.groups_by_name.stats(),
+            "groups_by_id": self.groups_by_id.stats(),
+            "members": self.members.stats(),
+        }
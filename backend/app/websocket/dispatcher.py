@@ -0,0 +1,106 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, NamedTuple, Type
+
+from pydantic import BaseModel, ValidationError
+from starlette.websockets import WebSocket, WebSocketDisconnect
+
+from app.utils.histogram import LatencyHistogram
+from app.utils.metrics import current_action
+from app.websocket.ratelimit import RateLimiter, RateLimitMode
+
+
+class Action(NamedTuple):
+    handler: Callable[..., Awaitable[None]]
+    model: Type[BaseModel]
+    uses_db: bool
+
+
+class ActionDispatcher:
+    """Maps action names to handlers; validates and rate-limits each frame before any database work.
+
+    Handlers are registered with the `action` decorator and called as
+    handler(websocket, payload, db), where payload is the validated model instance and db
+    a session opened only once the frame has passed validation and the rate limits.
+    Actions registered with db=False get None instead of a session.
+    """
+
+    def __init__(self, connection_manager, session_factory: Callable, limiter: RateLimiter = None):
+        self.connection_manager = connection_manager
+        self.session_factory = session_factory
+        self.limiter = limiter or RateLimiter()
+        self.actions: Dict[str, Action] = {}
+        self.latency: Dict[str, LatencyHistogram] = {}
+        self.rejected: Dict[str, int] = {}
+        self.failed: Dict[str, int] = {}
+
+    def action(self, name: str, model: Type[BaseModel], db: bool = True):
+        def register(handler):
+            self.actions[name] = Action(handler, model, db)
+            self.latency[name] = LatencyHistogram()
+            self.rejected[name] = 0
+            self.failed[name] = 0
+            return handler
+        return register
+
+    async def dispatch(self, websocket: WebSocket, message: dict):
+        name = message.get("action")
+        action = self.actions.get(name)
+        if action is None:
+            await self.connection_manager.send_personal_message("Unknown action", websocket)
+            return
+        try:
+            payload = action.model.model_validate(message.get("data") or {})
+        except ValidationError as e:
+            self.rejected[name] += 1
+            await self.connection_manager.send_personal_json({
+                "content": f"Invalid payload for {name}",
+                "errors": e.errors(include_url=False, include_context=False, include_input=False),
+            }, websocket)
+            return
+
+        if not await self._within_rate_limits(websocket, name, payload):
+            return
+
+        started = time.perf_counter()
+        # Lets the database hooks count this action's queries
+        token = current_action.set(name)
+        try:
+            if action.uses_db:
+                async with self.session_factory() as db:
+                    await action.handler(websocket, payload, db)
+            else:
+                await action.handler(websocket, payload, None)
+        except Exception:
+            self.failed[name] += 1
+            raise
+        finally:
+            current_action.reset(token)
+            self.latency[name].observe(time.perf_counter() - started)
+
+    async def _within_rate_limits(self, websocket: WebSocket, name: str, payload: BaseModel) -> bool:
+        user_info = self.connection_manager.get_user_info(websocket)
+        decision = self.limiter.acquire(name, websocket,
+                                        user=user_info["username"] if user_info else None,
+                                        room=getattr(payload, "room", None))
+        if decision.allowed:
+            if decision.wait:
+                # Not reading the next frame meanwhile pushes back on the client's TCP window
+                await asyncio.sleep(decision.wait)
+            return True
+        if self.limiter.mode == RateLimitMode.DISCONNECT:
+            self.connection_manager.disconnect(websocket)
+            await websocket.close(code=1008, reason="Rate limit exceeded")
+            raise WebSocketDisconnect(code=1008, reason="Rate limit exceeded")
+        await self.connection_manager.send_personal_json({
+            "content": f"Rate limit exceeded for {name}",
+            "retry_after": round(decision.wait, 3),
+        }, websocket)
+        return False
+
+    def stats(self) -> dict:
+        """Latency percentiles plus rejected (invalid payload) and failed counts per action."""
+        return {
+            name: {**self.latency[name].stats(), "rejected": self.rejected[name], "failed": self.failed[name]}
+            for name in self.actions
+        }
@@ -0,0 +1,159 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional, Sequence
+
+from app.utils.metrics import registry
+from app.websocket.rooms import RoomKey
+
+logger = logging.getLogger(__name__)
+
+# Rooms with at least this many local members are fanned out by the worker tasks
+LARGE_ROOM_THRESHOLD = int(os.getenv("LARGE_ROOM_THRESHOLD", "500"))
+# Recipients handled before a worker yields to the event loop
+FANOUT_SHARD_SIZE = int(os.getenv("FANOUT_SHARD_SIZE", "256"))
+FANOUT_WORKERS = int(os.getenv("FANOUT_WORKERS", "4"))
+# Messages waiting per worker; beyond that the backlog is delivered inline (backpressure on the sender)
+FANOUT_QUEUE_SIZE = int(os.getenv("FANOUT_QUEUE_SIZE", "1000"))
+
+large_fanout_duration = registry.histogram(
+    "chat_ws_large_fanout_duration_seconds",
+    "Time from a large-room message being handed off until every local member has it queued",
+)
+
+
+class _Job:
+    __slots__ = ("room", "members", "message", "coalesce_key", "submitted", "position", "frames", "finished")
+
+    def __init__(self, room: RoomKey, members: Sequence, message: dict, coalesce_key: Optional[str]):
+        self.room = room
+        self.members = members
+        self.message = message
+        self.coalesce_key = coalesce_key
+        self.submitted = time.perf_counter()
+        self.position = 0  # Members before this index already have the message queued
+        self.frames = {}
+        self.finished = False
+
+
+class ShardedFanout:
+    """Delivers messages of large rooms from a bounded set of worker tasks.
+
+    The caller hands over a snapshot of the room's members and returns at once; a
+    worker then walks the members in shards of `shard_size`, yielding to the event loop
+    after each shard so the sender's socket and everyone else keep being served.
+    A room always maps to the same worker and each worker runs its messages in order,
+    so members still get a room's messages in the order they were sent; different
+    large rooms fan out concurrently on different workers.
+    """
+
+    def __init__(self, deliver: Callable[[Sequence, dict, Optional[str], dict], None],
+                 threshold: int = LARGE_ROOM_THRESHOLD, shard_size: int = FANOUT_SHARD_SIZE,
+                 workers: int = FANOUT_WORKERS, max_pending: int = FANOUT_QUEUE_SIZE):
+        # deliver(members, message, coalesce_key, frames) queues the message for those members;
+        # `frames` caches the encoded message per codec across the shards of one message
+        self.deliver = deliver
+        self.threshold = threshold
+        self.shard_size = shard_size
+        self.max_pending = max_pending
+        self._queues: List[deque] = [deque() for _ in range(workers)]
+        # Job each worker is in the middle of, so a backed-up worker can be drained in order
+        self._current: List[Optional[_Job]] = [None] * workers
+        # Unfinished jobs per room: such a room stays on its worker even if it shrank meanwhile
+        self._pending_rooms: Dict[RoomKey, int] = {}
+        self._ready: List[asyncio.Event] = []
+        self._tasks: List[asyncio.Task] = []
+        self.handed_off = 0
+        self.inline = 0
+
+    def handles(self, room: RoomKey, members: int) -> bool:
+        """Whether a message for the room goes through the workers (large, or still has messages queued)."""
+        return members >= self.threshold or room in self._pending_rooms
+
+    def submit(self, room: RoomKey, members: Sequence, message: dict, coalesce_key: Optional[str] = None):
+        """Queue a message for the room's worker and return without delivering anything.
+
+        When that worker is backed up, its backlog and this message are delivered inline
+        instead, in order, which slows the sender down rather than growing the queue.
+        """
+        if not self._tasks:
+            self._start()
+        index = hash(room) % len(self._queues)
+        queue = self._queues[index]
+        job = _Job(room, members, message, coalesce_key)
+        queue.append(job)
+        self._pending_rooms[room] = self._pending_rooms.get(room, 0) + 1
+        if len(queue) > self.max_pending:
+            self.inline += 1
+            self._drain(index)
+            return
+        self.handed_off += 1
+        self._ready[index].set()
+
+    def _start(self):
+        # Started on first use, from inside the running event loop
+        self._ready = [asyncio.Event() for _ in self._queues]
+        self._tasks = [asyncio.create_task(self._run(index)) for index in range(len(self._queues))]
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+    def _finish(self, job: _Job):
+        if job.position < len(job.members):
+            self.deliver(job.members[job.position:], job.message, job.coalesce_key, job.frames)
+            job.position = len(job.members)
+        self._done(job)
+
+    def _done(self, job: _Job):
+        if job.finished:
+            return
+        job.finished = True
+        large_fanout_duration.observe(time.perf_counter() - job.submitted)
+        remaining = self._pending_rooms.pop(job.room) - 1
+        if remaining:
+            self._pending_rooms[job.room] = remaining
+
+    def _drain(self, index: int):
+        """Synchronously complete the worker's current job and everything queued behind it."""
+        if self._current[index] is not None:
+            self._finish(self._current[index])
+        queue = self._queues[index]
+        while queue:
+            self._finish(queue.popleft())
+
+    async def _run(self, index: int):
+        queue, ready = self._queues[index], self._ready[index]
+        while True:
+            if not queue:
+                ready.clear()
+                await ready.wait()
+                continue
+            job = self._current[index] = queue.popleft()
+            try:
+                while job.position < len(job.members):
+                    end = job.position + self.shard_size
+                    self.deliver(job.members[job.position:end], job.message, job.coalesce_key, job.frames)
+                    job.position = end
+                    await asyncio.sleep(0)
+            except Exception:
+                logger.exception("Large-room fan-out failed")
+            finally:
+                # Also when a backed-up submit() already finished the job inline meanwhile
+                self._done(job)
+                self._current[index] = None
+
+    def stats(self) -> dict:
+        return {
+            "threshold": self.threshold,
+            "shard_size": self.shard_size,
+            "workers": len(self._queues),
+            "pending": [len(queue) for queue in self._queues],
+            "rooms_pending": len(self._pending_rooms),
+            "handed_off": self.handed_off,
+            "inline": self.inline,
+            "duration": large_fanout_duration.stats(),
+        }
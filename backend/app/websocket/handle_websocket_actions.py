@@ -1,142 +1,119 @@
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from starlette.websockets import WebSocket
 
-from app.models import User, GroupChat
+from app.database import session_scope
+from app.models import PrivateChat
+from app.websocket import schemas
+from app.websocket.backplane import create_backplane
+from app.websocket.directory import ChatDirectory
+from app.websocket.dispatcher import ActionDispatcher
+from app.websocket.heartbeat import HeartbeatReaper
+from app.websocket.history import fetch_history_page
 from app.websocket.manager import PrivateChatManager, GroupChatManager, ConnectionManager
+from app.websocket.membership import MembershipService
+from app.websocket.persistence import message_writer
+from app.websocket.presence import PresenceTracker
+from app.websocket.rooms import RoomKey
+
+backplane = create_backplane()
+connection_manager = ConnectionManager(backplane)
+chat_directory = ChatDirectory(backplane=backplane)
+membership = MembershipService(chat_directory)
+private_chat_manager = PrivateChatManager(connection_manager, chat_directory, message_writer)
+group_chat_manager = GroupChatManager(connection_manager, chat_directory, message_writer, membership)
+presence = PresenceTracker(connection_manager)
+heartbeat = HeartbeatReaper(connection_manager)
+
+
+dispatcher = ActionDispatcher(connection_manager, session_scope)
 
-connection_manager = ConnectionManager()
-private_chat_manager = PrivateChatManager(connection_manager)
-group_chat_manager = GroupChatManager(connection_manager)
-
-
-async def handle_websocket_action(websocket: WebSocket, message: dict, db: Session):
-    action = message.get("action")
-    data = message.get("data", {})
-    if action == "join_private_chat":
-        await handle_join_private_chat(websocket, data, db)
-    elif action == "send_private_message":
-        chat_id = data.get("chat_id")
-        message_data = data.get("message")
-        if not chat_id or not message_data:
-            await handle_join_private_chat(websocket, data, db)
-        await private_chat_manager.send_private_message(db, chat_id, message_data)
-    elif action == "create_group_chat":
-        await handle_create_group_chat(websocket, data, db)
-    elif action == "add_user_to_group_chat":
-        await handle_add_user_to_group_chat(websocket, data, db)
-    elif action == "send_group_message":
-        await handle_send_group_message(websocket, data, db)
-    elif action == "join_group_chat":
-        await handle_join_group_chat(websocket, data, db)
-    elif action == "remove_user_from_group_chat":
-        await handle_delete_user_from_chat(websocket, data, db)
-    else:
-        await websocket.send_text("Unknown action")
+
+async def handle_websocket_action(websocket: WebSocket, message: dict):
+    """Validate a frame against its action's model, then run the handler in its own session."""
+    await dispatcher.dispatch(websocket, message)
 
 
 # Handlers for specific actions
-async def handle_join_private_chat(websocket: WebSocket, data: dict, db: Session):
-    user1 = data.get("user1")
-    user1 = db.query(User).filter(
-        User.username == user1["username"]
-    ).first()
-    user1_id = user1.id
-    user2_id = data.get("user2_id")
-    if not user1_id or not user2_id:
-        await websocket.send_text("Missing user information for private chat")
+@dispatcher.action("join_private_chat", schemas.JoinPrivateChat)
+async def handle_join_private_chat(websocket: WebSocket, data: schemas.JoinPrivateChat, db: AsyncSession):
+    user1 = await chat_directory.user_by_name(db, data.user1.username)
+    if not user1:
+        await connection_manager.send_personal_message("Missing user information for private chat", websocket)
         return
 
     # Get or create a private chat
-    chat = await private_chat_manager.get_or_create_chat(db, user1_id, user2_id)
+    chat = await private_chat_manager.get_or_create_chat(db, user1.id, data.user2_id)
     # Add the user to the chat's WebSocket connections
     await private_chat_manager.add_user_to_chat(chat.id, websocket)
-    # Send chat history to the client
-    messages = [
-        {"sender_username": db.query(User).filter(
-            User.id == message.sender_id
-        ).first().username,
-         "content": message.content,
-         "timestamp": message.timestamp.isoformat()
-         }
-        for message in chat.messages
-    ]
-    data_to_send = {"chat_id": chat.id, "history": messages}
-    await websocket.send_json(data_to_send)
-
+    # Send the latest page of chat history; older pages are fetched with load_history
+    page = await fetch_history_page(db, "private", chat.id)
+    epoch, seq = connection_manager.replay.position(RoomKey.of("private", chat.id))
+    data_to_send = {"chat_id": chat.id, "history": page["history"], "cursor": page["cursor"],
+                    "epoch": epoch, "seq": seq}
+    await connection_manager.send_personal_json(data_to_send, websocket)
 
-async def handle_create_group_chat(websocket: WebSocket, data: dict, db: Session):
-    admin_id = data.get("admin_id")
-    group_name = data.get("group_name")
 
-    if not admin_id or not group_name:
-        await websocket.send_text("Missing admin_id or group_name for creating group chat")
+@dispatcher.action("send_private_message", schemas.SendPrivateMessage)
+async def handle_send_private_message(websocket: WebSocket, data: schemas.SendPrivateMessage, db: AsyncSession):
+    if not await chat_directory.user_by_name(db, data.message.sender_username):
+        await connection_manager.send_personal_message("Unknown sender for private message", websocket)
         return
+    await private_chat_manager.send_private_message(db, data.chat_id, data.message.model_dump())
+
+
+@dispatcher.action("create_group_chat", schemas.CreateGroupChat)
+async def handle_create_group_chat(websocket: WebSocket, data: schemas.CreateGroupChat, db: AsyncSession):
+    admin_id = data.admin_id
+    group_name = data.group_name
 
     try:
         group_chat = await group_chat_manager.get_or_create_group_chat(admin_id, group_name, db)
-        await websocket.send_text(f"Group chat '{group_name}' created successfully with ID: {group_chat.id}")
+        await connection_manager.send_personal_message(f"Group chat '{group_name}' created successfully with ID: {group_chat.id}", websocket)
     except ValueError as e:
-        await websocket.send_text(f"Error creating group chat: {str(e)}")
+        await connection_manager.send_personal_message(f"Error creating group chat: {str(e)}", websocket)
 
 
-async def handle_join_group_chat(websocket: WebSocket, data: dict, db: Session):
-    user_name = data.get("user_name")
-    group_name = data.get("group_name")
-    user_id = db.query(User).filter(User.username == user_name).first().id
-    group_id = db.query(GroupChat).filter(GroupChat.name == group_name).first().id
-    if not user_id or not group_id:
-        await websocket.send_text("Missing user_id or group_id for joining group chat")
+@dispatcher.action("join_group_chat", schemas.JoinGroupChat)
+async def handle_join_group_chat(websocket: WebSocket, data: schemas.JoinGroupChat, db: AsyncSession):
+    user = await chat_directory.user_by_name(db, data.user_name)
+    group = await chat_directory.group_by_name(db, data.group_name)
+    if not user or not group:
+        await connection_manager.send_personal_message("Missing user_id or group_id for joining group chat", websocket)
         return
+    user_id, group_id = user.id, group.id
 
-    # Fetch the group chat and check if the user is a member
-    group_chat = db.query(GroupChat).filter(GroupChat.id == group_id).first()
-    if not group_chat:
-        await websocket.send_text(f"Group chat with ID {group_id} does not exist.")
-        return
-
-    # Check if the user is part of the group
-    if not any(user.id == user_id for user in group_chat.users) and user_id != group_chat.admin_id:
-        await websocket.send_json({"content": f"User with ID {user_id} is not a member of the group."})
+    # Check if the user is part of the group (cached member ids, no member rows loaded)
+    if not await membership.can_access(db, group, user_id):
+        await connection_manager.send_personal_json({"content": f"User with ID {user_id} is not a member of the group."}, websocket)
         return
     # Add the user to the group chat's WebSocket connections
     await group_chat_manager.add_user_to_group(group_id, user_id, "joining", websocket, db)
 
-    # Retrieve the message history of the group chat
-    messages = [
-        {"sender_username": db.query(User).filter(User.id == message.sender_id).first().username,
-         "content": message.content,
-         "timestamp": message.timestamp.isoformat()}
-        for message in group_chat.messages
-    ]
+    # Send the latest page of the group's history; older pages are fetched with load_history
+    page = await fetch_history_page(db, "group", group_id)
+    epoch, seq = connection_manager.replay.position(RoomKey.of("group", group_id))
+    data_to_send = {"group_id": group_id, "history": page["history"], "cursor": page["cursor"],
+                    "epoch": epoch, "seq": seq}
+    await connection_manager.send_personal_json(data_to_send, websocket)
 
-    # Send the message history to the user
-    data_to_send = {"group_id": group_id, "history": messages}
-    await websocket.send_json(data_to_send)
 
-
-async def handle_add_user_to_group_chat(websocket: WebSocket, data: dict, db: Session):
-    group_name = data.get("group_name")
-    user_id = data.get("user_id")
-    adder_name = data.get("adder_name")  # The user who is trying to add another user
-    user_name = db.query(User).filter(User.id == user_id).first().username
-    group_id = db.query(GroupChat).filter(GroupChat.name == group_name).first().id
-    adder_id = db.query(User).filter(User.username == adder_name).first().id
-    if not group_id or not user_id or not adder_id:
-        await websocket.send_text("Missing group_id, user_id, or adder_id for adding user to group chat")
+@dispatcher.action("add_user_to_group_chat", schemas.AddUserToGroupChat)
+async def handle_add_user_to_group_chat(websocket: WebSocket, data: schemas.AddUserToGroupChat, db: AsyncSession):
+    user_id = data.user_id
+    user = await chat_directory.user_by_id(db, user_id)
+    group = await chat_directory.group_by_name(db, data.group_name)
+    adder = await chat_directory.user_by_name(db, data.adder_name)
+    if not group or not user or not adder:
+        await connection_manager.send_personal_message("Missing group_id, user_id, or adder_id for adding user to group chat", websocket)
         return
+    user_name, group_id, adder_id = user.username, group.id, adder.id
 
     try:
-        # Check if the adder is a member of the group
-        group_chat = db.query(GroupChat).filter(GroupChat.id == group_id).first()
-
-        if not group_chat:
-            raise ValueError("Group chat does not exist")
-
         # Check if the adder is part of the group
-        if not any(user.id == adder_id for user in group_chat.users) and adder_id != group_chat.admin_id:
-            await websocket.send_json({"content": "User is not in the group. You can not add another user to this group"})
+        if not await membership.can_access(db, group, adder_id):
+            await connection_manager.send_personal_json({"content": "User is not in the group. You can not add another user to this group"}, websocket)
             return
-            
+
         # Add the user to the group
         await group_chat_manager.add_user_to_group(group_id, user_id, "adding", websocket, db)
 
@@ -145,42 +122,36 @@ async def handle_add_user_to_group_chat(websocket: WebSocket, data: dict, db: Se
                                                     f"I added {user_name}",
                                                     db)
     except ValueError as e:
-        await websocket.send_text(f"Error adding user to group chat: {str(e)}")
+        await connection_manager.send_personal_message(f"Error adding user to group chat: {str(e)}", websocket)
 
 
-async def handle_send_group_message(websocket: WebSocket, data: dict, db: Session):
-    group_name = data.get("group_id")
-    message = data.get("message")
-    sender_username = message.get("sender_username", None)
-    content = message.get("content", None)
-    group = db.query(GroupChat).filter(GroupChat.name == group_name).first()
-    sender_id = db.query(User).filter(User.username == sender_username).first().id
-    if not any(user.id == sender_id for user in group.users) and sender_id != group.admin_id:
-        await websocket.send_json({"content": "User is not in the group. You can not send messages"})
+@dispatcher.action("send_group_message", schemas.SendGroupMessage)
+async def handle_send_group_message(websocket: WebSocket, data: schemas.SendGroupMessage, db: AsyncSession):
+    # Cached lookups: a steady-state message needs no reads, only the insert
+    group = await chat_directory.group_by_name(db, data.group_id)
+    sender = await chat_directory.user_by_name(db, data.message.sender_username)
+    if not group or not sender:
+        await connection_manager.send_personal_message("Missing group_id or message for group chat", websocket)
         return
-    if not group.id or not message:
-        await websocket.send_text("Missing group_id or message for group chat")
+    if not await membership.can_access(db, group, sender.id):
+        await connection_manager.send_personal_json({"content": "User is not in the group. You can not send messages"}, websocket)
         return
-    await group_chat_manager.send_group_message(group.id, sender_id, content, db)
-
-
-async def handle_delete_user_from_chat(websocket: WebSocket, data: dict, db: Session):
+    await group_chat_manager.send_group_message(group.id, sender.id, data.message.content, db)
 
-    admin_name = data.get('admin_name')
-    user_id = data.get('user_id')
-    group_name = data.get('group_name')
 
-    admin = db.query(User).filter(User.username == admin_name).first()
-    group = db.query(GroupChat).filter(GroupChat.name == group_name).first()
-    user = db.query(User).get(user_id)
-    if user not in group.users:
-        await websocket.send_json({"content": "User is not in the group."})
-        return
+@dispatcher.action("remove_user_from_group_chat", schemas.RemoveUserFromGroupChat)
+async def handle_delete_user_from_chat(websocket: WebSocket, data: schemas.RemoveUserFromGroupChat, db: AsyncSession):
+    admin = await chat_directory.user_by_name(db, data.admin_name)
+    group = await chat_directory.group_by_name(db, data.group_name)
+    user = await chat_directory.user_by_id(db, data.user_id)
     if not group:
-        await websocket.send_json({"content": "There is no such group"})
+        await connection_manager.send_personal_json({"content": "There is no such group"}, websocket)
+        return
+    if not user or not await membership.is_member(db, group.id, user.id):
+        await connection_manager.send_personal_json({"content": "User is not in the group."}, websocket)
         return
     if not admin or admin.id != group.admin_id:
-        await websocket.send_json({"content": "You are not the admin, you cannot delete users."})
+        await connection_manager.send_personal_json({"content": "You are not the admin, you cannot delete users."}, websocket)
         return
 
     await group_chat_manager.delete_user_from_chat(admin_id=admin.id,
@@ -188,3 +159,145 @@ async def handle_delete_user_from_chat(websocket: WebSocket, data: dict, db: Ses
                                                    group_id=group.id,
                                                    db=db)
 
+
+@dispatcher.action("add_users_to_group_chat", schemas.AddUsersToGroupChat)
+async def handle_add_users_to_group_chat(websocket: WebSocket, data: schemas.AddUsersToGroupChat, db: AsyncSession):
+    """Add many users to a group in one statement; the group sees one summary message."""
+    # The adder is the connection's own user, never just a name from the payload
+    if data.adder_name != connection_manager.get_user_info(websocket)["username"]:
+        await connection_manager.send_personal_json({"content": "You can only add users as yourself."}, websocket)
+        return
+    group = await chat_directory.group_by_name(db, data.group_name)
+    adder = await chat_directory.user_by_name(db, data.adder_name)
+    if not group or not adder:
+        await connection_manager.send_personal_message("Missing group or adder for adding users to group chat", websocket)
+        return
+    if not await membership.can_access(db, group, adder.id):
+        await connection_manager.send_personal_json({"content": "User is not in the group. You can not add another user to this group"}, websocket)
+        return
+
+    try:
+        result = await group_chat_manager.add_users_to_group(group.id, adder.id, data.user_ids, db)
+    except ValueError as e:
+        await connection_manager.send_personal_message(f"Error adding users to group chat: {str(e)}", websocket)
+        return
+    await connection_manager.send_personal_json({"type": "members_added", "group_name": group.name, **result}, websocket)
+
+
+@dispatcher.action("remove_users_from_group_chat", schemas.RemoveUsersFromGroupChat)
+async def handle_remove_users_from_group_chat(websocket: WebSocket, data: schemas.RemoveUsersFromGroupChat, db: AsyncSession):
+    """Remove many members in one statement; only the admin may do this."""
+    group = await chat_directory.group_by_name(db, data.group_name)
+    # The admin is the connection's own user, never just a name from the payload
+    admin = None
+    if data.admin_name == connection_manager.get_user_info(websocket)["username"]:
+        admin = await chat_directory.user_by_name(db, data.admin_name)
+    if not group:
+        await connection_manager.send_personal_json({"content": "There is no such group"}, websocket)
+        return
+    if not admin or admin.id != group.admin_id:
+        await connection_manager.send_personal_json({"content": "You are not the admin, you cannot delete users."}, websocket)
+        return
+
+    try:
+        result = await group_chat_manager.remove_users_from_group(admin.id, group.id, data.user_ids, db)
+    except ValueError as e:
+        await connection_manager.send_personal_message(f"Error removing users from group chat: {str(e)}", websocket)
+        return
+    await connection_manager.send_personal_json({"type": "members_removed", "group_name": group.name, **result}, websocket)
+
+
+@dispatcher.action("load_history", schemas.LoadHistory)
+async def handle_load_history(websocket: WebSocket, data: schemas.LoadHistory, db: AsyncSession):
+    """Send the page of messages older than `cursor` for a chat this socket has joined."""
+    chat_type, chat_id = data.chat_type, data.chat_id
+    # Joining the chat already checked access, so the in-memory room is enough here
+    if not connection_manager.is_in_chat(chat_id, chat_type, websocket):
+        await connection_manager.send_personal_json({"content": "Join the chat before loading its history."}, websocket)
+        return
+
+    try:
+        page = await fetch_history_page(db, chat_type, chat_id, data.cursor, data.limit)
+    except ValueError as e:
+        await connection_manager.send_personal_json({"content": str(e)}, websocket)
+        return
+    await connection_manager.send_personal_json({
+        "chat_type": chat_type,
+        "chat_id": chat_id,
+        "history": page["history"],
+        "cursor": page["cursor"],
+    }, websocket)
+
+
+@dispatcher.action("typing", schemas.Typing, db=False)
+async def handle_typing(websocket: WebSocket, data: schemas.Typing, db: None):
+    """Start (or refresh) or stop this user's typing indicator in a joined chat."""
+    if not connection_manager.is_in_chat(data.chat_id, data.chat_type, websocket):
+        await connection_manager.send_personal_json({"content": "Join the chat before typing in it."}, websocket)
+        return
+    username = connection_manager.get_user_info(websocket)["username"]
+    presence.set_typing(RoomKey.of(data.chat_type, data.chat_id), username, data.typing)
+
+
+@dispatcher.action("room_presence", schemas.RoomPresence, db=False)
+async def handle_room_presence(websocket: WebSocket, data: schemas.RoomPresence, db: None):
+    """Send who is currently online and typing in a joined chat."""
+    if not connection_manager.is_in_chat(data.chat_id, data.chat_type, websocket):
+        await connection_manager.send_personal_json({"content": "Join the chat before asking who is in it."}, websocket)
+        return
+    room = RoomKey.of(data.chat_type, data.chat_id)
+    await connection_manager.send_personal_json({
+        "type": "presence",
+        "chat_type": data.chat_type,
+        "chat_id": data.chat_id,
+        "online": presence.online(room),
+        "typing": presence.typing(room),
+    }, websocket)
+
+
+@dispatcher.action("ping", schemas.Ping, db=False)
+async def handle_ping(websocket: WebSocket, data: schemas.Ping, db: None):
+    """Answer a client's keepalive; like every frame, it also counts as activity."""
+    await connection_manager.send_personal_json({"type": "pong"}, websocket)
+
+
+@dispatcher.action("pong", schemas.Pong, db=False)
+async def handle_pong(websocket: WebSocket, data: schemas.Pong, db: None):
+    """Reply to a server ping. Receiving the frame already marked the connection alive."""
+
+
+async def can_access_chat(db: AsyncSession, user_id: int, chat_type: str, chat_id: int) -> bool:
+    """Whether the user takes part in the private chat, or is a member or the admin of the group."""
+    if chat_type == "private":
+        chat = await db.get(PrivateChat, chat_id)
+        return chat is not None and user_id in (chat.user1_id, chat.user2_id)
+    group = await chat_directory.group_by_id(db, chat_id)
+    if not group:
+        return False
+    return await membership.can_access(db, group, user_id)
+
+
+@dispatcher.action("resume", schemas.Resume)
+async def handle_resume(websocket: WebSocket, data: schemas.Resume, db: AsyncSession):
+    """Rejoin a chat after a reconnect and send only what was missed since `last_seq`.
+
+    The gap comes from the replay buffer; if part of it was already evicted, or the room's
+    numbering restarted under another epoch, the newest history page is sent instead
+    (older pages via load_history), as on a fresh join.
+    """
+    user = await chat_directory.user_by_name(db, connection_manager.get_user_info(websocket)["username"])
+    if not user or not await can_access_chat(db, user.id, data.chat_type, data.chat_id):
+        await connection_manager.send_personal_json({"content": "You are not a member of this chat."}, websocket)
+        return
+    room = RoomKey.of(data.chat_type, data.chat_id)
+    # No await between joining and reading the buffer: every message is either replayed or delivered live
+    await connection_manager.add_user_to_chat(data.chat_id, data.chat_type, websocket)
+    missed = connection_manager.replay.since(room, data.epoch, data.last_seq)
+    epoch, seq = connection_manager.replay.position(room)
+    reply = {"type": "resume", "chat_type": data.chat_type, "chat_id": data.chat_id, "epoch": epoch, "seq": seq}
+    if missed is not None:
+        reply["messages"] = missed
+    else:
+        page = await fetch_history_page(db, data.chat_type, data.chat_id)
+        reply.update(history=page["history"], cursor=page["cursor"])
+    await connection_manager.send_personal_json(reply, websocket)
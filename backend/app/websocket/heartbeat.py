@@ -0,0 +1,143 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+from typing import Dict, List, Optional
+
+from fastapi import WebSocket
+
+from app.utils.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# A connection silent for WS_PING_INTERVAL seconds is pinged (and again every interval);
+# one silent for WS_IDLE_TIMEOUT seconds is evicted. 0 disables the reaper
+PING_INTERVAL = float(os.getenv("WS_PING_INTERVAL", "30"))
+IDLE_TIMEOUT = float(os.getenv("WS_IDLE_TIMEOUT", "90"))
+# How often the reaper wakes up; everything due by then is handled in that pass, in batches
+# of WS_REAPER_BATCH connections with a yield to the event loop in between
+REAPER_TICK = float(os.getenv("WS_REAPER_TICK", "1.0"))
+REAPER_BATCH = int(os.getenv("WS_REAPER_BATCH", "2000"))
+
+pings_sent = registry.counter("chat_ws_pings_total", "Heartbeat pings sent to idle connections")
+idle_evictions = registry.counter("chat_ws_idle_evictions_total", "Connections evicted after WS_IDLE_TIMEOUT of silence")
+
+PING = {"type": "ping"}
+
+
+class HeartbeatReaper:
+    """Pings silent connections and evicts the ones that stay silent, so dead sockets
+    stop costing memory and fan-out long before a send to them fails.
+
+    Any inbound frame counts as a sign of life, and recording one only stores a
+    timestamp. Each tracked socket has one entry in a heap ordered by the time it next
+    needs attention; an entry found early (the socket spoke since) is pushed back with
+    its new due time, so a tick only looks at the sockets that are actually due.
+    """
+
+    def __init__(self, connection_manager, ping_interval: float = PING_INTERVAL,
+                 idle_timeout: float = IDLE_TIMEOUT, tick: float = REAPER_TICK, batch: int = REAPER_BATCH):
+        self.connection_manager = connection_manager
+        self.ping_interval = ping_interval
+        self.idle_timeout = idle_timeout
+        self.tick = tick
+        self.batch = batch
+        self.enabled = ping_interval > 0 and idle_timeout > 0
+        self._last_seen: Dict[WebSocket, float] = {}
+        # (due, tie breaker, websocket); entries of forgotten sockets are skipped when popped
+        self._schedule: List[tuple] = []
+        self._counter = itertools.count()
+        self._task: Optional[asyncio.Task] = None
+        self.pings = 0
+        self.evictions = 0
+        if self.enabled:
+            connection_manager.connection_listeners.append(self.connection_changed)
+
+    async def start(self):
+        if self.enabled:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def connection_changed(self, websocket: WebSocket, connected: bool):
+        if connected:
+            now = time.monotonic()
+            self._last_seen[websocket] = now
+            self._push(now + self.ping_interval, websocket)
+        else:
+            self._last_seen.pop(websocket, None)
+
+    def seen(self, websocket: WebSocket):
+        """Record inbound activity; called for every frame, so O(1) and no heap work."""
+        if websocket in self._last_seen:
+            self._last_seen[websocket] = time.monotonic()
+
+    def _push(self, due: float, websocket: WebSocket):
+        heapq.heappush(self._schedule, (due, next(self._counter), websocket))
+
+    def due(self, now: float) -> bool:
+        return bool(self._schedule) and self._schedule[0][0] <= now
+
+    def reap(self, now: float, limit: Optional[int] = None) -> List[WebSocket]:
+        """Ping or evict the connections due by `now` (at most `limit`); returns the evicted sockets."""
+        evicted = []
+        schedule = self._schedule
+        handled = 0
+        while schedule and schedule[0][0] <= now and handled != limit:
+            handled += 1
+            _, _, websocket = heapq.heappop(schedule)
+            last_seen = self._last_seen.get(websocket)
+            if last_seen is None:
+                continue  # Disconnected since it was scheduled
+            idle = now - last_seen
+            if idle >= self.idle_timeout:
+                evicted.append(websocket)
+                continue
+            if idle >= self.ping_interval:
+                sender = self.connection_manager.get_sender(websocket)
+                if sender is not None:
+                    sender.send_json(PING, coalesce_key="ping")
+                    self.pings += 1
+                    pings_sent.inc()
+                due = min(now + self.ping_interval, last_seen + self.idle_timeout)
+            else:
+                due = last_seen + self.ping_interval
+            self._push(due, websocket)
+
+        for websocket in evicted:
+            self._last_seen.pop(websocket, None)
+            self.connection_manager.evict(websocket, "Idle timeout")
+        self.evictions += len(evicted)
+        idle_evictions.inc(len(evicted))
+        return evicted
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.tick)
+            try:
+                now = time.monotonic()
+                evicted = len(self.reap(now, self.batch))
+                while self.due(now):
+                    # Let queued deliveries run between batches
+                    await asyncio.sleep(0)
+                    evicted += len(self.reap(now, self.batch))
+                if evicted:
+                    logger.info("Evicted %s idle websocket connections", evicted)
+            except Exception:
+                logger.exception("Heartbeat reaper failed")
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "ping_interval": self.ping_interval,
+            "idle_timeout": self.idle_timeout,
+            "tracked": len(self._last_seen),
+            "scheduled": len(self._schedule),
+            "pings": self.pings,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,116 @@
+import base64
+import logging
+import os
+from datetime import datetime
+from typing import List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import GroupMessage, PrivateMessage, User
+from app.websocket.persistence import message_writer
+from app.websocket.rooms import GROUP, PRIVATE
+
+logger = logging.getLogger(__name__)
+
+HISTORY_PAGE_SIZE = int(os.getenv("CHAT_HISTORY_PAGE_SIZE", "50"))
+MAX_HISTORY_PAGE_SIZE = 200
+
+# Message model and the column holding its chat id, per room kind
+MESSAGE_TABLES = {
+    PRIVATE: (PrivateMessage, PrivateMessage.chat_id),
+    GROUP: (GroupMessage, GroupMessage.group_id),
+}
+
+
+class HistoryRow(NamedTuple):
+    sender_username: str
+    content: str
+    timestamp: datetime
+    id: int
+
+
+def encode_cursor(timestamp: datetime, message_id: int) -> str:
+    """Opaque cursor pointing at the oldest message of a page."""
+    raw = f"{timestamp.isoformat()}|{message_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        timestamp, message_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(timestamp), int(message_id)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("Invalid history cursor")
+
+
+def history_statement(chat_type: str, chat_id: int, cursor: Optional[str], limit: int):
+    """Newest-first page query: (sender_username, content, timestamp, id) rows older than `cursor`."""
+    if chat_type not in MESSAGE_TABLES:
+        raise ValueError(f"Unknown chat type: {chat_type}")
+    model, chat_column = MESSAGE_TABLES[chat_type]
+    # Plain column rows with the sender joined in: one query, no ORM objects to hydrate
+    statement = (
+        select(User.username, model.content, model.timestamp, model.id)
+        .join(User, User.id == model.sender_id)
+        .where(chat_column == chat_id)
+    )
+    if cursor:
+        before_timestamp, before_id = decode_cursor(cursor)
+        statement = statement.where(tuple_(model.timestamp, model.id) < tuple_(before_timestamp, before_id))
+    return statement.order_by(model.timestamp.desc(), model.id.desc()).limit(limit)
+
+
+async def fetch_history_page(db: AsyncSession, chat_type: str, chat_id: int,
+                             cursor: Optional[str] = None, limit: int = HISTORY_PAGE_SIZE) -> dict:
+    """Return up to `limit` messages older than `cursor` (newest page when no cursor).
+
+    Keyset pagination over (timestamp, id), backed by the (chat, timestamp, id) index,
+    so every page costs the same no matter how old the chat is. Messages come back in
+    chronological order; `cursor` is None once the beginning of the chat is reached.
+    """
+    limit = max(1, min(limit, MAX_HISTORY_PAGE_SIZE))
+    # Fetch one extra row to learn whether an older page exists
+    statement = history_statement(chat_type, chat_id, cursor, limit + 1)
+    pending = []
+    if message_writer.write_behind:
+        # Make buffered messages visible (and wait for an in-flight batch) before reading
+        try:
+            await message_writer.flush()
+        except Exception:
+            logger.exception("Write-behind flush failed, merging buffered messages into the history page")
+        model, chat_column = MESSAGE_TABLES[chat_type]
+        pending = message_writer.pending_rows(model, chat_column.key, chat_id)
+
+    rows = (await db.execute(statement)).all()
+    if pending:
+        rows = await merge_pending_rows(db, rows, pending, cursor, limit + 1)
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    messages = [
+        {"sender_username": sender_username,
+         "content": content,
+         "timestamp": timestamp.isoformat()}
+        for sender_username, content, timestamp, _ in reversed(rows)
+    ]
+    next_cursor = encode_cursor(rows[-1].timestamp, rows[-1].id) if has_more else None
+    return {"history": messages, "cursor": next_cursor}
+
+
+async def merge_pending_rows(db: AsyncSession, rows, pending: List[dict], cursor: Optional[str],
+                             limit: int) -> List[HistoryRow]:
+    """Combine a stored newest-first page with buffered rows that a failed flush left unstored."""
+    if cursor:
+        before = decode_cursor(cursor)
+        pending = [row for row in pending if (row["timestamp"], row["id"]) < before]
+    if not pending:
+        return rows
+    usernames = dict((await db.execute(
+        select(User.id, User.username).where(User.id.in_({row["sender_id"] for row in pending}))
+    )).all())
+    merged = {row.id: HistoryRow(*row) for row in rows}
+    for row in pending:
+        merged.setdefault(row["id"], HistoryRow(usernames.get(row["sender_id"]), row["content"],
+                                                row["timestamp"], row["id"]))
+    return sorted(merged.values(), key=lambda row: (row.timestamp, row.id), reverse=True)[:limit]
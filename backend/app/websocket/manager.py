@@ -1,140 +1,299 @@
-from typing import Dict, List
+import asyncio
+import time
+from typing import Callable, Dict, Iterable, List, Optional
 from datetime import datetime
 from fastapi import WebSocket, HTTPException
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import Session, joinedload
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.models import PrivateChat, PrivateMessage, User, GroupChat, GroupMessage
+from app.websocket.directory import ChatDirectory
+from app.websocket.persistence import MessageWriter
+from app.websocket.backplane import Backplane, InProcessBackplane
+from app.websocket.broadcast import ConnectionSender, OverflowPolicy, DEFAULT_OVERFLOW_POLICY
+from app.websocket.fanout import ShardedFanout
+from app.websocket.membership import MembershipService, add_members, remove_members, summarize_usernames
+from app.websocket.rooms import RoomKey, RoomRegistry
+from app.websocket.protocol import JSON_CODEC
+from app.websocket.replay import ReplayBuffer
 from app.websocket.verify_websocket import verify_connection
+from app.utils.metrics import registry
 
 
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: dict = {}
+# Time the publishing coroutine spends handing one room message to this worker's members
+# (queueing it for small rooms, passing a member snapshot to the fan-out workers for large ones)
+FANOUT_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1)
+fanout_duration = registry.histogram("chat_ws_fanout_duration_seconds",
+                                     "Time to hand a room message to the local members' send queues",
+                                     buckets=FANOUT_BUCKETS)
+fanout_recipients = registry.counter("chat_ws_fanout_recipients_total", "Room messages queued for local members")
+
 
-    async def connect(self, websocket: WebSocket, csrf_token: str, access_token: str):
-        """Connect a WebSocket and associate it with a CSRF token and access token."""
+class ConnectionManager:
+    def __init__(self, backplane: Optional[Backplane] = None):
+        # Per-socket user info only; room membership lives in the room registry
+        self.active_connections: Dict[WebSocket, dict] = {}
+        self.rooms = RoomRegistry()
+        # Outbound queue and writer task of every authenticated socket
+        self.senders: Dict[WebSocket, ConnectionSender] = {}
+        # Room broadcasts go through the backplane so other workers reach their sockets too
+        self.backplane = backplane or InProcessBackplane()
+        self.backplane.subscribe("room", self._deliver_room_frame)
+        # Large rooms are fanned out by worker tasks instead of the publishing coroutine
+        self.fanout = ShardedFanout(self._enqueue_frames)
+        # Recent sequenced messages per room, for clients resuming after a reconnect
+        self.replay = ReplayBuffer(on_evict=self._forget_room)
+        # Called as listener(room, username, joined) whenever a socket joins or leaves a room
+        self.room_listeners: List[Callable[[RoomKey, str, bool], None]] = []
+        # Called as listener(websocket, connected) when a socket is authenticated or dropped
+        self.connection_listeners: List[Callable[[WebSocket, bool], None]] = []
+
+    async def connect(self, websocket: WebSocket, csrf_token: str, access_token: str,
+                      overflow_policy: OverflowPolicy = DEFAULT_OVERFLOW_POLICY, codec=JSON_CODEC):
+        """Connect a WebSocket and associate it with a CSRF token and access token.
+
+        Returns False, after closing the socket, when authentication fails.
+        """
         try:
             username = await verify_connection(websocket, access_token)
-            if not username:
-                raise HTTPException(status_code=401, detail="Invalid access token")
             # Store the username and csrf_token with the WebSocket
             self.active_connections[websocket] = {
                 "username": username,
                 "csrf_token": csrf_token
             }
+            sender = ConnectionSender(websocket, self._drop_connection, policy=overflow_policy, codec=codec)
+            self.senders[websocket] = sender
+            sender.start()
+            for listener in self.connection_listeners:
+                listener(websocket, True)
+            return True
         except HTTPException as e:
             await websocket.close(code=1008, reason=f"Authentication failed: {e.detail}")
         except Exception as e:
             await websocket.close(code=1008, reason="Unexpected error")
+        return False
 
     def disconnect(self, websocket: WebSocket):
-        """Disconnect the WebSocket and remove it from active connections."""
-        websocket_to_delete = websocket
-        self.active_connections.pop(websocket_to_delete, None)
-        for key, values in self.active_connections.items():
-            if isinstance(values, list) and websocket_to_delete in values:
-                values.remove(websocket_to_delete)
+        """Disconnect the WebSocket and remove it from active connections and its rooms."""
+        info = self.active_connections.pop(websocket, None)
+        rooms = self.rooms.leave_all(websocket)
+        for room in rooms:
+            if room not in self.replay:
+                self._forget_room(room)
+        if info is not None:
+            for room in rooms:
+                self._notify_room_listeners(room, info["username"], False)
+            for listener in self.connection_listeners:
+                listener(websocket, False)
+        sender = self.senders.pop(websocket, None)
+        if sender is not None:
+            sender.stop()
+
+    def _forget_room(self, room: RoomKey):
+        """Drop the room's sequence counter once it has no local members and no buffered messages.
+
+        Nobody can resume from it then: a client holding an older seq gets history instead.
+        """
+        if not self.rooms.members(room) and room not in self.replay:
+            self.backplane.forget_seq(str(room))
+
+    def _drop_connection(self, websocket: WebSocket, reason: str):
+        """Called by a sender whose client failed or fell too far behind."""
+        self.disconnect(websocket)
+        asyncio.create_task(self._close_quietly(websocket, reason))
+
+    def evict(self, websocket: WebSocket, reason: str):
+        """Drop a connection that stopped responding and close it as going away."""
+        self.disconnect(websocket)
+        asyncio.create_task(self._close_quietly(websocket, reason, code=1001))
+
+    @staticmethod
+    async def _close_quietly(websocket: WebSocket, reason: str, code: int = 1011):
+        try:
+            await websocket.close(code=code, reason=reason)
+        except Exception:
+            pass
 
     async def send_personal_message(self, message: str, websocket: WebSocket):
         """Send a personal message to a specific WebSocket."""
-        await websocket.send_text(message)
+        sender = self.senders.get(websocket)
+        if sender is None:
+            await websocket.send_text(message)
+        else:
+            sender.send_notice(message)
+
+    async def send_personal_json(self, message: dict, websocket: WebSocket):
+        """Send a personal JSON message to a specific WebSocket."""
+        sender = self.senders.get(websocket)
+        if sender is None:
+            await websocket.send_json(message)
+        else:
+            sender.send_json(message)
+
+    def get_sender(self, websocket: WebSocket) -> Optional[ConnectionSender]:
+        return self.senders.get(websocket)
+
+    def queue_stats(self) -> List[dict]:
+        """Outbound queue depth and drop counters of every connection, slowest first."""
+        stats = [
+            {"username": self.active_connections.get(websocket, {}).get("username"), **sender.stats()}
+            for websocket, sender in self.senders.items()
+        ]
+        stats.sort(key=lambda item: (item["queue_depth"], item["dropped"]), reverse=True)
+        return stats
 
     def get_user_info(self, websocket: WebSocket):
         """Retrieve user information associated with the WebSocket."""
         return self.active_connections.get(websocket, None)
 
-    async def send_message_to_chat(self, chat_id: int, type_of_connection: str, message: dict):
-        """Send a message to all WebSocket connections in the specified chat."""
-        if type_of_connection == "private":
-            if f"private_{chat_id}" in self.active_connections:
-                message["timestamp"] = datetime.now().isoformat()
-                connections = self.active_connections[f"private_{chat_id}"]
-                for websocket in connections:
-                    await websocket.send_json(message)
-        if type_of_connection == "group":
-            if f"group_{chat_id}" in self.active_connections:
-                message["timestamp"] = datetime.now().isoformat()
-                connections = self.active_connections[f"group_{chat_id}"]
-                for websocket in connections:
-                    await websocket.send_json(message)
+    async def send_message_to_chat(self, chat_id: int, type_of_connection: str, message: dict,
+                                   coalesce_key: Optional[str] = None, replayable: bool = True):
+        """Send a message to all WebSocket connections in the specified chat, on every worker.
+
+        Replayable messages get the room's next sequence number and are kept in the replay
+        buffer; ephemeral ones (presence, typing) do not. If the shared counter cannot be
+        reached the message goes out unnumbered and every worker forgets the room's buffer,
+        so a resume across the gap gets history. Frames sharing a coalesce_key may replace
+        each other in a slow client's queue.
+        """
+        room = RoomKey.of(type_of_connection, chat_id)
+        if not replayable and self.backplane.is_local and not self.rooms.members(room):
+            return
+        # The caller's dict is left untouched
+        message = {**message, "timestamp": datetime.now().isoformat()}
+        payload = {"room": list(room), "message": message, "coalesce_key": coalesce_key}
+        if replayable:
+            numbered = await self.backplane.next_seq(str(room))
+            if numbered is not None:
+                message["epoch"], message["seq"] = numbered
+            else:
+                payload["replay_gap"] = True
+        await self.backplane.publish("room", payload)
+
+    def send_to_local_members(self, chat_id: int, type_of_connection: str, message: dict,
+                              coalesce_key: Optional[str] = None):
+        """Send an unsequenced message to this worker's sockets in the chat only."""
+        room = RoomKey.of(type_of_connection, chat_id)
+        if not self.rooms.members(room):
+            return
+        self._deliver_room_frame({"room": list(room), "message": {**message, "timestamp": datetime.now().isoformat()},
+                                  "coalesce_key": coalesce_key})
+
+    def _deliver_room_frame(self, payload: dict):
+        """Backplane handler: hand a room message to this worker's members of the room."""
+        started = time.perf_counter()
+        room = RoomKey.of(*payload["room"])
+        message = payload["message"]
+        if "seq" in message:
+            self.replay.append(room, message["epoch"], message["seq"], message)
+        elif payload.get("replay_gap"):
+            self.replay.discard(room)
+        # A snapshot: enqueueing may drop an overflowing member from the room mid-loop,
+        # and large rooms keep their shards stable while members join and leave meanwhile
+        connections = tuple(self.rooms.members(room))
+        coalesce_key = payload.get("coalesce_key")
+        if self.fanout.handles(room, len(connections)):
+            self.fanout.submit(room, connections, message, coalesce_key)
+        else:
+            self._enqueue_frames(connections, message, coalesce_key, {})
+        fanout_recipients.inc(len(connections))
+        fanout_duration.observe(time.perf_counter() - started)
+
+    def _enqueue_frames(self, connections, message: dict, coalesce_key: Optional[str], frames: dict):
+        """Queue a message for the given sockets; `frames` caches its encoding per codec."""
+        # Enqueue only: every connection's writer task delivers at its own pace
+        for websocket in connections:
+            sender = self.senders.get(websocket)
+            if sender is None:
+                continue
+            frame = frames.get(sender.codec.name)
+            if frame is None:
+                frame = frames[sender.codec.name] = sender.codec.encode(message)
+            sender.send_frame(frame, coalesce_key)
 
     async def add_user_to_chat(self, chat_id: int, type_of_connection: str, websocket: WebSocket):
         """Add a WebSocket connection to a specific chat."""
-        if type_of_connection == "private":
-            chat_code = f"private_{chat_id}"
-            if chat_code not in self.active_connections:
-                self.active_connections[chat_code] = []
-            self.active_connections[chat_code].append(websocket)
-        if type_of_connection == "group":
-            chat_code = f"group_{chat_id}"
-            if chat_code not in self.active_connections:
-                self.active_connections[chat_code] = []
-            self.active_connections[chat_code].append(websocket)
+        room = RoomKey.of(type_of_connection, chat_id)
+        info = self.active_connections.get(websocket)
+        if self.rooms.join(room, websocket) and info is not None:
+            self._notify_room_listeners(room, info["username"], True)
+
+    def _notify_room_listeners(self, room: RoomKey, username: str, joined: bool):
+        for listener in self.room_listeners:
+            listener(room, username, joined)
+
+    def is_in_chat(self, chat_id: int, type_of_connection: str, websocket: WebSocket) -> bool:
+        """Check whether the WebSocket has joined the specified chat."""
+        return self.rooms.is_member(RoomKey.of(type_of_connection, chat_id), websocket)
 
 
 class PrivateChatManager:
-    def __init__(self, connection_manager: ConnectionManager):
+    def __init__(self, connection_manager: ConnectionManager, directory: ChatDirectory, writer: MessageWriter):
         self.connection_manager = connection_manager
+        self.directory = directory
+        self.writer = writer
         self.private_chats: Dict[str, List[WebSocket]] = {}
 
     async def add_user_to_chat(self, chat_id: int, websocket):
         # Manage adding users to a specific chat (e.g., WebSocket connections)
         await self.connection_manager.add_user_to_chat(chat_id, "private", websocket)
 
-    async def send_private_message(self, db: Session, chat_id: int, message: dict):
+    async def send_private_message(self, db: AsyncSession, chat_id: int, message: dict):
         # Save the message in the database
-        sender = db.query(User).filter(
-            User.username == message["sender_username"]
-        ).first()
-        private_message = PrivateMessage(
+        sender = await self.directory.user_by_name(db, message["sender_username"])
+        await self.writer.save(
+            db,
+            PrivateMessage,
             chat_id=chat_id,
             sender_id=sender.id,
             content=message["content"],
             timestamp=datetime.now()
         )
-        db.add(private_message)
-        db.commit()
-        db.refresh(private_message)
         # Forward the message to connected users
         await self.connection_manager.send_message_to_chat(chat_id, "private", message)
 
-    async def get_or_create_chat(self, db: Session, user1_id: int, user2_id: int):
-        # Filter existing private chats
-        chat = (
-            db.query(PrivateChat)
-            .filter(
-                (PrivateChat.user1_id == user1_id) & (PrivateChat.user2_id == user2_id) |
-                (PrivateChat.user1_id == user2_id) & (PrivateChat.user2_id == user1_id)
-            )
-            .first()
-        )
+    async def get_or_create_chat(self, db: AsyncSession, user1_id: int, user2_id: int):
+        # Pairs are stored ordered, so the lookup is a single probe of the unique pair index
+        user1_id, user2_id = sorted((user1_id, user2_id))
+        chat = await db.scalar(private_chat_lookup(user1_id, user2_id))
         if chat:
             return chat  # Return the existing chat
 
         # Create a new chat if not found
         new_chat = PrivateChat(user1_id=user1_id, user2_id=user2_id)
         db.add(new_chat)
-        db.commit()
-        db.refresh(new_chat)
+        try:
+            await db.commit()
+        except IntegrityError:
+            # The other user opened the same chat concurrently
+            await db.rollback()
+            return await db.scalar(private_chat_lookup(user1_id, user2_id))
+        await db.refresh(new_chat)
         return new_chat
 
 
+def private_chat_lookup(user1_id: int, user2_id: int):
+    """Select the private chat of an ordered (user1_id < user2_id) pair."""
+    return select(PrivateChat).where(PrivateChat.user1_id == user1_id, PrivateChat.user2_id == user2_id)
+
+
 class GroupChatManager:
-    def __init__(self, connection_manager: ConnectionManager):
+    def __init__(self, connection_manager: ConnectionManager, directory: ChatDirectory, writer: MessageWriter,
+                 membership: Optional[MembershipService] = None):
         self.connection_manager = connection_manager
+        self.directory = directory
+        self.writer = writer
+        self.membership = membership or MembershipService(directory)
 
-    async def get_or_create_group_chat(self, admin_id: int, name: str, db: Session):
+    async def get_or_create_group_chat(self, admin_id: int, name: str, db: AsyncSession):
         # Validate input
-        if not db.query(User).filter(User.id == admin_id).first():
+        if not await db.get(User, admin_id):
             raise ValueError("Invalid admin_id")
 
         # Try to find an existing group chat
-        group_chat = (
-            db.query(GroupChat)
-            .filter(GroupChat.admin_id == admin_id, GroupChat.name == name)
-            .options(joinedload(GroupChat.users), joinedload(GroupChat.messages))  # Preload relationships
-            .first()
+        group_chat = await db.scalar(
+            select(GroupChat).where(GroupChat.admin_id == admin_id, GroupChat.name == name)
         )
 
         if group_chat:
@@ -145,64 +304,62 @@ class GroupChatManager:
         db.add(new_group_chat)
 
         try:
-            db.commit()
-            db.refresh(new_group_chat)
+            await db.commit()
+            await db.refresh(new_group_chat)
         except IntegrityError:
-            db.rollback()
+            await db.rollback()
             raise ValueError("Group name already exists for this admin")
+        self.directory.invalidate_group(new_group_chat.id, name)
 
         return new_group_chat
 
-    async def add_user_to_group(self, group_id: int, user_id: int, type_of_action: str, websocket: WebSocket, db: Session):
+    async def add_user_to_group(self, group_id: int, user_id: int, type_of_action: str, websocket: WebSocket, db: AsyncSession):
         """Add a user to a group chat and persist the membership in the database."""
-        # Fetch the group from the database
-        group_chat = db.query(GroupChat).filter(GroupChat.id == group_id).first()
-        if not group_chat:
+        group = await self.directory.group_by_id(db, group_id)
+        if not group:
             raise ValueError(f"Group with id {group_id} does not exist.")
 
-        # Fetch the user from the database
-        user = db.query(User).filter(User.id == user_id).first()
+        user = await self.directory.user_by_id(db, user_id)
         if not user:
             raise ValueError(f"User with id {user_id} does not exist.")
 
         # Check if the user is already a member of the group
-        if user not in group_chat.users and user.id != group_chat.admin_id:
+        if not await self.membership.can_access(db, group, user_id):
             try:
-                group_chat.users.append(user)
-                db.commit()
+                await add_members(db, group_id, group.admin_id, [user_id])
+                await db.commit()
             except IntegrityError:
-                db.rollback()
+                await db.rollback()
                 raise ValueError(f"Failed to add user {user_id} to group {group_id} due to a database error.")
+            self.directory.invalidate_members(group_id)
 
         # Add the user's WebSocket connection to the in-memory group structure
         if type_of_action == "joining":
             await self.connection_manager.add_user_to_chat(group_id, "group", websocket)
 
-    async def send_group_message(self, group_id: int, sender_id: int, message_text: str, db: Session):
+    async def send_group_message(self, group_id: int, sender_id: int, message_text: str, db: AsyncSession):
         """Send a message to a group chat, store it in the database, and broadcast it to group members."""
-        # Fetch the group chat from the database
-        group_chat = db.query(GroupChat).filter(GroupChat.id == group_id).first()
+        # Resolve the group and sender (cached, so a steady-state message only inserts)
+        group_chat = await self.directory.group_by_id(db, group_id)
         if not group_chat:
             raise ValueError(f"Group with id {group_id} does not exist.")
 
-        # Fetch the sender from the database
-        sender = db.query(User).filter(User.id == sender_id).first()
+        sender = await self.directory.user_by_id(db, sender_id)
         if not sender:
             raise ValueError(f"Sender with id {sender_id} does not exist.")
 
         # Persist the message in the database
         try:
-            new_message = GroupMessage(
+            await self.writer.save(
+                db,
+                GroupMessage,
                 group_id=group_id,
                 sender_id=sender_id,
                 content=message_text,
                 timestamp=datetime.now()
             )
-            db.add(new_message)
-            db.commit()
-            db.refresh(new_message)  # Refresh to get the newly created message's ID, etc.
         except IntegrityError:
-            db.rollback()
+            await db.rollback()
             raise ValueError("Failed to save the group message to the database.")
 
         # Broadcast the message to all WebSocket connections in the group
@@ -211,21 +368,62 @@ class GroupChatManager:
             "content": message_text
         })
 
-    async def delete_user_from_chat(self, admin_id: int, user_name: str, group_id: int, db: Session):
-        group = db.query(GroupChat).get(group_id)
-        user = db.query(User).filter(User.username == user_name).first()
+    async def delete_user_from_chat(self, admin_id: int, user_name: str, group_id: int, db: AsyncSession):
+        user = await self.directory.user_by_name(db, user_name)
         if not user:
             raise ValueError("User are not in this group")
 
-        # Remove user from group properly
+        # One DELETE of the membership row, no member list is loaded
         try:
-            group.users.remove(user)  # FIXED removal logic
-            db.commit()
+            removed = await remove_members(db, group_id, [user.id])
+            await db.commit()
         except IntegrityError:
-            db.rollback()
+            await db.rollback()
             raise IntegrityError("Error to delete user from the group")
+        if not removed:
+            raise ValueError("User are not in this group")
+        self.directory.invalidate_members(group_id)
         await self.send_group_message(group_id,
                                       admin_id,
                                       f"I deleted {user.username} from group",
                                       db)
 
+    async def add_users_to_group(self, group_id: int, adder_id: int, user_ids: Iterable[int], db: AsyncSession) -> dict:
+        """Add many users at once and post a single summary message instead of one per user.
+
+        Returns the ids that were added and the ones skipped (unknown users, existing members, the admin).
+        """
+        group = await self.directory.group_by_id(db, group_id)
+        if not group:
+            raise ValueError(f"Group with id {group_id} does not exist.")
+        requested = list(dict.fromkeys(user_ids))
+        try:
+            added = await add_members(db, group_id, group.admin_id, requested)
+            await db.commit()
+        except IntegrityError:
+            await db.rollback()
+            raise ValueError(f"Failed to add users to group {group_id} due to a database error.")
+        return await self._announce_members(group_id, adder_id, requested, added, "added", db)
+
+    async def remove_users_from_group(self, admin_id: int, group_id: int, user_ids: Iterable[int], db: AsyncSession) -> dict:
+        """Remove many members at once and post a single summary message; returns removed and skipped ids."""
+        requested = list(dict.fromkeys(user_ids))
+        try:
+            removed = await remove_members(db, group_id, requested)
+            await db.commit()
+        except IntegrityError:
+            await db.rollback()
+            raise ValueError(f"Failed to remove users from group {group_id} due to a database error.")
+        return await self._announce_members(group_id, admin_id, requested, removed, "removed", db)
+
+    async def _announce_members(self, group_id: int, actor_id: int, requested: List[int], changed: list,
+                                verb: str, db: AsyncSession) -> dict:
+        if changed:
+            self.directory.invalidate_members(group_id)
+            names = summarize_usernames([username for _, username in changed])
+            await self.send_group_message(group_id, actor_id, f"I {verb} {names}", db)
+        changed_ids = {user_id for user_id, _ in changed}
+        return {
+            verb: [user_id for user_id, _ in changed],
+            "skipped": [user_id for user_id in requested if user_id not in changed_ids],
+        }
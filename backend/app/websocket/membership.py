@@ -0,0 +1,134 @@
+import os
+from typing import Iterable, List, Tuple
+
+from sqlalchemy import and_, delete, exists, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database import insert_ignore
+from app.models import User, group_user_association
+from app.websocket.directory import ChatDirectory, GroupInfo
+
+# Most users a single bulk add or remove request may name
+MAX_BULK_MEMBERS = int(os.getenv("MAX_BULK_MEMBERS", "1000"))
+# Groups with more members are not cached as an id set; each check is an EXISTS probe instead
+MEMBER_SET_LIMIT = int(os.getenv("MEMBER_SET_LIMIT", "10000"))
+
+_membership = group_user_association.c
+# Cached in place of the id set of a group above the limit
+_TOO_LARGE = "too_large"
+
+
+def membership_probe(group_id: int, user_id: int):
+    """Select whether the user is a stored member of the group (one primary key lookup)."""
+    return select(exists().where(_membership.group_id == group_id, _membership.user_id == user_id))
+
+
+def member_ids_lookup(group_id: int, limit: int):
+    """Select up to `limit` member ids of the group, read from the primary key index alone."""
+    return select(_membership.user_id).where(_membership.group_id == group_id).limit(limit)
+
+
+class MembershipService:
+    """Answers "is user U in group G" without loading the group's member rows.
+
+    A group's member ids are read once into the directory's members cache, which every
+    membership change invalidates, so checks on the message path are a set lookup.
+    Groups above `set_limit` members are remembered as too large instead, and each of
+    their checks is a single EXISTS probe of the (group_id, user_id) key. Either way a
+    check costs the same however large the group grows.
+    """
+
+    def __init__(self, directory: ChatDirectory, set_limit: int = MEMBER_SET_LIMIT):
+        self.directory = directory
+        self.set_limit = set_limit
+        self.sets_loaded = 0
+        self.probes = 0
+        self.stale_loads = 0
+
+    async def is_member(self, db: AsyncSession, group_id: int, user_id: int) -> bool:
+        """Whether the user is a stored member; the admin is not, see can_access()."""
+        members = self.directory.members.get(group_id)
+        if members is None:
+            members = await self._load(db, group_id)
+        if members is _TOO_LARGE:
+            self.probes += 1
+            return bool(await db.scalar(membership_probe(group_id, user_id)))
+        return user_id in members
+
+    async def can_access(self, db: AsyncSession, group: GroupInfo, user_id: int) -> bool:
+        """Whether the user may read and post in the group: its admin or a member."""
+        return user_id == group.admin_id or await self.is_member(db, group.id, user_id)
+
+    async def _load(self, db: AsyncSession, group_id: int):
+        generation = self.directory.members_generation(group_id)
+        member_ids = (await db.scalars(member_ids_lookup(group_id, self.set_limit + 1))).all()
+        members = frozenset(member_ids) if len(member_ids) <= self.set_limit else _TOO_LARGE
+        # An invalidation that arrived during the query may have made these ids stale already
+        if self.directory.members_generation(group_id) == generation:
+            self.directory.members.set(group_id, members)
+        else:
+            self.stale_loads += 1
+        self.sets_loaded += 1
+        return members
+
+    def stats(self) -> dict:
+        return {"set_limit": self.set_limit, "sets_loaded": self.sets_loaded, "probes": self.probes,
+                "stale_loads": self.stale_loads}
+
+
+def candidates_lookup(group_id: int, user_ids: Iterable[int]):
+    """Select (id, username, member user_id or NULL) of the existing users among `user_ids`."""
+    return (
+        select(User.id, User.username, _membership.user_id)
+        .outerjoin(group_user_association,
+                   and_(_membership.user_id == User.id, _membership.group_id == group_id))
+        .where(User.id.in_(set(user_ids)))
+    )
+
+
+def members_lookup(group_id: int, user_ids: Iterable[int]):
+    """Select (id, username) of the group's members among `user_ids`."""
+    return (
+        select(User.id, User.username)
+        .join(group_user_association, _membership.user_id == User.id)
+        .where(_membership.group_id == group_id, User.id.in_(set(user_ids)))
+    )
+
+
+async def add_members(db: AsyncSession, group_id: int, admin_id: int,
+                      user_ids: Iterable[int]) -> List[Tuple[int, str]]:
+    """Add users to a group with one lookup and one INSERT; returns (id, username) of the users added.
+
+    Unknown users, existing members and the admin (who is never stored as a member) are
+    skipped. Rows that a concurrent request inserted first are skipped by the database.
+    The caller commits.
+    """
+    rows = (await db.execute(candidates_lookup(group_id, user_ids))).all()
+    added = sorted((user_id, username) for user_id, username, member in rows
+                   if member is None and user_id != admin_id)
+    if added:
+        await db.execute(insert_ignore(group_user_association).values(
+            [{"group_id": group_id, "user_id": user_id} for user_id, _ in added]
+        ))
+    return added
+
+
+async def remove_members(db: AsyncSession, group_id: int, user_ids: Iterable[int]) -> List[Tuple[int, str]]:
+    """Remove users from a group with one lookup and one DELETE; returns (id, username) of the users removed.
+
+    Users that are not members are skipped. The caller commits.
+    """
+    removed = sorted((await db.execute(members_lookup(group_id, user_ids))).all())
+    if removed:
+        await db.execute(delete(group_user_association).where(
+            _membership.group_id == group_id,
+            _membership.user_id.in_([user_id for user_id, _ in removed]),
+        ))
+    return [(user_id, username) for user_id, username in removed]
+
+
+def summarize_usernames(usernames: List[str], shown: int = 10) -> str:
+    """Readable list of names for a summary message, e.g. "alice, bob and carol"; long lists end in "and N others"."""
+    if len(usernames) <= shown:
+        return usernames[0] if len(usernames) == 1 else f"{', '.join(usernames[:-1])} and {usernames[-1]}"
+    return f"{', '.join(usernames[:shown])} and {len(usernames) - shown} others"
@@ -0,0 +1,226 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+from sqlalchemy import func, insert, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database import session_scope
+from app.websocket.backplane import BROADCAST_BACKPLANE
+
+logger = logging.getLogger(__name__)
+
+# "strict" commits every message before it is broadcast; "write_behind" broadcasts
+# first and persists messages in batches (single writer process only, ids are
+# allocated in memory, so it falls back to strict with a cross-process backplane)
+MESSAGE_PERSISTENCE = os.getenv("MESSAGE_PERSISTENCE", "strict")
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "200"))
+WRITE_BEHIND_FLUSH_INTERVAL = float(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL", "0.05"))
+# Buffered messages beyond which save() writes through (strictly) instead of buffering
+WRITE_BEHIND_MAX_PENDING = int(os.getenv("WRITE_BEHIND_MAX_PENDING", "10000"))
+# Rows the database refused (e.g. their group was deleted meanwhile), kept for inspection
+WRITE_BEHIND_DEAD_LETTERS = int(os.getenv("WRITE_BEHIND_DEAD_LETTERS", "1000"))
+
+
+class MessageWriter:
+    """Persists chat messages, either synchronously or through a write-behind buffer."""
+
+    def __init__(self, mode: str = MESSAGE_PERSISTENCE, batch_size: int = WRITE_BEHIND_BATCH_SIZE,
+                 flush_interval: float = WRITE_BEHIND_FLUSH_INTERVAL, max_pending: int = WRITE_BEHIND_MAX_PENDING,
+                 dead_letters: int = WRITE_BEHIND_DEAD_LETTERS):
+        if mode not in ("strict", "write_behind"):
+            raise ValueError(f"Unknown message persistence mode: {mode}")
+        self.mode = mode
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        # Pending rows per message model, in insertion order
+        self._pending: Dict[type, List[dict]] = {}
+        self._pending_count = 0
+        self._oldest_pending_at: Optional[float] = None
+        self._next_ids: Dict[type, int] = {}
+        self._id_lock = asyncio.Lock()
+        self._flush_lock = asyncio.Lock()
+        self._batch_ready = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        # (table, row, error) of rows dropped because the database rejected them on their own
+        self.dead_letters: deque = deque(maxlen=dead_letters)
+        self.written = 0
+        self.batches = 0
+        self.failures = 0
+        self.dropped = 0
+        self.write_through = 0
+        self.last_flush_at: Optional[float] = None
+        self.last_flush_seconds = 0.0
+
+    @property
+    def write_behind(self) -> bool:
+        return self.mode == "write_behind"
+
+    @property
+    def pending(self) -> int:
+        return self._pending_count
+
+    async def save(self, db: AsyncSession, model, **values) -> int:
+        """Store one message and return its id.
+
+        In strict mode the row is committed on `db` before this returns. In write-behind
+        mode the id is assigned in memory and the row is only queued for the next batch.
+        """
+        if not self.write_behind:
+            message = model(**values)
+            db.add(message)
+            await db.commit()
+            return message.id
+
+        values["id"] = await self._allocate_id(db, model)
+        if self._pending_count >= self.max_pending:
+            # The buffer is full (the database is slow or failing): write this one through,
+            # which holds the sender until it is stored and fails loudly if it cannot be
+            self.write_through += 1
+            db.add(model(**values))
+            await db.commit()
+            return values["id"]
+        self._pending.setdefault(model, []).append(values)
+        self._pending_count += 1
+        if self._oldest_pending_at is None:
+            self._oldest_pending_at = time.monotonic()
+        if self._pending_count >= self.batch_size:
+            self._batch_ready.set()
+        return values["id"]
+
+    async def _allocate_id(self, db: AsyncSession, model) -> int:
+        if model not in self._next_ids:
+            async with self._id_lock:
+                if model not in self._next_ids:
+                    self._next_ids[model] = (await db.scalar(select(func.max(model.id))) or 0) + 1
+        message_id = self._next_ids[model]
+        self._next_ids[model] += 1
+        return message_id
+
+    async def start(self):
+        if self.write_behind and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """Stop the background flusher and write out everything still buffered."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._batch_ready.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._batch_ready.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Write-behind flush failed, %s messages stay buffered", self._pending_count)
+
+    def pending_rows(self, model, column: str, value) -> List[dict]:
+        """Buffered, not yet stored rows of `model` whose `column` equals `value`."""
+        return [row for row in self._pending.get(model, ()) if row.get(column) == value]
+
+    async def flush(self):
+        """Insert every buffered message, one multi-row INSERT per table, in one transaction.
+
+        If the batch fails, its rows are retried one by one: rows the database rejects
+        on their own are logged and moved to `dead_letters`, so one bad row cannot hold
+        up the rest. Any other error (e.g. the database is unreachable) puts the
+        remaining rows back in front of the buffer for the next flush and is raised.
+        """
+        async with self._flush_lock:
+            if not self._pending_count:
+                return
+            batch, self._pending = self._pending, {}
+            count, oldest = self._pending_count, self._oldest_pending_at
+            self._pending_count, self._oldest_pending_at = 0, None
+            started = time.monotonic()
+            try:
+                async with session_scope() as db:
+                    for model, rows in batch.items():
+                        await db.execute(insert(model), rows)
+                    await db.commit()
+            except Exception:
+                self.failures += 1
+                logger.warning("Write-behind batch of %s messages failed, retrying row by row", count, exc_info=True)
+                await self._flush_rows(batch, oldest)
+            else:
+                self.written += count
+            self.batches += 1
+            self.last_flush_at = time.time()
+            self.last_flush_seconds = time.monotonic() - started
+
+    async def _flush_rows(self, batch: Dict[type, List[dict]], oldest: Optional[float]):
+        rows = [(model, row) for model, model_rows in batch.items() for row in model_rows]
+        done = 0
+        try:
+            async with session_scope() as db:
+                for model, row in rows:
+                    try:
+                        await db.execute(insert(model), [row])
+                        await db.commit()
+                        self.written += 1
+                    except IntegrityError as e:
+                        await db.rollback()
+                        self.dropped += 1
+                        self.dead_letters.append((model.__tablename__, row, str(e.orig)))
+                        logger.error("Dropped message %s for %s: %s", row.get("id"), model.__tablename__, e.orig)
+                    done += 1
+        except Exception:
+            # Not a single row's fault (e.g. the database is unreachable): keep the rest for the next flush
+            self._requeue(rows[done:], oldest)
+            raise
+
+    def _requeue(self, rows: List[tuple], oldest: Optional[float]):
+        """Put rows back in front of anything buffered since they were taken out."""
+        requeued: Dict[type, List[dict]] = {}
+        for model, row in rows:
+            requeued.setdefault(model, []).append(row)
+        for model, model_rows in requeued.items():
+            self._pending[model] = model_rows + self._pending.get(model, [])
+        self._pending_count += len(rows)
+        self._oldest_pending_at = oldest
+
+    def stats(self) -> dict:
+        lag = time.monotonic() - self._oldest_pending_at if self._oldest_pending_at is not None else 0.0
+        return {
+            "mode": self.mode,
+            "pending": self._pending_count,
+            "durability_lag_seconds": round(lag, 4),
+            "written": self.written,
+            "batches": self.batches,
+            "failures": self.failures,
+            "dropped": self.dropped,
+            "write_through": self.write_through,
+            "last_flush_at": self.last_flush_at,
+            "last_flush_seconds": round(self.last_flush_seconds, 4),
+        }
+
+
+def persistence_mode(mode: str = MESSAGE_PERSISTENCE, backplane: str = BROADCAST_BACKPLANE) -> str:
+    """The configured mode, unless write-behind would run in several processes at once.
+
+    Write-behind ids come from a per-process counter, so workers sharing a backplane
+    would hand out the same ids and their batches would collide.
+    """
+    if mode == "write_behind" and backplane != "inprocess":
+        logger.warning("MESSAGE_PERSISTENCE=write_behind needs a single writer process but "
+                       "BROADCAST_BACKPLANE=%s runs several; using strict persistence", backplane)
+        return "strict"
+    return mode
+
+
+message_writer = MessageWriter(persistence_mode())
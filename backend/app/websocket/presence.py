@@ -0,0 +1,238 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, FrozenSet, List, Optional, Set, Tuple
+
+from app.websocket.rooms import RoomKey
+
+logger = logging.getLogger(__name__)
+
+# Presence and typing changes are collected and broadcast at most once per room per interval
+PRESENCE_FLUSH_INTERVAL = float(os.getenv("PRESENCE_FLUSH_INTERVAL", "1.0"))
+# A typing indicator without a refresh for this long counts as stopped
+TYPING_TIMEOUT = float(os.getenv("TYPING_TIMEOUT", "5.0"))
+# With a cross-process backplane: other workers' users are forgotten after this long without
+# a refresh (every worker republishes its full state every third of it)
+PRESENCE_NODE_TTL = float(os.getenv("PRESENCE_NODE_TTL", "30"))
+
+_NOBODY: Tuple[FrozenSet[str], FrozenSet[str]] = (frozenset(), frozenset())
+
+
+class PresenceTracker:
+    """Who is online and who is typing in each room, broadcast as coalesced updates.
+
+    Fed by the connection manager's room listener: a user is online in a room while at
+    least one of their sockets has joined it. Changes only mark the room dirty; a flush
+    loop compares each dirty room with what was last announced and sends one "presence"
+    and/or one "typing" event with the net change. A reconnect or a burst of keystrokes
+    within one interval therefore produces at most one broadcast, and none at all when
+    the net state did not change.
+
+    Every worker announces to its own sockets only. With a cross-process backplane each
+    worker also publishes its local users per room (what changed at each flush, all of
+    it every node_ttl / 3) and merges the other workers' users into what it announces,
+    so a user stays online while any worker holds one of their sockets. A worker that
+    stops refreshing (crashed, cut off) is forgotten after node_ttl.
+    """
+
+    def __init__(self, connection_manager, interval: float = PRESENCE_FLUSH_INTERVAL,
+                 typing_timeout: float = TYPING_TIMEOUT, node_ttl: float = PRESENCE_NODE_TTL):
+        self.connection_manager = connection_manager
+        self.backplane = connection_manager.backplane
+        self.interval = interval
+        self.typing_timeout = typing_timeout
+        self.node_ttl = node_ttl
+        # Sockets per user per room, so a second tab keeps the user online
+        self._online: Dict[RoomKey, Dict[str, int]] = {}
+        # Typing deadline (monotonic) per user per room
+        self._typing: Dict[RoomKey, Dict[str, float]] = {}
+        # State last broadcast per room
+        self._announced_online: Dict[RoomKey, Set[str]] = {}
+        self._announced_typing: Dict[RoomKey, Set[str]] = {}
+        self._dirty: Set[RoomKey] = set()
+        # Other workers' (online, typing, expires) per room and worker, and our state they last got
+        self._remote: Dict[RoomKey, Dict[str, tuple]] = {}
+        self._published: Dict[RoomKey, Tuple[FrozenSet[str], FrozenSet[str]]] = {}
+        self._next_refresh = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self.broadcasts = 0
+        self.published = 0
+        connection_manager.room_listeners.append(self.room_changed)
+        if not self.backplane.is_local:
+            self.backplane.subscribe("presence", self._apply_remote)
+            # Others may have expired us while we were cut off
+            self.backplane.subscribe("resubscribed", self._refresh_soon)
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def room_changed(self, room: RoomKey, username: str, joined: bool):
+        users = self._online.setdefault(room, {})
+        if joined:
+            users[username] = users.get(username, 0) + 1
+        else:
+            remaining = users.get(username, 0) - 1
+            if remaining > 0:
+                users[username] = remaining
+            else:
+                users.pop(username, None)
+                # Leaving also ends typing
+                self._typing.get(room, {}).pop(username, None)
+            if not users:
+                del self._online[room]
+        self._dirty.add(room)
+
+    def set_typing(self, room: RoomKey, username: str, typing: bool):
+        typers = self._typing.setdefault(room, {})
+        if typing:
+            was_typing = username in typers
+            typers[username] = time.monotonic() + self.typing_timeout
+            if was_typing:
+                # Only the deadline moved: nothing to announce
+                return
+        elif typers.pop(username, None) is None:
+            return
+        if not typers:
+            del self._typing[room]
+        self._dirty.add(room)
+
+    def online(self, room: RoomKey) -> List[str]:
+        return sorted(self._merged(room)[0])
+
+    def typing(self, room: RoomKey) -> List[str]:
+        return sorted(self._merged(room)[1])
+
+    def _local(self, room: RoomKey) -> Tuple[FrozenSet[str], FrozenSet[str]]:
+        return frozenset(self._online.get(room, ())), frozenset(self._typing.get(room, ()))
+
+    def _merged(self, room: RoomKey) -> Tuple[Set[str], Set[str]]:
+        online, typing = set(self._online.get(room, ())), set(self._typing.get(room, ()))
+        for remote_online, remote_typing, _ in self._remote.get(room, {}).values():
+            online |= remote_online
+            typing |= remote_typing
+        return online, typing
+
+    def _expire_typing(self, now: float):
+        for room, typers in list(self._typing.items()):
+            expired = [username for username, deadline in typers.items() if deadline <= now]
+            for username in expired:
+                del typers[username]
+            if expired:
+                self._dirty.add(room)
+            if not typers:
+                del self._typing[room]
+
+    def _expire_nodes(self, now: float):
+        for room, nodes in list(self._remote.items()):
+            expired = [node for node, (_, _, expires) in nodes.items() if expires <= now]
+            for node in expired:
+                del nodes[node]
+            if expired:
+                self._dirty.add(room)
+            if not nodes:
+                del self._remote[room]
+
+    def _refresh_soon(self, payload: dict):
+        self._next_refresh = 0.0
+
+    async def _publish(self, dirty: Set[RoomKey], refresh: bool):
+        """Tell the other workers about our users in the rooms that changed, or in every room on a refresh."""
+        rooms = []
+        for room in (dirty | set(self._published)) if refresh else dirty:
+            state = self._local(room)
+            if state == self._published.get(room, _NOBODY) and (not refresh or state == _NOBODY):
+                continue
+            if state == _NOBODY:
+                self._published.pop(room, None)
+            else:
+                self._published[room] = state
+            rooms.append([room.kind, room.chat_id, sorted(state[0]), sorted(state[1])])
+        if rooms:
+            self.published += 1
+            await self.backplane.publish("presence", {"node": self.backplane.node_id, "rooms": rooms})
+
+    def _apply_remote(self, payload: dict):
+        """Backplane handler: another worker's users in the rooms it lists."""
+        node = payload["node"]
+        if node == self.backplane.node_id:
+            return
+        expires = time.monotonic() + self.node_ttl
+        for kind, chat_id, online, typing in payload["rooms"]:
+            room = RoomKey.of(kind, chat_id)
+            nodes = self._remote.setdefault(room, {})
+            if online or typing:
+                nodes[node] = (frozenset(online), frozenset(typing), expires)
+            else:
+                nodes.pop(node, None)
+                if not nodes:
+                    del self._remote[room]
+            self._dirty.add(room)
+
+    async def flush(self):
+        now = time.monotonic()
+        self._expire_typing(now)
+        refresh = not self.backplane.is_local and now >= self._next_refresh
+        if refresh:
+            self._next_refresh = now + self.node_ttl / 3
+            self._expire_nodes(now)
+        dirty, self._dirty = self._dirty, set()
+        if not self.backplane.is_local:
+            # Changes arriving while this awaits are left dirty for the next flush
+            await self._publish(dirty, refresh)
+        for room in dirty:
+            if not self.connection_manager.rooms.members(room):
+                # Nobody here to tell; whoever joins next starts from an empty announced state
+                self._announced_online.pop(room, None)
+                self._announced_typing.pop(room, None)
+                continue
+            online, typing = self._merged(room)
+            announced = self._announced_online.get(room, set())
+            if online != announced:
+                self._broadcast(room, "presence", {
+                    "online": sorted(online - announced),
+                    "offline": sorted(announced - online),
+                })
+                self._remember(self._announced_online, room, online)
+
+            if typing != self._announced_typing.get(room, set()):
+                self._broadcast(room, "typing", {"typing": sorted(typing)})
+                self._remember(self._announced_typing, room, typing)
+
+    @staticmethod
+    def _remember(announced: Dict[RoomKey, Set[str]], room: RoomKey, state: Set[str]):
+        if state:
+            announced[room] = state
+        else:
+            announced.pop(room, None)
+
+    def _broadcast(self, room: RoomKey, event: str, fields: dict):
+        self.broadcasts += 1
+        # Every worker announces the merged state to its own members, so this never crosses the backplane.
+        # Queued updates for the same room and event replace each other on slow connections
+        self.connection_manager.send_to_local_members(room.chat_id, room.kind, {
+            "type": event, "chat_type": room.kind, "chat_id": room.chat_id, **fields,
+        }, coalesce_key=f"{event}:{room}")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Presence flush failed")
+
+    def stats(self) -> dict:
+        return {
+            "rooms_with_presence": len(self._online),
+            "rooms_with_typing": len(self._typing),
+            "pending_rooms": len(self._dirty),
+            "rooms_with_remote_users": len(self._remote),
+            "broadcasts": self.broadcasts,
+            "published": self.published,
+        }
@@ -0,0 +1,104 @@
+import json
+from typing import Iterable, Optional, Union
+
+try:
+    import msgpack
+except ImportError:  # msgpack is optional, clients then stay on the JSON protocol
+    msgpack = None
+
+from fastapi import WebSocket
+
+from app.websocket.serialization import dumps
+
+# Subprotocols a client can request in Sec-WebSocket-Protocol; without one it speaks JSON
+JSON_SUBPROTOCOL = "chat.json"
+MSGPACK_SUBPROTOCOL = "chat.msgpack"
+
+# Short codes a client may send as "a" instead of the "action" string
+ACTION_CODES = {
+    1: "join_private_chat",
+    2: "send_private_message",
+    3: "create_group_chat",
+    4: "add_user_to_group_chat",
+    5: "send_group_message",
+    6: "join_group_chat",
+    7: "remove_user_from_group_chat",
+    8: "load_history",
+    9: "typing",
+    10: "room_presence",
+    11: "resume",
+    12: "ping",
+    13: "pong",
+    14: "add_users_to_group_chat",
+    15: "remove_users_from_group_chat",
+}
+ACTION_NAMES = {name: code for code, name in ACTION_CODES.items()}
+
+Frame = Union[str, bytes]
+
+
+def expand_action(message: dict) -> dict:
+    """Replace a numeric "a" action code with the "action" name the handlers expect."""
+    if "a" in message and "action" not in message:
+        message["action"] = ACTION_CODES.get(message.pop("a"), "unknown")
+    return message
+
+
+class JsonCodec:
+    """The original protocol: JSON objects in text frames, plain strings for notices."""
+
+    name = "json"
+    binary = False
+
+    def __init__(self, subprotocol: Optional[str] = None):
+        self.subprotocol = subprotocol
+
+    def encode(self, payload: dict) -> Frame:
+        return dumps(payload)
+
+    def encode_text(self, text: str) -> Frame:
+        return text
+
+    def decode(self, data: Frame) -> dict:
+        return expand_action(json.loads(data))
+
+    async def receive(self, websocket: WebSocket) -> dict:
+        return self.decode(await websocket.receive_text())
+
+
+class MsgpackCodec:
+    """MessagePack in binary frames; notices are packed strings."""
+
+    name = "msgpack"
+    binary = True
+    subprotocol = MSGPACK_SUBPROTOCOL
+
+    def encode(self, payload: dict) -> Frame:
+        return msgpack.packb(payload, use_bin_type=True)
+
+    def encode_text(self, text: str) -> Frame:
+        return msgpack.packb(text, use_bin_type=True)
+
+    def decode(self, data: Frame) -> dict:
+        message = msgpack.unpackb(data, raw=False)
+        if not isinstance(message, dict):
+            raise ValueError("Expected a MessagePack map")
+        return expand_action(message)
+
+    async def receive(self, websocket: WebSocket) -> dict:
+        return self.decode(await websocket.receive_bytes())
+
+
+JSON_CODEC = JsonCodec()
+CODECS = {JSON_SUBPROTOCOL: JsonCodec(JSON_SUBPROTOCOL)}
+if msgpack is not None:
+    CODECS[MSGPACK_SUBPROTOCOL] = MsgpackCodec()
+
+
+def negotiate(requested: Iterable[str]):
+    """Pick the first supported subprotocol the client asked for, JSON otherwise."""
+    for subprotocol in requested:
+        codec = CODECS.get(subprotocol)
+        if codec is not None:
+            return codec
+    return JSON_CODEC
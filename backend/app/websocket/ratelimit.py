@@ -0,0 +1,176 @@
+import os
+import time
+import weakref
+from collections import OrderedDict
+from enum import Enum
+from typing import Dict, NamedTuple, Optional
+
+
+class RateLimitMode(str, Enum):
+    """What to do with a frame that exceeds one of its rate limits."""
+    REJECT = "reject"  # Answer with an error frame and skip the action
+    DELAY = "delay"  # Hold the connection's receive loop until a token is free
+    DISCONNECT = "disconnect"  # Close the connection with a policy violation
+
+
+class RateLimit(NamedTuple):
+    rate: float  # Tokens refilled per second
+    burst: float  # Bucket capacity
+
+
+CONNECTION, USER, ROOM = "connection", "user", "room"
+
+# Limits per action and scope; "*" applies to every action unless the action overrides the scope
+DEFAULT_RATE_LIMITS: Dict[str, Dict[str, Optional[RateLimit]]] = {
+    "*": {CONNECTION: RateLimit(10, 20), USER: RateLimit(20, 40)},
+    "send_private_message": {ROOM: RateLimit(50, 100)},
+    "send_group_message": {ROOM: RateLimit(50, 100)},
+    "create_group_chat": {USER: RateLimit(1, 5)},
+    # Clients are expected to refresh typing every few seconds, not per keystroke
+    "typing": {CONNECTION: RateLimit(5, 10)},
+}
+
+
+def parse_rate_limits(spec: str) -> Dict[str, Dict[str, Optional[RateLimit]]]:
+    """Parse "action.scope=rate/burst" items separated by commas; "off" disables a limit.
+
+    Example: "*.connection=5/10,send_group_message.room=20/40,load_history.user=off"
+    """
+    limits: Dict[str, Dict[str, Optional[RateLimit]]] = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        try:
+            target, value = item.split("=")
+            action, scope = target.rsplit(".", 1)
+            if scope not in (CONNECTION, USER, ROOM):
+                raise ValueError
+            if value == "off":
+                limit = None
+            else:
+                rate, burst = value.split("/")
+                limit = RateLimit(float(rate), float(burst))
+        except ValueError:
+            raise ValueError(f"Invalid WS_RATE_LIMITS entry: {item!r}")
+        limits.setdefault(action, {})[scope] = limit
+    return limits
+
+
+def _merge(base: dict, overrides: dict) -> dict:
+    merged = {action: dict(scopes) for action, scopes in base.items()}
+    for action, scopes in overrides.items():
+        merged.setdefault(action, {}).update(scopes)
+    return merged
+
+
+RATE_LIMITS = _merge(DEFAULT_RATE_LIMITS, parse_rate_limits(os.getenv("WS_RATE_LIMITS", "")))
+RATE_LIMIT_MODE = RateLimitMode(os.getenv("WS_RATE_LIMIT_MODE", RateLimitMode.REJECT.value))
+# In delay mode a frame that would wait longer than this is rejected instead
+RATE_LIMIT_MAX_DELAY = float(os.getenv("WS_RATE_LIMIT_MAX_DELAY", "2.0"))
+# User and room buckets kept in memory; the least recently used are forgotten first
+RATE_LIMIT_STATE_SIZE = int(os.getenv("WS_RATE_LIMIT_STATE_SIZE", "50000"))
+
+
+class Decision(NamedTuple):
+    allowed: bool  # False: reject (or disconnect) the frame
+    wait: float  # Seconds to hold an allowed frame back (delay mode only)
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, burst: float, now: float):
+        self.tokens = burst
+        self.updated = now
+
+    def refill(self, limit: RateLimit, now: float):
+        self.tokens = min(limit.burst, self.tokens + (now - self.updated) * limit.rate)
+        self.updated = now
+
+    def wait_time(self, limit: RateLimit) -> float:
+        """Seconds until one token is available (0 when it already is)."""
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / limit.rate if limit.rate > 0 else float("inf")
+
+
+class RateLimiter:
+    """Token buckets per connection, per user and per room, checked on every inbound frame.
+
+    Connection buckets live as long as their socket (weak keys); user and room buckets sit
+    in a bounded LRU, so memory stays flat however many users and rooms come and go. A
+    forgotten bucket simply starts full again.
+    """
+
+    def __init__(self, limits: Dict[str, Dict[str, Optional[RateLimit]]] = RATE_LIMITS,
+                 mode: RateLimitMode = RATE_LIMIT_MODE, max_delay: float = RATE_LIMIT_MAX_DELAY,
+                 max_entries: int = RATE_LIMIT_STATE_SIZE):
+        self.limits = limits
+        self.mode = mode
+        self.max_delay = max_delay
+        self.max_entries = max_entries
+        self._action_limits: Dict[str, Dict[str, RateLimit]] = {}
+        self._connections: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+        self._shared: OrderedDict = OrderedDict()
+        self.limited: Dict[str, int] = {}
+
+    def limits_for(self, action: str) -> Dict[str, RateLimit]:
+        limits = self._action_limits.get(action)
+        if limits is None:
+            merged = {**self.limits.get("*", {}), **self.limits.get(action, {})}
+            limits = self._action_limits[action] = {scope: limit for scope, limit in merged.items() if limit}
+        return limits
+
+    def _shared_bucket(self, key: tuple, limit: RateLimit, now: float) -> TokenBucket:
+        bucket = self._shared.get(key)
+        if bucket is None:
+            bucket = self._shared[key] = TokenBucket(limit.burst, now)
+            if len(self._shared) > self.max_entries:
+                self._shared.popitem(last=False)
+        else:
+            self._shared.move_to_end(key)
+        return bucket
+
+    def acquire(self, action: str, connection, user: Optional[str] = None, room: Optional[tuple] = None) -> Decision:
+        """Take one token from every bucket that applies to this frame.
+
+        In delay mode an over-limit frame still takes its tokens (the buckets go into
+        debt) and is allowed with a wait, so later frames queue up behind it; a frame that
+        would wait longer than max_delay is refused like in the other modes.
+        """
+        limits = self.limits_for(action)
+        if not limits:
+            return Decision(True, 0.0)
+        now = time.monotonic()
+        buckets = []
+        for scope, limit in limits.items():
+            if scope == CONNECTION:
+                per_action = self._connections.get(connection)
+                if per_action is None:
+                    per_action = self._connections[connection] = {}
+                bucket = per_action.get(action)
+                if bucket is None:
+                    bucket = per_action[action] = TokenBucket(limit.burst, now)
+            elif scope == USER and user is not None:
+                bucket = self._shared_bucket((USER, user, action), limit, now)
+            elif scope == ROOM and room is not None:
+                bucket = self._shared_bucket((ROOM, room, action), limit, now)
+            else:
+                continue
+            bucket.refill(limit, now)
+            buckets.append((bucket, limit))
+
+        wait = max((bucket.wait_time(limit) for bucket, limit in buckets), default=0.0)
+        if wait:
+            self.limited[action] = self.limited.get(action, 0) + 1
+            if self.mode != RateLimitMode.DELAY or wait > self.max_delay:
+                return Decision(False, wait)
+        for bucket, _ in buckets:
+            bucket.tokens -= 1
+        return Decision(True, wait)
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode.value,
+            "connections": len(self._connections),
+            "shared_buckets": len(self._shared),
+            "limited": dict(self.limited),
+        }
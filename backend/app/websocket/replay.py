@@ -0,0 +1,84 @@
+import os
+from collections import OrderedDict, deque
+from typing import Callable, List, Optional, Tuple
+
+from app.websocket.rooms import RoomKey
+
+# Recent messages kept per room for `resume`, and rooms kept (least recently written are dropped)
+REPLAY_BUFFER_SIZE = int(os.getenv("REPLAY_BUFFER_SIZE", "200"))
+REPLAY_BUFFER_ROOMS = int(os.getenv("REPLAY_BUFFER_ROOMS", "10000"))
+
+
+class ReplayBuffer:
+    """Bounded ring buffer of the latest sequenced messages of each room.
+
+    Lets a reconnecting client fetch exactly the messages it missed. When the gap reaches
+    further back than the buffer, the room was evicted, or the room's counter was restarted
+    under another epoch since the client's last_seq, since() returns None and the caller
+    falls back to database history. `on_evict(room)` is called whenever a room is
+    dropped to make space for another.
+    """
+
+    def __init__(self, size: int = REPLAY_BUFFER_SIZE, max_rooms: int = REPLAY_BUFFER_ROOMS,
+                 on_evict: Optional[Callable[[RoomKey], None]] = None):
+        self.size = size
+        self.max_rooms = max_rooms
+        self.on_evict = on_evict
+        # room -> (epoch, deque of (seq, message))
+        self._rooms: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def append(self, room: RoomKey, epoch: str, seq: int, message: dict):
+        buffered = self._rooms.get(room)
+        if buffered is None:
+            self._rooms[room] = (epoch, deque([(seq, message)], maxlen=self.size))
+            if len(self._rooms) > self.max_rooms:
+                evicted, _ = self._rooms.popitem(last=False)
+                if self.on_evict is not None:
+                    self.on_evict(evicted)
+            return
+        self._rooms.move_to_end(room)
+        if buffered[0] != epoch:
+            # The counter restarted; numbers of the old epoch no longer compare
+            self._rooms[room] = (epoch, deque([(seq, message)], maxlen=self.size))
+        else:
+            buffered[1].append((seq, message))
+
+    def discard(self, room: RoomKey):
+        """Forget a room whose buffered messages no longer cover everything that was sent."""
+        self._rooms.pop(room, None)
+
+    def __contains__(self, room: RoomKey) -> bool:
+        return room in self._rooms
+
+    def position(self, room: RoomKey) -> Tuple[Optional[str], int]:
+        """(epoch, highest seq) buffered for the room, (None, 0) if nothing is."""
+        buffered = self._rooms.get(room)
+        if buffered is None:
+            return None, 0
+        return buffered[0], max(seq for seq, _ in buffered[1])
+
+    def since(self, room: RoomKey, epoch: Optional[str], last_seq: int) -> Optional[List[dict]]:
+        """Messages with seq > last_seq in order, or None if some of them are no longer buffered."""
+        buffered = self._rooms.get(room)
+        if buffered is None or buffered[0] != epoch:
+            self.misses += 1
+            return None
+        entries = buffered[1]
+        seqs = [seq for seq, _ in entries]
+        # Sequence numbers are taken before publishing, so concurrent sends may land out of order
+        if min(seqs) > last_seq + 1 or last_seq > max(seqs):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return [message for seq, message in sorted(entries, key=lambda entry: entry[0]) if seq > last_seq]
+
+    def stats(self) -> dict:
+        return {
+            "rooms": len(self._rooms),
+            "size": self.size,
+            "max_rooms": self.max_rooms,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -0,0 +1,85 @@
+from typing import Dict, NamedTuple, Set
+
+from fastapi import WebSocket
+
+PRIVATE = "private"
+GROUP = "group"
+ROOM_KINDS = (PRIVATE, GROUP)
+
+
+class RoomKey(NamedTuple):
+    """Typed identifier of a chat room, e.g. RoomKey("group", 3)."""
+    kind: str
+    chat_id: int
+
+    @classmethod
+    def of(cls, kind: str, chat_id) -> "RoomKey":
+        if kind not in ROOM_KINDS:
+            raise ValueError(f"Unknown room kind: {kind}")
+        return cls(kind, int(chat_id))
+
+    def __str__(self):
+        return f"{self.kind}_{self.chat_id}"
+
+
+class RoomRegistry:
+    """Room membership of live WebSocket connections.
+
+    Members are kept in sets and every socket has a reverse index of the rooms it
+    joined, so join, leave and membership checks cost O(1) and dropping a socket
+    costs O(rooms of that socket) instead of a scan over every room on the server.
+    """
+
+    def __init__(self):
+        self._members: Dict[RoomKey, Set[WebSocket]] = {}
+        self._rooms_by_socket: Dict[WebSocket, Set[RoomKey]] = {}
+
+    def join(self, room: RoomKey, websocket: WebSocket) -> bool:
+        """Add the socket to the room. Returns False if it was already a member."""
+        members = self._members.setdefault(room, set())
+        if websocket in members:
+            return False
+        members.add(websocket)
+        self._rooms_by_socket.setdefault(websocket, set()).add(room)
+        return True
+
+    def leave(self, room: RoomKey, websocket: WebSocket):
+        """Remove the socket from a single room."""
+        members = self._members.get(room)
+        if members is not None:
+            members.discard(websocket)
+            if not members:
+                del self._members[room]
+        rooms = self._rooms_by_socket.get(websocket)
+        if rooms is not None:
+            rooms.discard(room)
+            if not rooms:
+                del self._rooms_by_socket[websocket]
+
+    def leave_all(self, websocket: WebSocket) -> Set[RoomKey]:
+        """Remove the socket from every room it joined and return those rooms."""
+        rooms = self._rooms_by_socket.pop(websocket, set())
+        for room in rooms:
+            members = self._members.get(room)
+            if members is None:
+                continue
+            members.discard(websocket)
+            if not members:
+                del self._members[room]
+        return rooms
+
+    def members(self, room: RoomKey) -> Set[WebSocket]:
+        """Sockets currently in the room. Callers must not mutate the returned set."""
+        return self._members.get(room, set())
+
+    def rooms_of(self, websocket: WebSocket) -> Set[RoomKey]:
+        return self._rooms_by_socket.get(websocket, set())
+
+    def is_member(self, room: RoomKey, websocket: WebSocket) -> bool:
+        return websocket in self._members.get(room, ())
+
+    def room_count(self) -> int:
+        return len(self._members)
+
+    def room_sizes(self) -> Dict[RoomKey, int]:
+        return {room: len(members) for room, members in self._members.items()}
@@ -0,0 +1,109 @@
+from typing import Literal, Optional
+
+from pydantic import BaseModel, Field
+
+from app.websocket.history import HISTORY_PAGE_SIZE
+from app.websocket.membership import MAX_BULK_MEMBERS
+from app.websocket.rooms import GROUP, PRIVATE
+
+
+# Payloads of the websocket actions (the "data" object of a frame). Unknown keys are ignored.
+# Models of actions that post into a room expose it as `room`, which the per-room rate limit uses.
+
+class UserRef(BaseModel):
+    username: str
+
+
+class ChatMessage(BaseModel):
+    sender_username: str
+    content: str
+
+
+class JoinPrivateChat(BaseModel):
+    user1: UserRef
+    user2_id: int
+
+
+class SendPrivateMessage(BaseModel):
+    chat_id: int
+    message: ChatMessage
+
+    @property
+    def room(self) -> tuple:
+        return PRIVATE, self.chat_id
+
+
+class CreateGroupChat(BaseModel):
+    admin_id: int
+    group_name: str = Field(min_length=1)
+
+
+class AddUserToGroupChat(BaseModel):
+    group_name: str
+    user_id: int
+    adder_name: str  # The user who is trying to add another user
+
+
+class AddUsersToGroupChat(BaseModel):
+    group_name: str
+    user_ids: list[int] = Field(min_length=1, max_length=MAX_BULK_MEMBERS)
+    adder_name: str
+
+
+class SendGroupMessage(BaseModel):
+    group_id: str  # Clients send the group's name here
+    message: ChatMessage
+
+    @property
+    def room(self) -> tuple:
+        return GROUP, self.group_id
+
+
+class JoinGroupChat(BaseModel):
+    user_name: str
+    group_name: str
+
+
+class RemoveUserFromGroupChat(BaseModel):
+    admin_name: str
+    user_id: int
+    group_name: str
+
+
+class RemoveUsersFromGroupChat(BaseModel):
+    admin_name: str
+    user_ids: list[int] = Field(min_length=1, max_length=MAX_BULK_MEMBERS)
+    group_name: str
+
+
+class LoadHistory(BaseModel):
+    chat_type: Literal["private", "group"]
+    chat_id: int
+    cursor: str | None = None
+    limit: int = HISTORY_PAGE_SIZE  # Clamped to MAX_HISTORY_PAGE_SIZE by fetch_history_page
+
+
+class Typing(BaseModel):
+    chat_type: Literal["private", "group"]
+    chat_id: int
+    typing: bool = True
+
+
+class RoomPresence(BaseModel):
+    chat_type: Literal["private", "group"]
+    chat_id: int
+
+
+class Ping(BaseModel):
+    pass
+
+
+class Pong(BaseModel):
+    pass
+
+
+class Resume(BaseModel):
+    chat_type: Literal["private", "group"]
+    chat_id: int
+    last_seq: int = Field(0, ge=0)  # Highest `seq` the client received before it lost the connection
+    epoch: Optional[str] = None  # The `epoch` that came with last_seq
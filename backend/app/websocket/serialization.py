@@ -0,0 +1,27 @@
+import json
+import os
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, the stdlib encoder is the fallback
+    orjson = None
+
+# "auto" uses orjson when it is installed, "json" forces the stdlib encoder
+JSON_BACKEND = os.getenv("WS_JSON_BACKEND", "auto")
+
+
+def _stdlib_dumps(payload) -> str:
+    # Same output format as Starlette's WebSocket.send_json
+    return json.dumps(payload, separators=(",", ":"), ensure_ascii=False)
+
+
+def _orjson_dumps(payload) -> str:
+    return orjson.dumps(payload).decode("utf-8")
+
+
+if orjson is not None and JSON_BACKEND != "json":
+    dumps = _orjson_dumps
+    backend_name = "orjson"
+else:
+    dumps = _stdlib_dumps
+    backend_name = "json"
@@ -1,16 +1,13 @@
+from fastapi import HTTPException
 from starlette.websockets import WebSocket
 
 from app.auth import decode_token
 
 
 async def verify_connection(websocket: WebSocket, access_token: str):
-    try:
-        payload = decode_token(access_token)
-        username = payload.get("sub")
-        if not username:
-            await websocket.close(code=1008, reason="Invalid access token")
-            return
-        return username
-    except Exception as e:
-        await websocket.close(code=1008, reason=f"Authentication failed: {str(e)}")
-        raise
+    """Return the token's username; the caller closes the socket if this raises."""
+    payload = decode_token(access_token)
+    username = payload.get("sub")
+    if not username:
+        raise HTTPException(status_code=401, detail="Invalid access token")
+    return username
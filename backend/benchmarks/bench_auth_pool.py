@@ -0,0 +1,75 @@
+"""Login burst through the auth pool: login latency and event loop stalls meanwhile.
+
+Run from the backend folder:
+    python -m benchmarks.bench_auth_pool --logins 200 --concurrency 50
+
+Posts a burst of concurrent /login requests to the app in-process (httpx over ASGI,
+throwaway SQLite database) while a probe task measures how late the event loop
+wakes it up, which is what websocket traffic sharing the process would feel.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] * 1000
+
+
+async def probe_loop_lag(stop: asyncio.Event, lags: list, interval: float = 0.005):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - started - interval)
+
+
+async def main(args):
+    import httpx
+    from app.auth import auth_pool, BCRYPT_ROUNDS
+    from app.database import async_engine, create_all_tables
+    from app.main import app
+
+    create_all_tables()
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        await client.post("/register/", json={"username": "bench", "email": "bench@example.com", "password": "pw"})
+        slots = asyncio.Semaphore(args.concurrency)
+        latencies, statuses, lags = [], {}, []
+
+        async def login():
+            async with slots:
+                started = time.perf_counter()
+                response = await client.post("/login/", json={"username": "bench", "password": "pw"})
+                latencies.append(time.perf_counter() - started)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        stop = asyncio.Event()
+        probe = asyncio.create_task(probe_loop_lag(stop, lags))
+        started = time.perf_counter()
+        await asyncio.gather(*(login() for _ in range(args.logins)))
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await probe
+
+    pool = auth_pool.stats()
+    print(f"bcrypt rounds:     {BCRYPT_ROUNDS}, pool {pool['kind']} x{pool['workers']}")
+    print(f"logins/s:          {args.logins / elapsed:.1f}  statuses {statuses}")
+    print(f"login p50/p99 ms:  {percentile(latencies, 0.5):.1f} / {percentile(latencies, 0.99):.1f}")
+    print(f"pool queue p95 ms: {pool['queue_time']['p95_ms']}")
+    print(f"loop lag mean/max: {statistics.mean(lags) * 1000:.2f} / {max(lags) * 1000:.2f} ms")
+    auth_pool.close()
+    await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50, help="Logins in flight at once")
+    arguments = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(directory, 'bench.db')}")
+        asyncio.run(main(arguments))
@@ -0,0 +1,90 @@
+"""Benchmark: adding many users to a group one action at a time vs one bulk request.
+
+Run from the backend folder:
+    python -m benchmarks.bench_bulk_membership [--users 50 500]
+
+Builds a throwaway SQLite file database and, for each size, adds that many users to a
+fresh group the old way (one add_user_to_group_chat action per user: membership
+check, insert, commit, post "I added X") and through add_users_to_group
+(one lookup, one INSERT that skips existing rows, one summary message). Reports wall
+time, SQL statements, commits and group messages broadcast per approach.
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from sqlalchemy import event, insert, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from app.database import Base
+from app.models import GroupChat, User, group_user_association
+from app.websocket.directory import ChatDirectory
+from app.websocket.manager import ConnectionManager, GroupChatManager
+from app.websocket.persistence import MessageWriter
+
+
+async def run(sizes) -> None:
+    path = os.path.join(tempfile.mkdtemp(), "bulk.db")
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    statements, commits = [], []
+    event.listen(engine.sync_engine, "before_cursor_execute",
+                 lambda conn, cursor, statement, *args: statements.append(statement))
+    event.listen(engine.sync_engine, "commit", commits.append)
+    Session = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+
+    users = max(sizes) + 1
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.execute(insert(User), [{"id": i, "username": f"user{i}"} for i in range(1, users + 1)])
+
+    connection_manager = ConnectionManager()
+    manager = GroupChatManager(connection_manager, ChatDirectory(), MessageWriter("strict"))
+    broadcasts = []
+    connection_manager.backplane.subscribe("room", broadcasts.append)
+
+    print(f"{'users':>6} {'approach':>9} {'ms':>9} {'statements':>11} {'commits':>8} {'messages':>9}")
+    for size in sizes:
+        user_ids = list(range(2, size + 2))
+        for approach in ("one_by_one", "bulk"):
+            async with Session() as db:
+                group = GroupChat(name=f"{approach}-{size}", admin_id=1)
+                db.add(group)
+                await db.commit()
+                group_id = group.id
+
+            statements.clear()
+            commits.clear()
+            broadcasts.clear()
+            started = time.perf_counter()
+            if approach == "bulk":
+                async with Session() as db:
+                    await manager.add_users_to_group(group_id, 1, user_ids, db)
+            else:
+                for user_id in user_ids:
+                    # Every websocket action runs in its own session
+                    async with Session() as db:
+                        await manager.add_user_to_group(group_id, user_id, "adding", None, db)
+                        await manager.send_group_message(group_id, 1, f"I added user{user_id}", db)
+            elapsed = time.perf_counter() - started
+            statement_count, commit_count, messages = len(statements), len(commits), len(broadcasts)
+
+            async with Session() as db:
+                members = set(await db.scalars(select(group_user_association.c.user_id)
+                                               .where(group_user_association.c.group_id == group_id)))
+            assert members == set(user_ids), f"{approach} added {len(members)} of {size} users"
+            print(f"{size:>6} {approach:>9} {elapsed * 1000:>9.1f} {statement_count:>11} {commit_count:>8} {messages:>9}")
+
+    await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, nargs="+", default=[50, 500])
+    args = parser.parse_args()
+    asyncio.run(run(args.users))
+
+
+if __name__ == "__main__":
+    main()
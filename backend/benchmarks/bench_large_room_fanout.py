@@ -0,0 +1,126 @@
+"""Room broadcast cost by room size, with inline fan-out vs the large-room fan-out workers.
+
+Run from the backend folder:
+    python -m benchmarks.bench_large_room_fanout --sizes 10,1000,10000 --messages 20
+
+For every room size, fills a ConnectionManager with fake sockets (each with its real
+ConnectionSender and writer task) and broadcasts messages to the room, first with every
+room delivered inline by the publishing coroutine and then with the sharded workers.
+Reports how long the sender's handler is held by send_message_to_chat, the delivery
+latency until a member's socket gets the frame (p50/p99 and the last member), and the
+longest event loop stall a concurrent probe saw, i.e. what every other socket waited.
+Keep --interval above the time one message takes to reach everyone (about 0.1 s for 10k
+members on one core), otherwise the delivery numbers measure the backlog instead.
+Setup objects are frozen out of the garbage collector so its pauses over them don't
+count as fan-out stalls.
+"""
+import argparse
+import asyncio
+import gc
+import json
+import time
+
+from app.websocket.backplane import InProcessBackplane
+from app.websocket.broadcast import ConnectionSender
+from app.websocket.fanout import ShardedFanout
+from app.websocket.manager import ConnectionManager
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] * 1000
+
+
+class FakeSocket:
+    """Records when each frame reaches the socket."""
+
+    def __init__(self, arrivals: list):
+        self.arrivals = arrivals
+
+    async def send_text(self, frame: str):
+        self.arrivals.append((time.perf_counter(), frame))
+
+
+async def probe_loop_lag(stop: asyncio.Event, lags: list, interval: float = 0.001):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - started - interval)
+
+
+async def run(size: int, threshold: int, args) -> dict:
+    manager = ConnectionManager(InProcessBackplane())
+    manager.fanout = ShardedFanout(manager._enqueue_frames, threshold=threshold, shard_size=args.shard_size,
+                                   workers=args.workers)
+    arrivals = []
+    for _ in range(size):
+        socket = FakeSocket(arrivals)
+        sender = ConnectionSender(socket, lambda websocket, reason: None, max_queue=args.messages + 1)
+        manager.senders[socket] = sender
+        sender.start()
+        await manager.add_user_to_chat(1, "group", socket)
+
+    # Let the writer tasks reach their first wait and clear setup garbage before measuring
+    await asyncio.sleep(0.2)
+    gc.collect()
+    gc.freeze()
+    stop, lags = asyncio.Event(), []
+    probe = asyncio.create_task(probe_loop_lag(stop, lags))
+    sent_at, handler = {}, []
+    for index in range(args.messages):
+        started = time.perf_counter()
+        sent_at[index] = started
+        await manager.send_message_to_chat(1, "group", {"sender_username": "bench", "content": str(index)})
+        handler.append(time.perf_counter() - started)
+        await asyncio.sleep(args.interval)
+    deadline = time.perf_counter() + 60
+    while len(arrivals) < size * args.messages and time.perf_counter() < deadline:
+        await asyncio.sleep(0.01)
+    stop.set()
+    await probe
+    for sender in manager.senders.values():
+        sender.stop()
+    await manager.fanout.close()
+    gc.unfreeze()
+
+    index_of = {}
+    latencies, last = [], {}
+    for arrived, frame in arrivals:
+        index = index_of.get(frame)
+        if index is None:
+            index = index_of[frame] = int(json.loads(frame)["content"])
+        latency = arrived - sent_at[index]
+        latencies.append(latency)
+        last[index] = max(last.get(index, 0), latency)
+    return {
+        "handler_p50": percentile(handler, 0.5),
+        "handler_max": max(handler) * 1000,
+        "delivery_p50": percentile(latencies, 0.5),
+        "delivery_p99": percentile(latencies, 0.99),
+        "last_member": percentile(list(last.values()), 0.5),
+        "loop_lag_max": max(lags) * 1000 if lags else 0.0,
+        "missing": size * args.messages - len(arrivals),
+    }
+
+
+async def main(args):
+    print(f"{'members':>8} {'mode':>8} {'handler p50/max ms':>19} {'delivery p50/p99 ms':>20} "
+          f"{'last member ms':>15} {'loop stall ms':>14}")
+    for size in args.sizes:
+        for mode, threshold in (("inline", size + 1), ("sharded", args.threshold)):
+            result = await run(size, threshold, args)
+            print(f"{size:>8} {mode:>8} {result['handler_p50']:>9.3f} / {result['handler_max']:<7.3f} "
+                  f"{result['delivery_p50']:>9.2f} / {result['delivery_p99']:<8.2f} "
+                  f"{result['last_member']:>15.2f} {result['loop_lag_max']:>14.2f}"
+                  + (f"  ({result['missing']} frames missing)" if result["missing"] else ""))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=lambda value: [int(size) for size in value.split(",")], default=[10, 1000, 10000])
+    parser.add_argument("--messages", type=int, default=20, help="Messages broadcast per run")
+    parser.add_argument("--interval", type=float, default=0.15, help="Seconds between messages")
+    parser.add_argument("--threshold", type=int, default=500, help="Large-room threshold of the sharded runs")
+    parser.add_argument("--shard-size", type=int, default=256)
+    parser.add_argument("--workers", type=int, default=4)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,59 @@
+"""Per-frame cost and memory of the inbound rate limiter.
+
+Run from the backend folder:
+    python -m benchmarks.bench_rate_limiter --frames 200000 --users 100000
+
+Feeds frames from many distinct users and rooms through RateLimiter.acquire() and
+reports the time per check and the number of buckets kept, which must stay at the
+configured bound however many users show up.
+"""
+import argparse
+import time
+import tracemalloc
+
+from app.websocket.ratelimit import RateLimiter
+
+
+class FakeSocket:
+    pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--frames", type=int, default=200000)
+    parser.add_argument("--users", type=int, default=100000, help="Distinct users sending frames")
+    parser.add_argument("--connections", type=int, default=1000)
+    parser.add_argument("--max-entries", type=int, default=50000, help="User/room buckets kept")
+    args = parser.parse_args()
+
+    sockets = [FakeSocket() for _ in range(args.connections)]
+    users = [f"user{i}" for i in range(args.users)]
+    rooms = [("group", f"room{i}") for i in range(500)]
+    frames = [(sockets[i % args.connections], users[i % args.users], rooms[i % len(rooms)])
+              for i in range(args.frames)]
+
+    limiter = RateLimiter(max_entries=args.max_entries)
+    started = time.perf_counter()
+    for socket, user, room in frames:
+        limiter.acquire("send_group_message", socket, user=user, room=room)
+    elapsed = time.perf_counter() - started
+
+    # Second pass on a fresh limiter only to measure the memory the buckets take
+    tracemalloc.start()
+    limiter = RateLimiter(max_entries=args.max_entries)
+    for socket, user, room in frames:
+        limiter.acquire("send_group_message", socket, user=user, room=room)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    stats = limiter.stats()
+    print(f"frames:            {args.frames}")
+    print(f"us per check:      {elapsed / args.frames * 1e6:.2f}")
+    print(f"shared buckets:    {stats['shared_buckets']} (bound {args.max_entries})")
+    print(f"connection states: {stats['connections']}")
+    print(f"peak traced MiB:   {peak / 2**20:.1f}")
+    print(f"limited frames:    {sum(stats['limited'].values())}")
+
+
+if __name__ == "__main__":
+    main()
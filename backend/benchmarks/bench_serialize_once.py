@@ -0,0 +1,54 @@
+"""Per-recipient JSON encoding vs encode-once for group broadcasts.
+
+Run from the backend folder:
+    python -m benchmarks.bench_serialize_once
+"""
+import argparse
+import json
+import timeit
+from datetime import datetime
+
+from app.websocket.serialization import _orjson_dumps, _stdlib_dumps, orjson
+
+GROUP_SIZES = (10, 100, 1000, 2000)
+
+
+def per_recipient(message: dict, recipients: int):
+    # What send_json did: one json.dumps per member
+    for _ in range(recipients):
+        json.dumps({**message}, separators=(",", ":"), ensure_ascii=False)
+
+
+def encode_once(dumps, message: dict, recipients: int):
+    frame = dumps(message)
+    for _ in range(recipients):
+        _ = frame
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--content-size", type=int, default=200, help="Characters in the message body")
+    args = parser.parse_args()
+
+    message = {
+        "sender_username": "alice",
+        "content": "x" * args.content_size,
+        "timestamp": datetime.now().isoformat(),
+    }
+    variants = [("per-recipient json", lambda n: per_recipient(message, n)),
+                ("encode-once json", lambda n: encode_once(_stdlib_dumps, message, n))]
+    if orjson is not None:
+        variants.append(("encode-once orjson", lambda n: encode_once(_orjson_dumps, message, n)))
+
+    print(f"{'members':>8}  " + "  ".join(f"{name:>20}" for name, _ in variants))
+    for size in GROUP_SIZES:
+        timings = []
+        for _, fn in variants:
+            best = min(timeit.repeat(lambda: fn(size), number=10, repeat=args.repeat)) / 10
+            timings.append(f"{best * 1e6:>17.1f} us")
+        print(f"{size:>8}  " + "  ".join(timings))
+
+
+if __name__ == "__main__":
+    main()
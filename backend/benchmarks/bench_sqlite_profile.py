@@ -0,0 +1,89 @@
+"""Write-heavy chat workload against SQLite under the "legacy" and "tuned" database profiles.
+
+Run from the backend folder:
+    python -m benchmarks.bench_sqlite_profile --writers 20 --messages 200 --readers 5
+
+Each writer commits messages one at a time (like strict persistence) while readers keep
+loading the newest history page. Every profile gets a fresh database file.
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from datetime import datetime
+
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from app.database import Base
+from app.db_profiles import build_engines
+from app.models import PrivateChat, PrivateMessage, User
+
+
+async def run_profile(profile: str, args) -> dict:
+    with tempfile.TemporaryDirectory() as directory:
+        url = f"sqlite:///{os.path.join(directory, 'bench.db')}"
+        engine, async_engine = build_engines(url, profile)
+        Base.metadata.create_all(bind=engine)
+        with engine.begin() as conn:
+            conn.execute(insert(User), [{"id": i, "username": f"user{i}"} for i in range(1, args.writers + 2)])
+            conn.execute(insert(PrivateChat), [{"id": i, "user1_id": i, "user2_id": i + 1} for i in range(1, args.writers + 1)])
+        Session = async_sessionmaker(async_engine, expire_on_commit=False)
+        stop = asyncio.Event()
+        reads = 0
+        errors = 0
+
+        async def writer(chat_id: int):
+            nonlocal errors
+            for i in range(args.messages):
+                try:
+                    async with Session() as db:
+                        db.add(PrivateMessage(chat_id=chat_id, sender_id=chat_id, content=f"message {i}",
+                                              timestamp=datetime.now()))
+                        await db.commit()
+                except Exception:
+                    errors += 1
+
+        async def reader(chat_id: int):
+            nonlocal reads
+            while not stop.is_set():
+                async with Session() as db:
+                    await db.execute(
+                        select(PrivateMessage.content, PrivateMessage.timestamp)
+                        .where(PrivateMessage.chat_id == chat_id)
+                        .order_by(PrivateMessage.timestamp.desc(), PrivateMessage.id.desc())
+                        .limit(50)
+                    )
+                reads += 1
+                await asyncio.sleep(0)
+
+        readers = [asyncio.create_task(reader(i % args.writers + 1)) for i in range(args.readers)]
+        started = time.perf_counter()
+        await asyncio.gather(*(writer(i) for i in range(1, args.writers + 1)))
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await asyncio.gather(*readers)
+        await async_engine.dispose()
+        engine.dispose()
+
+    written = args.writers * args.messages - errors
+    return {"profile": profile, "seconds": elapsed, "writes_per_s": written / elapsed,
+            "reads_per_s": reads / elapsed, "errors": errors}
+
+
+async def main(args):
+    print(f"{'profile':>8} {'seconds':>9} {'writes/s':>10} {'reads/s':>10} {'errors':>7}")
+    for profile in args.profiles:
+        result = await run_profile(profile, args)
+        print(f"{result['profile']:>8} {result['seconds']:>9.2f} {result['writes_per_s']:>10.0f} "
+              f"{result['reads_per_s']:>10.0f} {result['errors']:>7}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--writers", type=int, default=20, help="Concurrent chats being written")
+    parser.add_argument("--messages", type=int, default=200, help="Messages committed per writer")
+    parser.add_argument("--readers", type=int, default=5, help="Concurrent history readers")
+    parser.add_argument("--profiles", nargs="+", default=["legacy", "tuned"])
+    asyncio.run(main(parser.parse_args()))
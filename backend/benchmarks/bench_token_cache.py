@@ -0,0 +1,41 @@
+"""Websocket connect authentication throughput with and without the verified-token cache.
+
+Run from the backend folder (SECRET_KEY must be set, as for the app):
+    python -m benchmarks.bench_token_cache --users 1000 --reconnects 20
+
+Simulates a reconnect storm after a deploy: every user reconnects several times with
+the same access token, and each connect runs verify_connection() as the endpoint does.
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from app import auth
+from app.utils.cache import TTLCache
+from app.websocket.verify_websocket import verify_connection
+
+
+async def storm(tokens: list, reconnects: int) -> float:
+    connects = [token for token in tokens for _ in range(reconnects)]
+    random.shuffle(connects)
+    started = time.perf_counter()
+    for token in connects:
+        await verify_connection(None, token)
+    return len(connects) / (time.perf_counter() - started)
+
+
+async def main(args):
+    tokens = [auth.create_access_token({"sub": f"user{i}"}) for i in range(args.users)]
+    print(f"{'cache':>8} {'connects/s':>12}")
+    for label, size in (("off", 0), ("on", max(args.users, auth.JWT_CACHE_SIZE))):
+        auth.verified_tokens = TTLCache(size, auth.JWT_CACHE_TTL)
+        rate = await storm(tokens, args.reconnects)
+        print(f"{label:>8} {rate:>12.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--reconnects", type=int, default=20, help="Connects per user")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,62 @@
+"""Frame size and encode/decode time of the JSON and MessagePack wire protocols.
+
+Run from the backend folder (MessagePack rows need `pip install msgpack`):
+    python -m benchmarks.bench_wire_protocol --repeat 20000
+
+Sizes are reported raw and after permessage-deflate style compression (zlib, no
+context takeover), which is what a client offering the extension receives.
+"""
+import argparse
+import timeit
+import zlib
+from datetime import datetime
+
+from app.websocket.protocol import ACTION_NAMES, CODECS, JSON_CODEC, MSGPACK_SUBPROTOCOL
+
+
+def sample_frames(content_size: int) -> dict:
+    """Typical inbound action and outbound broadcast, as each protocol sends them."""
+    content = "see you at the standup tomorrow " * (content_size // 32 + 1)
+    return {
+        "inbound json": {"action": "send_group_message", "group_id": 42, "user_id": 7,
+                         "message": content[:content_size]},
+        "inbound compact": {"a": ACTION_NAMES["send_group_message"], "group_id": 42, "user_id": 7,
+                            "message": content[:content_size]},
+        "broadcast": {"sender_username": "alice", "content": content[:content_size],
+                      "timestamp": datetime.now().isoformat()},
+    }
+
+
+def deflated_size(frame) -> int:
+    data = frame.encode("utf-8") if isinstance(frame, str) else frame
+    compressor = zlib.compressobj(wbits=-15)
+    return len(compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)) - 4
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=20000)
+    parser.add_argument("--content-size", type=int, default=120, help="Characters in the message body")
+    args = parser.parse_args()
+
+    codecs = [("json", JSON_CODEC)]
+    if MSGPACK_SUBPROTOCOL in CODECS:
+        codecs.append(("msgpack", CODECS[MSGPACK_SUBPROTOCOL]))
+    else:
+        print("msgpack is not installed; only the JSON protocol is measured")
+
+    frames = sample_frames(args.content_size)
+    print(f"{'protocol':>8} {'frame':>16} {'bytes':>6} {'deflated':>9} {'encode us':>10} {'decode us':>10}")
+    for name, codec in codecs:
+        for label, payload in frames.items():
+            if label == "inbound json" and name != "json":
+                continue
+            frame = codec.encode(payload)
+            size = len(frame.encode("utf-8") if isinstance(frame, str) else frame)
+            encode = timeit.timeit(lambda: codec.encode(payload), number=args.repeat) / args.repeat * 1e6
+            decode = timeit.timeit(lambda: codec.decode(frame), number=args.repeat) / args.repeat * 1e6
+            print(f"{name:>8} {label:>16} {size:>6} {deflated_size(frame):>9} {encode:>10.2f} {decode:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
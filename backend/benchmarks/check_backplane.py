@@ -0,0 +1,211 @@
+"""Regression check: room messages and cache invalidations reach every node of the backplane.
+
+Run from the backend folder:
+    python -m benchmarks.check_backplane
+
+Wires two ConnectionManager/ChatDirectory pairs ("nodes") to RedisBackplane instances
+that share an in-memory pub/sub fake instead of a Redis server. A room message sent on
+one node must reach the room's sockets on both nodes exactly once, and invalidating a
+group on one node must drop it from the other node's cache; both nodes must see the
+message under the same epoch and seq. Then the fake delivers malformed envelopes and
+drops node-b's subscription: node-b must skip the bad messages, resubscribe, forget its
+cached entries and receive room messages again. Finally every Redis command fails for a
+while: sending must still reach node-a's own socket, unnumbered and without raising, and
+the failures must be counted. Exits with status 1 otherwise.
+"""
+import asyncio
+import json
+import sys
+
+from app.websocket.backplane import RedisBackplane
+from app.websocket.directory import ChatDirectory, GroupInfo
+from app.websocket.manager import ConnectionManager
+from app.websocket.protocol import JSON_CODEC
+from app.websocket.rooms import RoomKey
+
+
+# Put in a subscriber's queue to make its listen() fail like a dropped connection
+DROP = object()
+
+
+class FakePubSub:
+    def __init__(self, broker: "FakeRedis"):
+        self.broker = broker
+        self.queue: asyncio.Queue = asyncio.Queue()
+
+    async def subscribe(self, channel: str):
+        self.broker.subscribers.setdefault(channel, []).append(self.queue)
+
+    async def unsubscribe(self, channel: str):
+        self.broker.subscribers[channel].remove(self.queue)
+
+    async def listen(self):
+        while True:
+            message = await self.queue.get()
+            if message is DROP:
+                raise ConnectionError("Connection closed by server")
+            yield message
+
+
+class FakePipeline:
+    """Queues commands and runs them in order on execute(), like a non-transactional pipeline."""
+
+    def __init__(self, broker: "FakeRedis"):
+        self.broker = broker
+        self.commands = []
+
+    def incr(self, key: str):
+        self.commands.append(lambda: self.broker.incr_now(key))
+
+    def set(self, key: str, value: str, nx: bool = False):
+        self.commands.append(lambda: self.broker.set_now(key, value, nx))
+
+    def get(self, key: str):
+        self.commands.append(lambda: self.broker.values.get(key))
+
+    async def execute(self) -> list:
+        self.broker.check_up()
+        return [command() for command in self.commands]
+
+
+class FakeRedis:
+    """The subset of redis.asyncio.Redis the backplane uses."""
+
+    def __init__(self):
+        self.subscribers = {}
+        self.values = {}
+        self.down = False
+
+    def check_up(self):
+        if self.down:
+            raise ConnectionError("Error connecting to Redis")
+
+    def pubsub(self) -> FakePubSub:
+        return FakePubSub(self)
+
+    def pipeline(self, transaction: bool = True) -> FakePipeline:
+        return FakePipeline(self)
+
+    def incr_now(self, key: str) -> int:
+        self.values[key] = self.values.get(key, 0) + 1
+        return self.values[key]
+
+    def set_now(self, key: str, value: str, nx: bool) -> bool:
+        if nx and key in self.values:
+            return False
+        self.values[key] = value
+        return True
+
+    async def publish(self, channel: str, data: str):
+        self.check_up()
+        for queue in self.subscribers.get(channel, ()):
+            queue.put_nowait({"type": "message", "data": data})
+
+    def drop(self, channel: str, index: int):
+        self.subscribers[channel][index].put_nowait(DROP)
+
+
+class RecordingSender:
+    codec = JSON_CODEC
+
+    def __init__(self):
+        self.frames = []
+
+    def send_frame(self, frame, coalesce_key=None):
+        self.frames.append(frame)
+
+
+def make_node(broker: FakeRedis, name: str):
+    backplane = RedisBackplane(broker, channel="check", node_id=name, retry_delay=0.01)
+    manager = ConnectionManager(backplane)
+    directory = ChatDirectory(backplane=backplane)
+    socket = object()
+    sender = RecordingSender()
+    manager.senders[socket] = sender
+    return backplane, manager, directory, socket, sender
+
+
+async def main() -> int:
+    broker = FakeRedis()
+    nodes = [make_node(broker, name) for name in ("node-a", "node-b")]
+    for backplane, *_ in nodes:
+        await backplane.start()
+
+    failures = []
+    (_, manager_a, directory_a, socket_a, sender_a), (_, manager_b, directory_b, socket_b, sender_b) = nodes
+    await manager_a.add_user_to_chat(1, "group", socket_a)
+    await manager_b.add_user_to_chat(1, "group", socket_b)
+    await manager_a.send_message_to_chat(1, "group", {"sender_username": "alice", "content": "hi"})
+    # Only node-b joined group 2: node-a has no local member but must still publish
+    await manager_b.add_user_to_chat(2, "group", socket_b)
+    await manager_a.send_message_to_chat(2, "group", {"sender_username": "alice", "content": "there"})
+
+    directory_b.groups_by_id.set(7, GroupInfo(7, "team", 1))
+    directory_b.groups_by_name.set("team", GroupInfo(7, "team", 1))
+    directory_a.invalidate_group(7, "team")
+    await asyncio.sleep(0.05)
+
+    if len(sender_a.frames) != 1:
+        failures.append(f"node-a received {len(sender_a.frames)} frames for group 1, expected 1")
+    if len(sender_b.frames) != 2:
+        failures.append(f"node-b received {len(sender_b.frames)} frames for groups 1 and 2, expected 2")
+    numbering = {(frame.get("epoch"), frame.get("seq")) for frame in map(json.loads, sender_a.frames + sender_b.frames[:1])}
+    if len(numbering) != 1 or None in next(iter(numbering)):
+        failures.append(f"nodes numbered the same group 1 message differently: {numbering}")
+    if directory_b.groups_by_id.get(7) is not None or directory_b.groups_by_name.get("team") is not None:
+        failures.append("node-b still caches group 7 after node-a invalidated it")
+
+    # Bad envelopes are skipped, a dropped subscription is re-established
+    backplane_b = nodes[1][0]
+    await broker.publish("check", "not json")
+    await broker.publish("check", '{"origin": "node-x", "type": "room"}')
+    directory_b.groups_by_id.set(8, GroupInfo(8, "ops", 1))
+    broker.drop("check", 1)
+    await asyncio.sleep(0.1)
+    await manager_a.send_message_to_chat(1, "group", {"sender_username": "alice", "content": "back"})
+    await asyncio.sleep(0.05)
+    if backplane_b.malformed != 2:
+        failures.append(f"node-b counted {backplane_b.malformed} malformed messages, expected 2")
+    if backplane_b.reconnects != 1:
+        failures.append(f"node-b resubscribed {backplane_b.reconnects} times after a drop, expected 1")
+    if len(sender_b.frames) != 3:
+        failures.append(f"node-b received {len(sender_b.frames)} frames, expected 3 after resubscribing")
+    if directory_b.groups_by_id.get(8) is not None:
+        failures.append("node-b kept its cache across a lost subscription")
+
+    # Redis unreachable: the sender's own node still delivers, nothing raises
+    backplane_a = nodes[0][0]
+    broker.down = True
+    frames_a = len(sender_a.frames)
+    try:
+        await manager_a.send_message_to_chat(1, "group", {"sender_username": "alice", "content": "outage"})
+        directory_a.invalidate_group(9, "lost")
+        await asyncio.sleep(0.05)
+    except Exception as exc:
+        failures.append(f"sending during a Redis outage raised {exc!r}")
+    broker.down = False
+    outage_frames = [json.loads(frame) for frame in sender_a.frames[frames_a:]]
+    if [frame["content"] for frame in outage_frames] != ["outage"] or "seq" in outage_frames[0]:
+        failures.append(f"node-a delivered {outage_frames} during the outage, expected one unnumbered frame")
+    if backplane_a.publish_failures != 2 or backplane_a.seq_failures != 1:
+        failures.append(f"node-a counted {backplane_a.stats()} during the outage, expected 2 publish and 1 seq failure")
+    if RoomKey.of("group", 1) in manager_a.replay:
+        failures.append("node-a kept replaying group 1 across an unnumbered message")
+    await manager_a.send_message_to_chat(1, "group", {"sender_username": "alice", "content": "recovered"})
+    await asyncio.sleep(0.05)
+    if json.loads(sender_b.frames[-1])["content"] != "recovered":
+        failures.append("node-b did not receive messages again after Redis came back")
+
+    for backplane, *_ in nodes:
+        await backplane.close()
+    for failure in failures:
+        print(f"FAIL  {failure}")
+    if failures:
+        return 1
+    print("OK: room messages and invalidations reach every node exactly once, across bad messages, a reconnect "
+          "and a Redis outage")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
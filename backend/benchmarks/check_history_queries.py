@@ -0,0 +1,63 @@
+"""Regression check: rendering chat history must cost a constant number of queries.
+
+Run from the backend folder:
+    python -m benchmarks.check_history_queries
+
+Builds a throwaway in-memory database, fills a private chat with histories of growing
+length, renders the newest page with fetch_history_page and counts the SQL statements
+it issues. Exits with status 1 if the count grows with the history length.
+"""
+import asyncio
+import sys
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, insert
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from app.database import Base
+from app.models import PrivateChat, PrivateMessage, User
+from app.websocket.history import fetch_history_page
+
+HISTORY_LENGTHS = (10, 100, 1000, 10000)
+
+
+async def main() -> int:
+    engine = create_async_engine("sqlite+aiosqlite://")
+    statements = []
+    event.listen(engine.sync_engine, "before_cursor_execute",
+                 lambda conn, cursor, statement, *args: statements.append(statement))
+    Session = async_sessionmaker(engine, expire_on_commit=False)
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.execute(insert(User), [{"id": i, "username": f"user{i}"} for i in range(1, 51)])
+        await conn.execute(insert(PrivateChat), [{"id": 1, "user1_id": 1, "user2_id": 2}])
+
+    counts = []
+    inserted = 0
+    start = datetime(2025, 1, 1)
+    for length in HISTORY_LENGTHS:
+        async with engine.begin() as conn:
+            await conn.execute(insert(PrivateMessage), [
+                {"chat_id": 1, "sender_id": i % 50 + 1, "content": f"message {i}",
+                 "timestamp": start + timedelta(seconds=i)}
+                for i in range(inserted, length)
+            ])
+        inserted = length
+
+        async with Session() as db:
+            statements.clear()
+            page = await fetch_history_page(db, "private", 1)
+        counts.append(len(statements))
+        print(f"history={length:>6}  page={len(page['history']):>3}  queries={len(statements)}")
+
+    await engine.dispose()
+    if len(set(counts)) != 1:
+        print("FAIL: query count grows with history length")
+        return 1
+    print("OK: query count is constant")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
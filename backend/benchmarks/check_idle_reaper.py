@@ -0,0 +1,91 @@
+"""Regression check: the heartbeat reaper evicts exactly the silent connections, in one batch.
+
+Run from the backend folder:
+    python -m benchmarks.check_idle_reaper --connections 100000
+
+Tracks many fake connections on a simulated clock. All of them go quiet until the first
+ping; then half of them speak again. At the idle timeout the reaper must evict exactly the
+silent half and ping the other half. A tick with nothing due must not touch the heap.
+Prints the time per reap pass.
+"""
+import argparse
+import sys
+import time
+
+from app.websocket import heartbeat as heartbeat_module
+from app.websocket.heartbeat import HeartbeatReaper
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+class FakeSender:
+    def __init__(self):
+        self.pings = 0
+
+    def send_json(self, payload, coalesce_key=None):
+        self.pings += 1
+
+
+class RecordingManager:
+    """Stands in for ConnectionManager: one fake sender per connection, evictions recorded."""
+
+    def __init__(self):
+        self.connection_listeners = []
+        self.senders = {}
+        self.evicted = []
+
+    def get_sender(self, websocket):
+        return self.senders.get(websocket)
+
+    def evict(self, websocket, reason):
+        self.evicted.append(websocket)
+
+
+def timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return result, (time.perf_counter() - started) * 1000
+
+
+def main(args) -> int:
+    clock = FakeClock()
+    heartbeat_module.time = clock  # The reaper reads time.monotonic() through its module
+    manager = RecordingManager()
+    reaper = HeartbeatReaper(manager, ping_interval=30, idle_timeout=90)
+    sockets = [object() for _ in range(args.connections)]
+    for websocket in sockets:
+        manager.senders[websocket] = FakeSender()
+        manager.connection_listeners[0](websocket, True)
+    start = clock.now
+
+    _, first_ms = timed(lambda: reaper.reap(start + 30))
+    clock.now = start + 40
+    active = sockets[::2]
+    for websocket in active:
+        reaper.seen(websocket)
+    evicted, evict_ms = timed(lambda: reaper.reap(start + 90))
+    heap_before = len(reaper._schedule)
+    _, idle_ms = timed(lambda: reaper.reap(start + 90.5))
+
+    silent = set(sockets[1::2])
+    print(f"connections: {args.connections}, ping pass {first_ms:.1f} ms, evict pass {evict_ms:.1f} ms, "
+          f"idle tick {idle_ms:.3f} ms, stats {reaper.stats()}")
+    active_pings = {manager.senders[websocket].pings for websocket in active}
+    if (set(evicted) != silent or set(manager.evicted) != silent or active_pings != {2}
+            or len(reaper._schedule) != heap_before or reaper.stats()["tracked"] != len(active)):
+        print("FAIL: the reaper did not evict exactly the silent connections")
+        return 1
+    print("OK: silent connections evicted in one pass, live ones pinged")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--connections", type=int, default=100000)
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,105 @@
+"""Regression check: a group membership check must not get dearer as the group grows.
+
+Run from the backend folder:
+    python -m benchmarks.check_membership_checks
+
+Builds a throwaway in-memory database with groups of growing size, then asks the
+MembershipService about members and non-members the way the send_group_message handler
+does, counting SQL statements and ORM User objects loaded. Groups up to the set limit
+must answer from the cached id set after one load; larger ones with one EXISTS probe per
+check. Then removes a member while its group's ids are being loaded; the load must not
+cache the stale ids. Exits with status 1 if any check loads User rows, gives a wrong
+answer, costs more queries in a bigger group, or a removed member stays cached.
+"""
+import asyncio
+import sys
+import time
+
+from sqlalchemy import delete, event, insert
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import StaticPool
+
+from app.database import Base
+from app.models import GroupChat, User, group_user_association
+from app.websocket.directory import ChatDirectory
+from app.websocket.membership import MembershipService
+
+GROUP_SIZES = (10, 1000, 20000)
+SET_LIMIT = 5000
+CHECKS = 200
+
+
+async def main() -> int:
+    engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+    statements = []
+    event.listen(engine.sync_engine, "before_cursor_execute",
+                 lambda conn, cursor, statement, *args: statements.append(statement))
+    users_loaded = []
+    event.listen(User, "load", lambda target, context: users_loaded.append(target))
+    Session = async_sessionmaker(engine, expire_on_commit=False)
+
+    users = max(GROUP_SIZES) + 1
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.execute(insert(User), [{"id": i, "username": f"user{i}"} for i in range(1, users + 1)])
+        for group_id, size in enumerate(GROUP_SIZES, start=1):
+            await conn.execute(insert(GroupChat), [{"id": group_id, "name": f"group{size}", "admin_id": 1}])
+            await conn.execute(insert(group_user_association),
+                               [{"group_id": group_id, "user_id": user_id} for user_id in range(2, size + 2)])
+
+    membership = MembershipService(ChatDirectory(), set_limit=SET_LIMIT)
+    failures = 0
+    per_check = []
+    for group_id, size in enumerate(GROUP_SIZES, start=1):
+        async with Session() as db:
+            # First check fills the cache (or marks the group as too large for it)
+            statements.clear()
+            assert await membership.is_member(db, group_id, 2)
+            first = len(statements)
+
+            statements.clear()
+            started = time.perf_counter()
+            wrong = 0
+            for i in range(CHECKS):
+                member = i % 2 == 0
+                user_id = 2 + i % size if member else size + 2 + i % 10
+                wrong += await membership.is_member(db, group_id, user_id) != member
+            elapsed = time.perf_counter() - started
+        queries = len(statements) / CHECKS
+        per_check.append(queries if size > SET_LIMIT else 0)
+        failures += bool(wrong) + bool(size <= SET_LIMIT and statements)
+        print(f"members={size:>6}  first check queries={first}  queries/check={queries:.2f}  "
+              f"us/check={elapsed / CHECKS * 1e6:>7.1f}  wrong={wrong}")
+
+    # A member removed (and invalidated) while the group's ids are still being read
+    directory = ChatDirectory()
+    membership = MembershipService(directory, set_limit=SET_LIMIT)
+    async with Session() as db:
+        load = asyncio.create_task(membership.is_member(db, 1, 2))
+        await asyncio.sleep(0)
+        directory.invalidate_members(1)
+        await load
+    async with engine.begin() as conn:
+        await conn.execute(delete(group_user_association).where(group_user_association.c.group_id == 1,
+                                                                group_user_association.c.user_id == 2))
+    async with Session() as db:
+        removed_still_member = await membership.is_member(db, 1, 2)
+    print(f"load raced an invalidation: stale_loads={membership.stale_loads}  "
+          f"removed member still passes={removed_still_member}")
+
+    await engine.dispose()
+    if removed_still_member or membership.stale_loads != 1:
+        print("FAIL: a load that raced an invalidation cached the removed member")
+        return 1
+    if users_loaded:
+        print(f"FAIL: membership checks loaded {len(users_loaded)} User rows")
+        return 1
+    if failures or max(per_check) > 1:
+        print("FAIL: membership checks gave wrong answers or cost more than one query")
+        return 1
+    print("OK: membership checks are set lookups or one EXISTS probe, whatever the group size")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
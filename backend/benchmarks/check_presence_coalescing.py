@@ -0,0 +1,133 @@
+"""Regression check: presence and typing bursts collapse into one broadcast per room per interval.
+
+Run from the backend folder:
+    python -m benchmarks.check_presence_coalescing --users 1000 --keystrokes 50
+
+Drives a PresenceTracker with a reconnect storm (every user joins, drops and rejoins a
+room) plus a typing burst (every user sends many typing frames), then flushes once.
+Without coalescing that would be users * (3 + keystrokes) broadcasts; the check fails
+unless it is exactly one presence and one typing event. A second flush with no changes
+must send nothing.
+
+Then runs two workers on a linked cross-process backplane with a user connected to both:
+dropping one of the user's sockets must not announce them offline anywhere, both workers
+must list every user of the room, and a worker that stops refreshing must be forgotten
+after the node TTL.
+"""
+import argparse
+import asyncio
+import sys
+import time
+
+from app.websocket.backplane import Backplane, InProcessBackplane
+from app.websocket.presence import PresenceTracker
+from app.websocket.rooms import RoomKey, RoomRegistry
+
+
+class RecordingManager:
+    """Stands in for ConnectionManager: records local room broadcasts instead of sending them."""
+
+    def __init__(self, backplane=None):
+        self.backplane = backplane or InProcessBackplane()
+        self.rooms = RoomRegistry()
+        self.room_listeners = []
+        self.sent = []
+
+    def send_to_local_members(self, chat_id, type_of_connection, message, coalesce_key=None):
+        self.sent.append(message)
+
+
+class LinkedBackplane(Backplane):
+    """Cross-process backplane stand-in: every publish is dispatched on all linked nodes."""
+
+    is_local = False
+
+    def __init__(self, peers: list):
+        super().__init__()
+        self.peers = peers
+        peers.append(self)
+        self.muted = False
+
+    async def publish(self, event_type: str, payload: dict):
+        if not self.muted:
+            for peer in self.peers:
+                peer._dispatch(event_type, payload)
+
+
+async def check_workers() -> int:
+    """Failures of the merged presence of two workers sharing a room."""
+    peers = []
+    (manager_a, tracker_a), (manager_b, tracker_b) = [
+        (manager, PresenceTracker(manager, interval=3600, node_ttl=0.3))
+        for manager in (RecordingManager(LinkedBackplane(peers)), RecordingManager(LinkedBackplane(peers)))
+    ]
+    room = RoomKey.of("group", 1)
+    manager_a.rooms.join(room, "socket-a")
+    manager_b.rooms.join(room, "socket-b")
+    tracker_a.room_changed(room, "alice", True)
+    tracker_b.room_changed(room, "alice", True)
+    tracker_b.room_changed(room, "bob", True)
+    for tracker in (tracker_a, tracker_b, tracker_a):
+        await tracker.flush()
+    failures = int(tracker_a.online(room) != ["alice", "bob"] or tracker_b.online(room) != ["alice", "bob"])
+
+    # alice closes her tab on worker b but is still connected to worker a
+    manager_a.sent.clear()
+    manager_b.sent.clear()
+    tracker_b.room_changed(room, "alice", False)
+    await tracker_b.flush()
+    await tracker_a.flush()
+    offline = [message for message in manager_a.sent + manager_b.sent if message.get("offline")]
+    failures += bool(offline) or tracker_b.online(room) != ["alice", "bob"]
+
+    # worker b goes silent; after the TTL worker a forgets bob
+    manager_b.backplane.muted = True
+    await asyncio.sleep(0.35)
+    await tracker_a.flush()
+    gone = [message for message in manager_a.sent if message.get("offline") == ["bob"]]
+    failures += tracker_a.online(room) != ["alice"] or len(gone) != 1
+    print(f"two workers: alice online on both after closing one tab={not offline}, "
+          f"silent worker's users forgotten={tracker_a.online(room) == ['alice']}")
+    return failures
+
+
+async def main(args) -> int:
+    manager = RecordingManager()
+    tracker = PresenceTracker(manager, interval=3600)
+    room = RoomKey.of("group", 1)
+    manager.rooms.join(room, "listener")
+    users = [f"user{i}" for i in range(args.users)]
+
+    started = time.perf_counter()
+    for user in users:
+        tracker.room_changed(room, user, True)
+        tracker.room_changed(room, user, False)
+        tracker.room_changed(room, user, True)
+    for _ in range(args.keystrokes):
+        for user in users:
+            tracker.set_typing(room, user, True)
+    await tracker.flush()
+    first = list(manager.sent)
+    await tracker.flush()
+    elapsed = time.perf_counter() - started
+
+    naive = args.users * (3 + args.keystrokes)
+    print(f"updates: {naive}, broadcasts: {len(first)}, after idle flush: {len(manager.sent) - len(first)}, "
+          f"{elapsed * 1000:.1f} ms")
+    types = sorted(message["type"] for message in first)
+    online = next((message["online"] for message in first if message["type"] == "presence"), [])
+    if types != ["presence", "typing"] or len(online) != args.users or len(manager.sent) != len(first):
+        print("FAIL: presence updates were not coalesced into one event per kind")
+        return 1
+    if await check_workers():
+        print("FAIL: workers announced a user offline who is still connected elsewhere, or kept a silent worker's users")
+        return 1
+    print("OK: one presence and one typing broadcast for the whole burst, presence merged across workers")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--keystrokes", type=int, default=50, help="Typing frames per user")
+    sys.exit(asyncio.run(main(parser.parse_args())))
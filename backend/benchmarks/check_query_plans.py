@@ -0,0 +1,72 @@
+"""Regression check: every hot query must be answered from an index, never a table scan.
+
+Run from the backend folder:
+    python -m benchmarks.check_query_plans
+
+Creates the schema from the models in an in-memory SQLite database, runs EXPLAIN QUERY
+PLAN for each query on the websocket hot path and exits with status 1 if any plan
+contains a SCAN step or a temporary sort.
+"""
+import sys
+from datetime import datetime
+
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.pool import StaticPool
+
+from app.database import Base
+from app.models import GroupChat, GroupMessage, User, group_user_association
+from app.websocket.history import encode_cursor, history_statement
+from app.websocket.manager import private_chat_lookup
+from app.websocket.membership import candidates_lookup, member_ids_lookup, members_lookup, membership_probe
+
+CURSOR = encode_cursor(datetime(2025, 1, 1), 100)
+HOT_QUERIES = {
+    "private history, newest page": history_statement("private", 1, None, 51),
+    "private history, older page": history_statement("private", 1, CURSOR, 51),
+    "group history, newest page": history_statement("group", 1, None, 51),
+    "group history, older page": history_statement("group", 1, CURSOR, 51),
+    "private chat by user pair": private_chat_lookup(1, 2),
+    "user by username": select(User.id, User.username).where(User.username == "alice"),
+    "user by id": select(User.id, User.username).where(User.id == 1),
+    "group by name": select(GroupChat.id, GroupChat.name, GroupChat.admin_id).where(GroupChat.name == "team"),
+    "group by id": select(GroupChat.id, GroupChat.name, GroupChat.admin_id).where(GroupChat.id == 1),
+    "member ids of a group": member_ids_lookup(1, 10001),
+    "is user in group": membership_probe(1, 2),
+    "groups of a user": select(group_user_association.c.group_id).where(group_user_association.c.user_id == 2),
+    "last group message id": select(func.max(GroupMessage.id)),
+    "bulk add candidates": candidates_lookup(1, [2, 3, 4]),
+    "bulk remove members": members_lookup(1, [2, 3, 4]),
+}
+
+BAD_STEPS = ("SCAN", "USE TEMP B-TREE")
+# Selecting an EXISTS(...) without a FROM clause "scans" a single constant row
+HARMLESS_STEPS = ("SCAN CONSTANT ROW",)
+
+
+def explain(conn, statement) -> list:
+    # Expand IN (...) lists into one placeholder per value
+    compiled = statement.compile(dialect=conn.dialect, compile_kwargs={"render_postcompile": True})
+    params = tuple(compiled.params[name] for name in compiled.positiontup)
+    params = tuple(value.isoformat(" ") if isinstance(value, datetime) else value for value in params)
+    return [row[-1] for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}", params)]
+
+
+def main() -> int:
+    engine = create_engine("sqlite://", poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    failures = 0
+    with engine.connect() as conn:
+        for name, statement in HOT_QUERIES.items():
+            plan = explain(conn, statement)
+            bad = [step for step in plan if step.startswith(BAD_STEPS) and not step.startswith(HARMLESS_STEPS)]
+            failures += bool(bad)
+            print(f"{'FAIL' if bad else 'ok':>4}  {name}: {' | '.join(plan)}")
+    if failures:
+        print(f"{failures} hot queries fall back to a scan or a temporary sort")
+        return 1
+    print("OK: every hot query uses an index")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
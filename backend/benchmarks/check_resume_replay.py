@@ -0,0 +1,101 @@
+"""Regression check: resume returns exactly the missed messages, or None once the gap is evicted.
+
+Run from the backend folder:
+    python -m benchmarks.check_resume_replay --messages 1000 --size 200
+
+Feeds a ReplayBuffer with sequenced messages of one room (a few of them out of order, as
+concurrent sends can be) and asks since() for every last_seq a client could hold. Gaps
+still inside the buffer must come back complete and in order; anything older, or a
+last_seq the room never reached, must return None so the caller falls back to history.
+
+Then sends to many more rooms than the buffer keeps through a ConnectionManager: sequence
+counters must be dropped with the evicted rooms, except for rooms with a connected
+member, whose counters must go once that member disconnects. A room numbered afresh
+after that gets a new epoch, and resuming with the old epoch must fall back to history
+instead of replaying the new numbers as if they followed the old ones.
+"""
+import argparse
+import asyncio
+import sys
+import time
+
+from app.websocket.manager import ConnectionManager
+from app.websocket.replay import ReplayBuffer
+from app.websocket.rooms import RoomKey
+
+
+async def count_sequences(rooms: int, max_rooms: int) -> int:
+    """Failures of the sequence counter pruning after sending one message to each of `rooms` rooms."""
+    manager = ConnectionManager()
+    manager.replay.max_rooms = max_rooms
+    member = object()
+    manager.rooms.join(RoomKey.of("group", 1), member)
+    for chat_id in range(1, rooms + 1):
+        await manager.send_message_to_chat(chat_id, "group", {"content": "hi"})
+    kept = manager.backplane.sequence_count()
+    # The member's room was evicted from the buffer but keeps numbering while it is joined
+    failures = int(kept != max_rooms + 1)
+    await manager.send_message_to_chat(1, "group", {"content": "again"})
+    old_epoch, old_seq = manager.replay.position(RoomKey.of("group", 1))
+    failures += old_seq != 2
+    # Enough other rooms to push group 1 out of the buffer again
+    for chat_id in range(1, max_rooms + 1):
+        await manager.send_message_to_chat(chat_id, "private", {"content": "hi"})
+    manager.disconnect(member)
+    failures += manager.backplane.sequence_count() != max_rooms
+    print(f"sequence counters: {kept} kept after {rooms} rooms with {max_rooms} buffered, "
+          f"{manager.backplane.sequence_count()} after the last member left")
+
+    # Group 1 is numbered again from 1; a client still holding seq 2 of the old epoch missed all of it
+    for index in range(5):
+        await manager.send_message_to_chat(1, "group", {"content": f"new{index}"})
+    new_epoch, new_seq = manager.replay.position(RoomKey.of("group", 1))
+    stale = manager.replay.since(RoomKey.of("group", 1), old_epoch, old_seq)
+    current = manager.replay.since(RoomKey.of("group", 1), new_epoch, 2)
+    failures += new_epoch == old_epoch or new_seq != 5 or stale is not None
+    failures += [message["content"] for message in current or ()] != ["new2", "new3", "new4"]
+    print(f"restarted counter: epoch {old_epoch} -> {new_epoch}, resume with the old epoch "
+          f"{'falls back to history' if stale is None else f'replayed {len(stale)} messages'}")
+    return failures
+
+
+def main(args) -> int:
+    buffer = ReplayBuffer(size=args.size)
+    room = RoomKey.of("group", 1)
+    seqs = list(range(1, args.messages + 1))
+    # Swap neighbours now and then to mimic sends that took their seq in one order and landed in the other
+    for index in range(0, len(seqs) - 1, 7):
+        seqs[index], seqs[index + 1] = seqs[index + 1], seqs[index]
+    for seq in seqs:
+        buffer.append(room, "e1", seq, {"seq": seq})
+
+    oldest = min(seq for seq in seqs[-args.size:])
+    failures = 0
+    started = time.perf_counter()
+    for last_seq in range(args.messages + 2):
+        messages = buffer.since(room, "e1", last_seq)
+        if last_seq + 1 < oldest or last_seq > args.messages:
+            failures += messages is not None
+        else:
+            failures += messages is None or [m["seq"] for m in messages] != list(range(last_seq + 1, args.messages + 1))
+    elapsed = time.perf_counter() - started
+
+    print(f"resume lookups: {args.messages + 2}, {elapsed * 1e6 / (args.messages + 2):.1f} us each, stats {buffer.stats()}")
+    if failures or buffer.since(RoomKey.of("group", 2), "e1", 0) is not None:
+        print(f"FAIL: {failures} resume lookups returned the wrong messages")
+        return 1
+    if asyncio.run(count_sequences(args.rooms, args.max_rooms)):
+        print("FAIL: sequence counters outlived their rooms, were dropped while a member was joined, "
+              "or a restarted counter replayed across epochs")
+        return 1
+    print("OK: buffered gaps replay exactly, evicted gaps fall back to history, idle counters are dropped, old epochs never replay")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--size", type=int, default=200, help="Replay buffer size per room")
+    parser.add_argument("--rooms", type=int, default=5000, help="Rooms to send to in the pruning check")
+    parser.add_argument("--max-rooms", type=int, default=100, help="Rooms the replay buffer keeps in the pruning check")
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,74 @@
+"""Regression check: a slow client disconnected mid-broadcast must not cost the others the message.
+
+Run from the backend folder:
+    python -m benchmarks.check_slow_consumers --fast 5 --slow 5 --messages 20
+
+Joins fast and stalled fake sockets to one room of a ConnectionManager, with send queues
+of one frame and the disconnect overflow policy, and broadcasts a stream of messages.
+The stalled sockets overflow and are dropped while a broadcast is handing out frames;
+the check fails unless every fast socket received every message and every stalled one
+was disconnected.
+"""
+import argparse
+import asyncio
+import sys
+
+from app.websocket.broadcast import ConnectionSender, OverflowPolicy
+from app.websocket.manager import ConnectionManager
+from app.websocket.rooms import RoomKey
+
+
+class FakeSocket:
+    """Records the frames it is sent; a stalled one never finishes its first send."""
+
+    def __init__(self, stalled: bool):
+        self.stalled = stalled
+        self.received = []
+        self.closed = False
+
+    async def send_text(self, payload: str):
+        if self.stalled:
+            await asyncio.Event().wait()
+        self.received.append(payload)
+
+    async def close(self, code: int = 1000, reason: str = ""):
+        self.closed = True
+
+
+async def main(args) -> int:
+    manager = ConnectionManager()
+    room = RoomKey.of("group", 1)
+    sockets = [FakeSocket(stalled=index >= args.fast) for index in range(args.fast + args.slow)]
+    for index, websocket in enumerate(sockets):
+        manager.active_connections[websocket] = {"username": f"user{index}", "csrf_token": ""}
+        sender = ConnectionSender(websocket, manager._drop_connection, max_queue=1, policy=OverflowPolicy.DISCONNECT)
+        manager.senders[websocket] = sender
+        sender.start()
+        manager.rooms.join(room, websocket)
+
+    for index in range(args.messages):
+        await manager.send_message_to_chat(1, "group", {"content": f"m{index}"})
+        # Let the writers drain: fast sockets empty their queue, stalled ones stay stuck
+        for _ in range(5):
+            await asyncio.sleep(0)
+
+    fast = [websocket for websocket in sockets if not websocket.stalled]
+    slow = [websocket for websocket in sockets if websocket.stalled]
+    short = sum(len(websocket.received) != args.messages for websocket in fast)
+    still_joined = sum(websocket in manager.active_connections for websocket in slow)
+    print(f"fast sockets missing messages: {short}/{len(fast)}, stalled sockets still joined: {still_joined}/{len(slow)}")
+    for sender in list(manager.senders.values()):
+        sender.stop()
+    if short or still_joined:
+        print("FAIL: dropping a slow client during a broadcast cost other members the message")
+        return 1
+    print("OK: slow clients are disconnected and everyone else gets every message")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--fast", type=int, default=5)
+    parser.add_argument("--slow", type=int, default=5)
+    parser.add_argument("--messages", type=int, default=20)
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,122 @@
+"""Regression check: a failing write-behind row or outage must not stop persistence or history.
+
+Run from the backend folder:
+    python -m benchmarks.check_write_behind_failures
+
+Uses a throwaway SQLite file database and the write-behind MessageWriter, then:
+  1. buffers messages and commits a row with one of their ids behind the writer's back
+     (what a second writer process would do); the flush must store every other message
+     and dead-letter only the colliding one;
+  2. makes every INSERT fail for a while; the flush must raise and keep the rows, and a
+     history page must still be served with the buffered messages merged in;
+  3. fills the buffer past its cap; further messages must be written through at once.
+Exits with status 1 if any of that does not hold.
+"""
+import asyncio
+import os
+import sys
+import tempfile
+
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'write_behind.db')}"
+os.environ["MESSAGE_PERSISTENCE"] = "write_behind"
+os.environ["BROADCAST_BACKPLANE"] = "inprocess"
+
+from datetime import datetime  # noqa: E402
+
+from sqlalchemy import event, func, insert, select  # noqa: E402
+from sqlalchemy.exc import OperationalError  # noqa: E402
+
+from app.database import async_engine, create_all_tables, engine, session_scope  # noqa: E402
+from app.models import PrivateChat, PrivateMessage, User  # noqa: E402
+from app.websocket.history import fetch_history_page  # noqa: E402
+from app.websocket.persistence import message_writer  # noqa: E402
+
+outage = False
+
+
+def fail_inserts(conn, cursor, statement, parameters, context, executemany):
+    if outage and statement.startswith("INSERT"):
+        raise OperationalError(statement, parameters, Exception("simulated outage"))
+
+
+async def save(db, content: str) -> int:
+    return await message_writer.save(db, PrivateMessage, chat_id=1, sender_id=1, content=content,
+                                     timestamp=datetime.now())
+
+
+async def stored_contents() -> list:
+    async with session_scope() as db:
+        return list(await db.scalars(select(PrivateMessage.content).order_by(PrivateMessage.id)))
+
+
+def check(condition: bool, message: str) -> int:
+    print(f"{'ok' if condition else 'FAIL':>4}  {message}")
+    return 0 if condition else 1
+
+
+async def main() -> int:
+    global outage
+    for sync_engine in (engine, async_engine.sync_engine):
+        event.listen(sync_engine, "before_cursor_execute", fail_inserts)
+    create_all_tables()
+    with engine.begin() as conn:
+        conn.execute(insert(User), [{"id": 1, "username": "alice"}, {"id": 2, "username": "bob"}])
+        conn.execute(insert(PrivateChat), [{"id": 1, "user1_id": 1, "user2_id": 2}])
+
+    failures = 0
+    # 1. A row whose id another writer already used
+    async with session_scope() as db:
+        ids = [await save(db, f"batch {i}") for i in range(20)]
+    with engine.begin() as conn:
+        conn.execute(insert(PrivateMessage), [{"id": ids[5], "chat_id": 1, "sender_id": 2, "content": "other worker",
+                                               "timestamp": datetime.now()}])
+    await message_writer.flush()
+    stored = await stored_contents()
+    failures += check(message_writer.pending == 0, f"poisoned batch flushed, {message_writer.pending} left buffered")
+    failures += check(message_writer.dropped == 1 and len(message_writer.dead_letters) == 1,
+                      f"only the colliding row was dead-lettered ({message_writer.dropped} dropped)")
+    failures += check(len(stored) == 20 and "batch 5" not in stored, f"{len(stored)} rows stored, 19 of the batch")
+
+    # 2. The database rejects every INSERT for a while
+    async with session_scope() as db:
+        for i in range(10):
+            await save(db, f"outage {i}")
+    outage = True
+    try:
+        await message_writer.flush()
+        raised = False
+    except OperationalError:
+        raised = True
+    failures += check(raised and message_writer.pending == 10, f"flush during outage raised, {message_writer.pending} kept")
+    async with session_scope() as db:
+        page = await fetch_history_page(db, "private", 1, limit=12)
+    contents = [message["content"] for message in page["history"]]
+    failures += check(contents[-10:] == [f"outage {i}" for i in range(10)] and len(contents) == 12,
+                      f"history during outage served {len(contents)} messages, buffered ones included")
+    outage = False
+    await message_writer.flush()
+    failures += check(message_writer.pending == 0 and len(await stored_contents()) == 30, "outage rows stored after recovery")
+
+    # 3. A full buffer writes through
+    message_writer.max_pending = 5
+    async with session_scope() as db:
+        for i in range(8):
+            await save(db, f"capped {i}")
+    failures += check(message_writer.pending == 5 and message_writer.write_through == 3,
+                      f"{message_writer.pending} buffered, {message_writer.write_through} written through")
+    await message_writer.flush()
+    async with session_scope() as db:
+        count = await db.scalar(select(func.count()).select_from(PrivateMessage))
+    failures += check(count == 38, f"{count} rows stored after the capped burst")
+
+    print(f"writer stats: {message_writer.stats()}")
+    await async_engine.dispose()
+    if failures:
+        print(f"FAIL: {failures} write-behind failure checks did not hold")
+        return 1
+    print("OK: bad rows are dead-lettered, outages keep rows and history, a full buffer writes through")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
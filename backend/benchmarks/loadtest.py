@@ -0,0 +1,357 @@
+"""Load test: simulated users chatting over /ws, with delivery latency and server CPU/RSS.
+
+From the backend folder, either let the script start its own server on a throwaway database
+    python -m benchmarks.loadtest --spawn --users 200 --groups 10,50 --duration 30
+or point it at a running one (started with the rate limits off, see below) and pass its pid
+so CPU and RSS can be read from /proc
+    python -m benchmarks.loadtest --url http://127.0.0.1:8008 --pid 12345 --users 200
+
+Every user registers and logs in over /register/ and /login/, opens one websocket, joins a
+private chat with a neighbour and every group it belongs to (--groups lists the group sizes),
+and then sends --rate messages per second to a random one of its chats. Each message carries
+the time it was sent, so every other member that receives it records the end-to-end delivery
+latency. After --warmup seconds the script measures for --duration seconds and prints
+p50/p95/p99 latency, messages and deliveries per second, frames the server answered with an
+error, and the server's CPU and RSS. --json writes the same numbers to a file, and
+--max-p99-ms / --min-deliveries make the exit status fail on a regression.
+
+The generator itself shares the machine: its own CPU use is printed too, and a client near
+100% means the numbers describe the client, not the server.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+import websockets
+
+from benchmarks.soak_connections import _get, _post, ensure_user
+
+# Content prefix of load test messages; the rest is the sender's perf_counter() at send time
+MARK = "lt:"
+# Rate limits for a --spawn server: the load test measures delivery, not the limiter
+LOADTEST_RATE_LIMITS = ",".join([
+    "*.connection=off", "*.user=off", "*.room=off",
+    "send_private_message.room=off", "send_group_message.room=off", "create_group_chat.user=off",
+])
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] * 1000
+
+
+def read_process(pid: int):
+    """CPU seconds (user + system) and RSS bytes of a process, from /proc."""
+    with open(f"/proc/{pid}/stat") as f:
+        # Fields after the parenthesised command name; utime and stime are fields 14 and 15
+        fields = f.read().rsplit(")", 1)[1].split()
+    cpu = (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+    with open(f"/proc/{pid}/status") as f:
+        rss = next(int(line.split()[1]) * 1024 for line in f if line.startswith("VmRSS:"))
+    return cpu, rss
+
+
+class Results:
+    def __init__(self):
+        self.measuring = False
+        self.sent = 0
+        self.delivered = 0
+        self.latencies = []
+        self.errors = {}
+        self.disconnects = 0
+
+    def error(self, content: str):
+        if self.measuring:
+            # Strip ids and numbers so the same kind of error is counted once
+            key = "".join(ch for ch in content if not ch.isdigit())[:80]
+            self.errors[key] = self.errors.get(key, 0) + 1
+
+
+def plan_groups(usernames, sizes, prefix):
+    """Groups of the requested sizes over consecutive (wrapping) users; the first member is admin."""
+    groups = []
+    start = 0
+    for index, size in enumerate(sizes):
+        size = min(size, len(usernames))
+        members = [usernames[(start + offset) % len(usernames)] for offset in range(size)]
+        groups.append({"name": f"{prefix}group_{index}_{size}", "members": members})
+        start += size
+    return groups
+
+
+async def setup_group(ws_url: str, base_url: str, tokens: dict, ids: dict, group: dict):
+    """Create the group over REST and add its members from the admin's socket."""
+    admin = group["members"][0]
+    try:
+        await asyncio.to_thread(_post, base_url, "/group_create/", {"group_name": group["name"], "admin_username": admin})
+    except urllib.error.HTTPError as e:
+        if e.code != 400:  # 400: created by a previous run
+            raise
+    async with websockets.connect(ws_url, max_size=None) as ws:
+        frames = [{"action": "add_user_to_group_chat",
+                   "data": {"group_name": group["name"], "user_id": ids[member], "adder_name": admin}}
+                  for member in group["members"][1:]]
+        frames.append({"action": "join_group_chat", "data": {"user_name": admin, "group_name": group["name"]}})
+        frames[0].update(access_token=tokens[admin]["access_token"], csrf_token=tokens[admin]["csrf_token"])
+        for frame in frames:
+            await ws.send(json.dumps(frame))
+        # Actions of one connection run in order, so the join reply means every add is done
+        async for frame in ws:
+            reply = json.loads(frame) if frame.startswith("{") else {}
+            if "group_id" in reply:
+                return reply["group_id"]
+
+
+async def join_chats(ws_url: str, tokens: dict, username: str, chats: list, delay: float):
+    """Connect one user and join all of its chats; returns the socket and the send targets."""
+    await asyncio.sleep(delay)  # Don't open everything in a single burst
+    ws = await websockets.connect(ws_url, max_size=None)
+    first = {"access_token": tokens["access_token"], "csrf_token": tokens["csrf_token"]}
+    for chat in chats:
+        await ws.send(json.dumps({**first, **chat["join"]}))
+        first = {}
+    targets = []
+    while len(targets) < len(chats):
+        frame = await ws.recv()
+        reply = json.loads(frame) if frame.startswith("{") else {"content": frame}
+        if "chat_id" in reply and "history" in reply:
+            targets.append({"action": "send_private_message", "data": {"chat_id": reply["chat_id"]}})
+        elif "group_id" in reply and "history" in reply:
+            name = next(chat["group"] for chat in chats if chat.get("group_id") == reply["group_id"])
+            targets.append({"action": "send_group_message", "data": {"group_id": name}})
+        elif "content" in reply and not str(reply["content"]).startswith(MARK):
+            await ws.close()
+            raise RuntimeError(f"{username} could not join: {reply['content']}")
+    return ws, targets
+
+
+async def run_client(ws, targets: list, username: str, args, results: Results, stop: asyncio.Event):
+    rng = random.Random(f"{args.seed}:{username}")
+
+    async def reader():
+        async for frame in ws:
+            received = time.perf_counter()
+            if not frame.startswith("{"):
+                results.error(frame)
+                continue
+            message = json.loads(frame)
+            content = message.get("content")
+            if not isinstance(content, str) or "type" in message:
+                continue  # presence and typing events
+            if not content.startswith(MARK):
+                results.error(content)
+            elif results.measuring and message.get("sender_username") != username:
+                results.delivered += 1
+                results.latencies.append(received - float(content[len(MARK):]))
+
+    reader_task = asyncio.create_task(reader())
+    try:
+        while not stop.is_set():
+            target = rng.choice(targets)
+            data = dict(target["data"], message={"sender_username": username,
+                                                 "content": f"{MARK}{time.perf_counter():.6f}"})
+            await ws.send(json.dumps({"action": target["action"], "data": data}))
+            if results.measuring:
+                results.sent += 1
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=rng.expovariate(args.rate))
+            except asyncio.TimeoutError:
+                pass
+        # Let deliveries of the last messages arrive
+        await asyncio.sleep(args.drain)
+    except websockets.ConnectionClosed:
+        results.disconnects += 1
+    finally:
+        reader_task.cancel()
+        await ws.close()
+
+
+async def sample_server(pid, base_url: str, stop: asyncio.Event, samples: list, interval: float = 1.0):
+    while not stop.is_set():
+        if pid is not None:
+            samples.append(read_process(pid)[1])
+        else:
+            samples.append((await asyncio.to_thread(_get, base_url, "/ws/stats"))["memory"]["rss_bytes"])
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def main(args, pid) -> dict:
+    base_url = args.url.rstrip("/")
+    ws_url = base_url.replace("http", "ws", 1) + "/ws"
+    usernames = [f"{args.prefix}{i}" for i in range(args.users - args.users % 2)]
+
+    print(f"Preparing {len(usernames)} users...")
+    slots = asyncio.Semaphore(args.setup_concurrency)
+
+    async def prepare(username):
+        async with slots:
+            return username, await asyncio.to_thread(ensure_user, base_url, username, args.password)
+
+    tokens = dict(await asyncio.gather(*(prepare(username) for username in usernames)))
+    ids = {user["username"]: user["id"] for user in (await asyncio.to_thread(_get, base_url, "/all_user"))["users"]}
+
+    chats = {username: [{"join": {"action": "join_private_chat",
+                                  "data": {"user1": {"username": username}, "user2_id": ids[usernames[i ^ 1]]}}}]
+             for i, username in enumerate(usernames)}
+    groups = plan_groups(usernames, args.groups, args.prefix)
+    for group in groups:
+        print(f"Preparing group {group['name']} ({len(group['members'])} members)...")
+        group_id = await setup_group(ws_url, base_url, tokens, ids, group)
+        for member in group["members"]:
+            chats[member].append({"join": {"action": "join_group_chat",
+                                           "data": {"user_name": member, "group_name": group["name"]}},
+                                  "group": group["name"], "group_id": group_id})
+
+    sessions = await asyncio.gather(*(join_chats(ws_url, tokens[username], username, chats[username], i // 50 * 0.1)
+                                      for i, username in enumerate(usernames)))
+    print(f"{len(usernames)} clients connected, warming up for {args.warmup:.0f}s...")
+    results = Results()
+    stop = asyncio.Event()
+    clients = [asyncio.create_task(run_client(ws, targets, username, args, results, stop))
+               for username, (ws, targets) in zip(usernames, sessions)]
+    await asyncio.sleep(args.warmup)
+
+    rss_samples = []
+    sampler_stop = asyncio.Event()
+    sampler = asyncio.create_task(sample_server(pid, base_url, sampler_stop, rss_samples))
+    server_cpu = read_process(pid)[0] if pid is not None else None
+    client_cpu = time.process_time()
+    results.measuring = True
+    started = time.perf_counter()
+    await asyncio.sleep(args.duration)
+    stop.set()
+    elapsed = time.perf_counter() - started
+    server_cpu = (read_process(pid)[0] - server_cpu) / elapsed if pid is not None else None
+    client_cpu = (time.process_time() - client_cpu) / elapsed
+    await asyncio.gather(*clients, return_exceptions=True)
+    results.measuring = False
+    sampler_stop.set()
+    await sampler
+
+    return {
+        "users": len(usernames),
+        "groups": [len(group["members"]) for group in groups],
+        "duration_s": round(elapsed, 2),
+        "sent_per_s": round(results.sent / elapsed, 1),
+        "delivered_per_s": round(results.delivered / elapsed, 1),
+        "latency_ms": {name: None if value is None else round(value, 2) for name, value in (
+            ("p50", percentile(results.latencies, 0.5)),
+            ("p95", percentile(results.latencies, 0.95)),
+            ("p99", percentile(results.latencies, 0.99)),
+            ("max", percentile(results.latencies, 1.0)),
+        )},
+        "errors": results.errors,
+        "disconnects": results.disconnects,
+        "server_cpu_percent": None if server_cpu is None else round(server_cpu * 100, 1),
+        "server_rss_mib": {
+            "start": round(rss_samples[0] / 2 ** 20, 1) if rss_samples else None,
+            "peak": round(max(rss_samples) / 2 ** 20, 1) if rss_samples else None,
+        },
+        "client_cpu_percent": round(client_cpu * 100, 1),
+    }
+
+
+def spawn_server(port: int, directory: str) -> subprocess.Popen:
+    """Start uvicorn for the app on a throwaway SQLite database and wait until it answers."""
+    env = dict(os.environ)
+    env["DATABASE_URL"] = f"sqlite:///{os.path.join(directory, 'loadtest.db')}"
+    env.setdefault("SECRET_KEY", "loadtest-secret")
+    env.setdefault("WS_RATE_LIMITS", LOADTEST_RATE_LIMITS)
+    # Cheap hashes: registering users is setup, not what is measured
+    env.setdefault("BCRYPT_ROUNDS", "4")
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        env=env,
+    )
+    deadline = time.monotonic() + 30
+    while True:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/ws/stats").close()
+            return server
+        except OSError:
+            if server.poll() is not None or time.monotonic() > deadline:
+                server.kill()
+                raise RuntimeError("The spawned server did not start")
+            time.sleep(0.2)
+
+
+def report(result: dict):
+    latency = result["latency_ms"]
+    print(f"users / groups:      {result['users']} / {result['groups']}")
+    print(f"sent msgs/s:         {result['sent_per_s']}")
+    print(f"delivered msgs/s:    {result['delivered_per_s']}")
+    print(f"latency p50/p95/p99: {latency['p50']} / {latency['p95']} / {latency['p99']} ms (max {latency['max']})")
+    print(f"server CPU / RSS:    {result['server_cpu_percent']}% / "
+          f"{result['server_rss_mib']['start']} -> {result['server_rss_mib']['peak']} MiB peak")
+    print(f"client CPU:          {result['client_cpu_percent']}%")
+    print(f"errors / drops:      {sum(result['errors'].values())} / {result['disconnects']}")
+    for content, count in sorted(result["errors"].items(), key=lambda item: -item[1]):
+        print(f"  {count:>7}  {content}")
+
+
+def run(args) -> int:
+    with tempfile.TemporaryDirectory() as directory:
+        server = None
+        pid = args.pid
+        if args.spawn:
+            server = spawn_server(args.port, directory)
+            args.url, pid = f"http://127.0.0.1:{args.port}", server.pid
+        try:
+            result = asyncio.run(main(args, pid))
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait(timeout=30)
+
+    report(result)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+    failed = []
+    p99 = result["latency_ms"]["p99"]
+    if args.max_p99_ms is not None and (p99 is None or p99 > args.max_p99_ms):
+        failed.append(f"p99 {p99} ms > {args.max_p99_ms} ms")
+    if args.min_deliveries is not None and result["delivered_per_s"] < args.min_deliveries:
+        failed.append(f"{result['delivered_per_s']} deliveries/s < {args.min_deliveries}")
+    if failed:
+        print("FAIL: " + "; ".join(failed))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8008")
+    parser.add_argument("--pid", type=int, help="Server process to sample CPU and RSS from (/proc)")
+    parser.add_argument("--spawn", action="store_true", help="Start a server on a temporary database instead")
+    parser.add_argument("--port", type=int, default=8765, help="Port for --spawn")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--groups", type=lambda value: [int(size) for size in value.split(",") if size],
+                        default=[10, 50], help="Comma separated group sizes, e.g. 5,20,100 (empty for none)")
+    parser.add_argument("--rate", type=float, default=1.0, help="Messages per second per user")
+    parser.add_argument("--warmup", type=float, default=5)
+    parser.add_argument("--duration", type=float, default=20, help="Seconds to measure")
+    parser.add_argument("--drain", type=float, default=1.0, help="Seconds to wait for in-flight deliveries")
+    parser.add_argument("--setup-concurrency", type=int, default=8, help="Registrations/logins in flight")
+    parser.add_argument("--seed", default="loadtest")
+    parser.add_argument("--prefix", default="load_user_")
+    parser.add_argument("--password", default="load-password")
+    parser.add_argument("--json", help="Also write the results to this file")
+    parser.add_argument("--max-p99-ms", type=float, help="Fail if p99 delivery latency is higher")
+    parser.add_argument("--min-deliveries", type=float, help="Fail if fewer deliveries per second")
+    sys.exit(run(parser.parse_args()))
@@ -0,0 +1,126 @@
+"""Soak test: hold many websocket connections open while they chat, and watch server memory.
+
+Start the server first (e.g. `uvicorn app.main:app --port 8008`), then from the backend folder:
+    python -m benchmarks.soak_connections --users 1000 --duration 600
+
+Users are paired into private chats and keep sending messages. Every --sample seconds the
+script reads /ws/stats and prints RSS per connection and the session identity map sizes,
+which should stay flat for the whole run.
+"""
+import argparse
+import asyncio
+import json
+import time
+import urllib.error
+import urllib.request
+
+import websockets
+
+
+def _post(base_url: str, path: str, payload: dict) -> dict:
+    request = urllib.request.Request(
+        f"{base_url}{path}",
+        data=json.dumps(payload).encode(),
+        headers={"Content-Type": "application/json"},
+    )
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())
+
+
+def _get(base_url: str, path: str) -> dict:
+    with urllib.request.urlopen(f"{base_url}{path}") as response:
+        return json.loads(response.read())
+
+
+def ensure_user(base_url: str, username: str, password: str) -> dict:
+    """Register the user if needed and log in."""
+    try:
+        _post(base_url, "/register/", {"username": username, "email": f"{username}@example.com", "password": password})
+    except urllib.error.HTTPError as e:
+        if e.code != 400:  # 400: already registered by a previous run
+            raise
+    return _post(base_url, "/login/", {"username": username, "password": password})
+
+
+async def run_client(ws_url: str, tokens: dict, username: str, peer_id: int, args, stop: asyncio.Event, counters: dict):
+    async with websockets.connect(ws_url, max_size=None) as ws:
+        await ws.send(json.dumps({
+            "access_token": tokens["access_token"],
+            "csrf_token": tokens["csrf_token"],
+            "action": "join_private_chat",
+            "data": {"user1": {"username": username}, "user2_id": peer_id},
+        }))
+        chat_id = json.loads(await ws.recv())["chat_id"]
+
+        async def reader():
+            async for _ in ws:
+                counters["received"] += 1
+
+        reader_task = asyncio.create_task(reader())
+        try:
+            while not stop.is_set():
+                await ws.send(json.dumps({
+                    "action": "send_private_message",
+                    "data": {"chat_id": chat_id, "message": {"sender_username": username, "content": f"soak {time.time()}"}},
+                }))
+                counters["sent"] += 1
+                try:
+                    await asyncio.wait_for(stop.wait(), timeout=args.interval)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            reader_task.cancel()
+
+
+async def sample_memory(base_url: str, args, stop: asyncio.Event, counters: dict):
+    started = time.monotonic()
+    print(f"{'t(s)':>6} {'conns':>6} {'rss MiB':>9} {'rss/conn KiB':>13} {'idmap last':>11} {'idmap peak':>11} {'sent':>9} {'recv':>9}")
+    while not stop.is_set():
+        stats = await asyncio.to_thread(_get, base_url, "/ws/stats")
+        memory = stats["memory"]
+        per_connection = memory["rss_per_connection_bytes"] or 0
+        print(f"{time.monotonic() - started:>6.0f} {stats['connections']:>6} {memory['rss_bytes'] / 2 ** 20:>9.1f} "
+              f"{per_connection / 1024:>13.1f} {memory['db_sessions']['identity_map_last']:>11} "
+              f"{memory['db_sessions']['identity_map_peak']:>11} {counters['sent']:>9} {counters['received']:>9}")
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=args.sample)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def main(args):
+    base_url = args.url.rstrip("/")
+    ws_url = base_url.replace("http", "ws", 1) + "/ws"
+    usernames = [f"{args.prefix}{i}" for i in range(args.users - args.users % 2)]
+
+    print(f"Preparing {len(usernames)} users...")
+    tokens = {}
+    for username in usernames:
+        tokens[username] = await asyncio.to_thread(ensure_user, base_url, username, args.password)
+    ids = {user["username"]: user["id"] for user in (await asyncio.to_thread(_get, base_url, "/all_user"))["users"]}
+
+    stop = asyncio.Event()
+    counters = {"sent": 0, "received": 0}
+    clients = []
+    for i, username in enumerate(usernames):
+        peer = usernames[i ^ 1]
+        clients.append(asyncio.create_task(run_client(ws_url, tokens[username], username, ids[peer], args, stop, counters)))
+        if i % 50 == 49:
+            await asyncio.sleep(0.1)  # Don't open everything in a single burst
+    sampler = asyncio.create_task(sample_memory(base_url, args, stop, counters))
+
+    await asyncio.sleep(args.duration)
+    stop.set()
+    await asyncio.gather(*clients, sampler, return_exceptions=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8008")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--duration", type=float, default=300, help="Seconds to keep chatting")
+    parser.add_argument("--interval", type=float, default=5, help="Seconds between messages per client")
+    parser.add_argument("--sample", type=float, default=10, help="Seconds between memory samples")
+    parser.add_argument("--prefix", default="soak_user_")
+    parser.add_argument("--password", default="soak-password")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,49 @@
+"""Add message history indexes
+
+Revision ID: d1fc21403d02
+Revises: 4c427073e07e
+Create Date: 2026-10-18 17:40:12.512064
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd1fc21403d02'
+down_revision: Union[str, None] = '4c427073e07e'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+INDEXES = [
+    ("ix_private_messages_chat_id_timestamp_id", "private_messages", ["chat_id", "timestamp", "id"]),
+    ("ix_group_messages_group_id_timestamp_id", "group_messages", ["group_id", "timestamp", "id"]),
+]
+
+
+def _existing_indexes():
+    inspector = sa.inspect(op.get_bind())
+    tables = set(inspector.get_table_names())
+    return tables, {
+        index["name"]
+        for table in tables
+        for index in inspector.get_indexes(table)
+    }
+
+
+def upgrade() -> None:
+    # Tables are created by the app on startup, so a fresh database may not have them yet;
+    # create_all() then builds the indexes from the models instead
+    tables, indexes = _existing_indexes()
+    for name, table, columns in INDEXES:
+        if table in tables and name not in indexes:
+            op.create_index(name, table, columns)
+
+
+def downgrade() -> None:
+    tables, indexes = _existing_indexes()
+    for name, table, _ in INDEXES:
+        if name in indexes:
+            op.drop_index(name, table_name=table)
@@ -0,0 +1,70 @@
+"""Normalize private chat pairs and index membership lookups
+
+Revision ID: f469269b678f
+Revises: d1fc21403d02
+Create Date: 2026-10-18 18:05:41.208730
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f469269b678f'
+down_revision: Union[str, None] = 'd1fc21403d02'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+PAIR_INDEX = "uq_private_chats_user1_id_user2_id"
+MEMBERSHIP_INDEX = "ix_group_users_user_id_group_id"
+
+
+def _existing_indexes():
+    inspector = sa.inspect(op.get_bind())
+    tables = set(inspector.get_table_names())
+    return tables, {
+        index["name"]
+        for table in tables
+        for index in inspector.get_indexes(table)
+    }
+
+
+def _normalize_private_chats(bind):
+    # Store every pair as (smaller id, larger id)
+    bind.execute(sa.text(
+        "UPDATE private_chats SET user1_id = user2_id, user2_id = user1_id "
+        "WHERE user1_id > user2_id"
+    ))
+    # Merge chats that now turn out to be the same pair into the oldest one
+    duplicates = bind.execute(sa.text(
+        "SELECT c.id, keeper.id FROM private_chats c "
+        "JOIN (SELECT user1_id, user2_id, MIN(id) AS id FROM private_chats "
+        "      GROUP BY user1_id, user2_id HAVING COUNT(*) > 1) keeper "
+        "ON c.user1_id = keeper.user1_id AND c.user2_id = keeper.user2_id AND c.id != keeper.id"
+    )).fetchall()
+    for duplicate_id, keeper_id in duplicates:
+        bind.execute(sa.text("UPDATE private_messages SET chat_id = :keeper WHERE chat_id = :duplicate"),
+                     {"keeper": keeper_id, "duplicate": duplicate_id})
+        bind.execute(sa.text("DELETE FROM private_chats WHERE id = :duplicate"), {"duplicate": duplicate_id})
+
+
+def upgrade() -> None:
+    # Tables are created by the app on startup, so a fresh database may not have them yet;
+    # create_all() then builds the indexes from the models instead
+    tables, indexes = _existing_indexes()
+    if "private_chats" in tables and PAIR_INDEX not in indexes:
+        _normalize_private_chats(op.get_bind())
+        op.create_index(PAIR_INDEX, "private_chats", ["user1_id", "user2_id"], unique=True)
+    if "group_users" in tables and MEMBERSHIP_INDEX not in indexes:
+        op.create_index(MEMBERSHIP_INDEX, "group_users", ["user_id", "group_id"])
+
+
+def downgrade() -> None:
+    # Pair normalization and merged chats are kept; only the indexes are dropped
+    tables, indexes = _existing_indexes()
+    if MEMBERSHIP_INDEX in indexes:
+        op.drop_index(MEMBERSHIP_INDEX, table_name="group_users")
+    if PAIR_INDEX in indexes:
+        op.drop_index(PAIR_INDEX, table_name="private_chats")
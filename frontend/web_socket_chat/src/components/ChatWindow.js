@@ -41,6 +41,13 @@ function ChatWindow({ currentUser, chatUser }) {
         websocket.onmessage = (event) => {    
             try {
                 const message = JSON.parse(event.data); // Safely parse JSON
+                // Presence and typing updates are not chat messages
+                if (message.type === "presence" || message.type === "typing") return;
+                // Answer the server's heartbeat so an idle tab is not evicted
+                if (message.type === "ping") {
+                    websocket.send(JSON.stringify({ action: "pong" }));
+                    return;
+                }
 
                 // Access values in the parsed object
                 if (message.chat_id) {
@@ -103,6 +103,13 @@ function GroupChatWindow({ currentUser, group }) {
         websocket.onmessage = (event) => {
             try {
                 const message = JSON.parse(event.data);
+                // Presence and typing updates are not chat messages
+                if (message.type === "presence" || message.type === "typing") return;
+                // Answer the server's heartbeat so an idle tab is not evicted
+                if (message.type === "ping") {
+                    websocket.send(JSON.stringify({ action: "pong" }));
+                    return;
+                }
                 if (message.history) {
                     setMessages(message.history);
                 } else {